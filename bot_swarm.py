@@ -0,0 +1,377 @@
+"""
+Headless load generator: N bots join a server and keep moving, then we
+print throughput, MOVE -> POS round trip percentiles and bytes per bot.
+
+    python bot_swarm.py --bots 200 --rate 5 --duration 20
+    python bot_swarm.py --launch "--mode threaded --tick-hz 20" --binary
+    python bot_swarm.py --batch 4      # MOVES lines of 4 steps
+
+Every bot knows the maze (from MAZESEED or the MAZE grid) and only makes
+moves that should succeed, so each MOVE is expected to come back as a POS
+for the bot itself. Round trip = MOVE sent until that POS arrives. Other
+POS for the bot (keyframes, tick frames in the middle of a batch) are older
+than the moves in flight and don't count. A move that never shows up
+within MOVE_TIMEOUT (blocked by a locked door, or a POS frame thrown away
+for a slow client) counts as lost, together with every move predicted on
+top of it, and the bot resyncs to where the server last said it is. With
+--batch the steps of one MOVES line only get a POS for where the last one
+ends.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import deque
+
+import maze_gen
+import protocol
+from pathing import PathField
+
+# MOVE name -> (dx, dy)
+DIRECTIONS = {
+    "UP": (0, -1),
+    "DOWN": (0, 1),
+    "LEFT": (-1, 0),
+    "RIGHT": (1, 0),
+}
+
+# a move without its POS after this long counts as lost
+MOVE_TIMEOUT = 5.0
+
+# how long a bot waits for its last moves after the run is over
+DRAIN_TIME = 1.0
+
+
+class SwarmStats:
+    def __init__(self):
+        self.latencies = []       # seconds, one per confirmed move
+        self.sent = 0
+        self.confirmed = 0
+        self.lost = 0
+        self.bytes_in = []        # per bot
+        self.joined = 0
+        self.failed = 0
+        self.at_exit = 0
+
+
+class Bot:
+    def __init__(self, n, args, stats):
+        self.n = n
+        self.args = args
+        self.stats = stats
+        self.rng = random.Random(args.seed * 100003 + n if args.seed is not None else None)
+
+        self.pid = None
+        self.maze = None
+        self.paths = None
+        self.pos = None           # where we expect to be once every move landed
+        self.server_pos = None    # the last POS the server sent for us
+        self.pending = deque()    # (expected x, expected y, sent at, gets a POS)
+        self.bytes_in = 0
+        self.joined = asyncio.Event()
+        self.reached_exit = False
+
+    async def run(self, stop_at):
+        args = self.args
+        try:
+            reader, writer = await asyncio.open_connection(args.host, args.port)
+        except OSError:
+            self.stats.failed += 1
+            return
+
+        join = "JOIN" + (f" {args.room}" if args.room else "")
+        if args.binary:
+            join += f" BIN {protocol.PROTOCOL_VERSION}"
+        join += " GEN " + ",".join(str(v) for v in maze_gen.supported_versions())
+        writer.write((join + "\n").encode())
+
+        listener = asyncio.create_task(self.listen(reader))
+        try:
+            await asyncio.wait_for(self.joined.wait(), MOVE_TIMEOUT)
+            self.stats.joined += 1
+            await self.move_loop(writer, stop_at)
+            await self.drain()
+            # or the server keeps the bot's player for a RESUME
+            writer.write(b"QUIT\n")
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            self.stats.failed += 1
+        finally:
+            listener.cancel()
+            writer.close()
+            self.stats.bytes_in.append(self.bytes_in)
+            self.stats.lost += len(self.pending)
+            if self.reached_exit:
+                self.stats.at_exit += 1
+
+    async def move_loop(self, writer, stop_at):
+        batch = self.args.batch
+        period = batch / self.args.rate
+        # spread the bots over the first period so they don't move in lockstep
+        await asyncio.sleep(self.rng.random() * period)
+        next_move = time.monotonic()
+        while time.monotonic() < stop_at:
+            self.expire()
+            steps = []
+            sent = time.perf_counter()
+            for _ in range(batch):
+                direction = self.choose()
+                if direction is None:
+                    break
+                dx, dy = DIRECTIONS[direction]
+                x, y = self.pos[0] + dx, self.pos[1] + dy
+                self.pos = (x, y)
+                self.pending.append((x, y, sent, False))
+                steps.append(direction)
+            if steps:
+                x, y, _, _ = self.pending.pop()
+                self.pending.append((x, y, sent, True))
+                self.stats.sent += len(steps)
+                if batch == 1:
+                    writer.write(f"MOVE {steps[0]}\n".encode())
+                else:
+                    writer.write(f"MOVES {' '.join(d[0] for d in steps)}\n".encode())
+                await writer.drain()
+            next_move += period
+            await asyncio.sleep(max(0.0, next_move - time.monotonic()))
+
+    async def drain(self):
+        # give moves still in flight a moment before calling them lost
+        deadline = time.monotonic() + DRAIN_TIME
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    def choose(self):
+        # next move from the predicted position, None = nothing sensible
+        x, y = self.pos
+        if self.args.strategy == "path" and self.paths is not None:
+            step = self.paths.next_step(x, y)
+            if step is not None:
+                return step[0]
+            if self.paths.distance(x, y) == 0:
+                self.reached_exit = True
+        options = [
+            name for name, (dx, dy) in DIRECTIONS.items()
+            if self.maze.in_bounds(x + dx, y + dy) and self.maze.get(x + dx, y + dy) != 1
+        ]
+        return self.rng.choice(options) if options else None
+
+    def expire(self):
+        # the oldest move never showed up (a locked door bounced it, or its
+        # POS was thrown away). every later one was predicted from it, so
+        # they all go, and we start over from where the server last put us
+        if self.pending and time.perf_counter() - self.pending[0][2] > MOVE_TIMEOUT:
+            self.stats.lost += len(self.pending)
+            self.pending.clear()
+            if self.server_pos is not None:
+                self.pos = self.server_pos
+
+    def on_position(self, x, y):
+        # a POS for us: confirm every move up to the one that put us there
+        now = time.perf_counter()
+        self.server_pos = (x, y)
+        for i, (ex, ey, _, last) in enumerate(self.pending):
+            if last and (ex, ey) == (x, y):
+                for _ in range(i + 1):
+                    _, _, sent, _ = self.pending.popleft()
+                    self.stats.latencies.append(now - sent)
+                    self.stats.confirmed += 1
+                return
+        # anything else with moves in flight was sent before they landed
+        # (a keyframe, a tick halfway through a batch), expire() deals with
+        # moves that really bounced
+        if not self.pending:
+            self.pos = (x, y)
+
+    def on_maze(self, maze):
+        self.maze = maze
+        if self.args.strategy == "path":
+            self.paths = PathField(maze)
+
+    def on_tiles(self, tiles):
+        for x, y, v in tiles:
+            if self.maze is not None:
+                self.maze.set(x, y, v)
+        if self.maze is not None and not self.joined.is_set() and self.pos is not None:
+            self.joined.set()
+
+    async def listen(self, reader):
+        frames = protocol.FrameReader()
+        buf = b""
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            self.bytes_in += len(data)
+            if self.args.binary:
+                for msg_type, payload in frames.feed(data):
+                    self.on_frame(msg_type, payload)
+            else:
+                buf += data
+                *lines, buf = buf.split(b"\n")
+                self.on_lines(lines)
+
+    def on_frame(self, msg_type, payload):
+        if msg_type == protocol.MSG_WELCOME:
+            _, self.pid, x, y, _, _ = protocol.decode_welcome(payload)
+            self.pos = (x, y)
+        elif msg_type == protocol.MSG_MAZE_SEED:
+            seed, rows, cols, generator, loops, doors = protocol.decode_maze_seed(payload)
+            self.on_maze(maze_gen.generate(rows, cols, loops, doors, seed, generator)[0])
+        elif msg_type == protocol.MSG_MAZE_Z:
+            self.on_maze(protocol.decode_maze_z(payload))
+        elif msg_type == protocol.MSG_MAZE:
+            self.on_maze(protocol.decode_maze(payload))
+        elif msg_type == protocol.MSG_UPDATE:
+            _, tiles, _, moved = protocol.decode_update(payload)
+            self.on_tiles(tiles)
+            for pid, x, y in moved:
+                if pid == self.pid:
+                    self.on_position(x, y)
+
+    def on_lines(self, lines):
+        tiles = []
+        for raw in lines:
+            line = raw.decode()
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == "WELCOME":
+                self.pid = parts[1]
+            elif parts[0] == "SPAWN":
+                self.pos = (int(parts[1]), int(parts[2]))
+            elif parts[0] == "MAZESEED":
+                seed, rows, cols, generator, loops, doors = protocol.decode_text_maze_seed(line)
+                self.on_maze(maze_gen.generate(rows, cols, loops, doors, seed, generator)[0])
+            elif parts[0] == "MAZE":
+                self.on_maze(protocol.decode_text_maze(line))
+            elif parts[0] == "TILE":
+                tiles.append((int(parts[1]), int(parts[2]), int(parts[3])))
+            elif parts[0] == "POS" and parts[1] == self.pid:
+                self.on_tiles(tiles)
+                tiles = []
+                self.on_position(int(parts[2]), int(parts[3]))
+        self.on_tiles(tiles)
+
+
+def percentile_ms(quantiles, p):
+    return quantiles[p - 1] * 1e3
+
+
+def report(stats, args, elapsed):
+    # --duration 0 moves for no time at all
+    per_second = 1 / elapsed if elapsed > 0 else 0
+    print(f"bots: {args.bots} ({stats.joined} joined, {stats.failed} failed), "
+          f"{args.rate:g} moves/s each in batches of {args.batch}, strategy {args.strategy}, "
+          f"{'binary' if args.binary else 'text'} protocol, {elapsed:.1f}s")
+    print(f"moves: {stats.sent} sent, {stats.confirmed} confirmed, {stats.lost} lost, "
+          f"{stats.confirmed * per_second:.0f} confirmed/s")
+    if len(stats.latencies) >= 2:
+        q = statistics.quantiles(stats.latencies, n=100, method="inclusive")
+        print(f"MOVE->POS: p50 {percentile_ms(q, 50):.2f}ms  p95 {percentile_ms(q, 95):.2f}ms  "
+              f"p99 {percentile_ms(q, 99):.2f}ms  max {max(stats.latencies) * 1e3:.2f}ms")
+    if stats.bytes_in:
+        total = sum(stats.bytes_in)
+        print(f"received: {total / 1e6:.2f}MB total, per bot avg {total / len(stats.bytes_in) / 1e3:.1f}kB "
+              f"max {max(stats.bytes_in) / 1e3:.1f}kB, {total * per_second / 1e6:.2f}MB/s")
+    if args.strategy == "path":
+        print(f"reached the exit: {stats.at_exit}")
+
+
+async def swarm(args):
+    stats = SwarmStats()
+    start = time.monotonic()
+    stop_at = start + args.ramp + args.duration
+    bots = [Bot(n, args, stats) for n in range(args.bots)]
+    tasks = []
+    for bot in bots:
+        tasks.append(asyncio.create_task(bot.run(stop_at)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.bots)
+    await asyncio.gather(*tasks)
+    # rates are per second of moving, the drain at the end doesn't count
+    report(stats, args, min(time.monotonic(), stop_at) - start - args.ramp)
+
+
+# server.py next to this file, so --launch works from any directory
+SERVER_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")
+# how long a --launch server gets to start listening
+LAUNCH_TIMEOUT = 30.0
+
+
+def at_least(value_type, low, strict=False):
+    # argparse type: value_type(text), refusing anything below low (or low itself)
+    def parse(text):
+        value = value_type(text)
+        if value < low or (strict and value == low):
+            raise argparse.ArgumentTypeError(f"must be {'more than' if strict else 'at least'} {low}, got {text}")
+        return value
+    parse.__name__ = value_type.__name__    # argparse says "invalid int value"
+    return parse
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Maze lock bot swarm / load generator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--bots", type=at_least(int, 1), default=50)
+    parser.add_argument("--rate", type=at_least(float, 0, strict=True), default=5.0, help="moves per second per bot")
+    parser.add_argument("--duration", type=at_least(float, 0), default=10.0, help="seconds of moving after the ramp")
+    parser.add_argument("--ramp", type=at_least(float, 0), default=1.0, help="seconds to spread the joins over")
+    parser.add_argument("--batch", type=at_least(int, 1), default=1, help="steps per MOVES line, 1 = plain MOVE")
+    parser.add_argument("--strategy", choices=("random", "path"), default="random")
+    parser.add_argument("--binary", action="store_true", help="use the binary protocol")
+    parser.add_argument("--room", default=None, help="room to join (default: matchmaking)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the bots' choices")
+    parser.add_argument(
+        "--launch",
+        metavar="ARGS",
+        default=None,
+        help="start server.py with these arguments on --port first, stop it afterwards",
+    )
+    return parser.parse_args(argv)
+
+
+def wait_for_server(server, host, port):
+    # until the launched server takes connections, exits if it died or never does
+    deadline = time.monotonic() + LAUNCH_TIMEOUT
+    while True:
+        if server.poll() is not None:
+            sys.exit(f"server.py exited with code {server.returncode}")
+        try:
+            socket.create_connection((host, port), timeout=1.0).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                sys.exit(f"server.py is not listening on {host}:{port} after {LAUNCH_TIMEOUT:g}s")
+            time.sleep(0.05)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = None
+    if args.launch is not None:
+        server = subprocess.Popen(
+            [sys.executable, SERVER_PY, "--port", str(args.port)] + shlex.split(args.launch),
+            stdout=subprocess.DEVNULL,
+        )
+    try:
+        if server is not None:
+            wait_for_server(server, args.host, args.port)
+        asyncio.run(swarm(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -31,10 +31,15 @@ def main():
                     if len(parts) == 4:
                         _, pid_msg, x_str, y_str = parts
                         print(f"Player {pid_msg} at ({x_str}, {y_str})")
+                elif line.startswith("LEAVE"):
+                    parts = line.split()
+                    if len(parts) == 2:
+                        print(f"Player {parts[1]} left")
 
 
             cmd = input("Move (W A S D, or Q to quit): ").strip().upper()
             if cmd == "Q":
+                c.sendall(b"QUIT\n")
                 break
             elif cmd == "W":
                 c.sendall(b"MOVE UP\n")
@@ -1,11 +1,48 @@
 import socket
+import threading
+import time
+from collections import deque
+
 import pygame
 
+import maze_gen
+import protocol
+from maze_view import MazeView, Minimap
+
 HOST = "127.0.0.1"
 PORT = 5001
 
+# bytes per recv() in the reader thread, a whole burst usually fits
+RECV_SIZE = 65536
+
+FPS = 60
+
+# after the connection drops, try to RESUME every RECONNECT_DELAY seconds
+# for RECONNECT_SECONDS (about the server's --resume-grace)
+RECONNECT_DELAY = 1.0
+RECONNECT_SECONDS = 30.0
+
+# key -> (MOVE direction, dx, dy)
+KEYS = {
+    pygame.K_w: ("UP", 0, -1),
+    pygame.K_s: ("DOWN", 0, 1),
+    pygame.K_a: ("LEFT", -1, 0),
+    pygame.K_d: ("RIGHT", 1, 0),
+}
+
+# other players glide from tile to tile over this long, about one
+# update interval; farther jumps than SNAP_DISTANCE tiles aren't animated
+INTERP_SECONDS = 0.1
+SNAP_DISTANCE = 2
+
 WINDOW_SIZE = 790           # square window
 TILE_SIZE = None            # we will compute this after we know maze size
+# tiles never get smaller than this, a bigger maze scrolls with the player
+MIN_TILE_SIZE = 8
+
+# overview in the top right corner when the maze doesn't fit the window
+SHOW_MINIMAP = True
+MINIMAP_SIZE = 160
 
 BACKGROUND_COLOR = (0, 0, 0)
 MY_COLOR = (0, 200, 0)
@@ -15,163 +52,347 @@ EXIT_COLOR = (0, 0, 200)   # blue for the exit
 DOOR_COLOR = (160, 110, 40)   # brown-ish for doors
 HIGHLIGHT_COLOR = (255, 0, 0)   # red tiles from shared doors
 
+# cell value -> color, paths show the background
+TILE_COLORS = {
+    1: WALL_COLOR,
+    2: EXIT_COLOR,
+    3: DOOR_COLOR,
+    4: HIGHLIGHT_COLOR,
+}
+
+
+def decode_frame(msg_type, payload):
+    """
+    (msg_type, decoded) for one frame. Every maze message becomes
+    (MSG_MAZE, Grid), building it from a seed included, so that work
+    happens in the reader thread and not in the frame loop.
+    """
+    if msg_type == protocol.MSG_WELCOME:
+        return msg_type, protocol.decode_welcome(payload)
+    if msg_type == protocol.MSG_MAZE_Z:
+        # the whole maze in one frame
+        return protocol.MSG_MAZE, protocol.decode_maze_z(payload)
+    if msg_type == protocol.MSG_MAZE:
+        return msg_type, protocol.decode_maze(payload)
+    if msg_type == protocol.MSG_MAZE_SEED:
+        # build the maze locally, the changed tiles follow in the UPDATE
+        seed, rows, cols, generator, loops, doors = protocol.decode_maze_seed(payload)
+        maze, _ = maze_gen.generate(rows, cols, loops, doors, seed, generator)
+        return protocol.MSG_MAZE, maze
+    if msg_type == protocol.MSG_UPDATE:
+        return msg_type, protocol.decode_update(payload)
+    if msg_type == protocol.MSG_ACK:
+        return msg_type, protocol.decode_ack(payload)
+    return msg_type, payload
+
+
+def predict(maze, x, y, dx, dy):
+    """
+    Where a move from (x, y) should end up. Only walls and the maze edge
+    block, a door somebody else holds bounces us back when the ACK comes.
+    """
+    nx, ny = x + dx, y + dy
+    if not maze.in_bounds(nx, ny) or maze.get(nx, ny) == 1:
+        return x, y
+    return nx, ny
+
+
+def reconcile(maze, pending, seq, x, y):
+    """
+    The server applied every move up to seq and put us at (x, y): drop
+    those from pending and replay the rest on top. Returns the new
+    predicted position, None for an ACK we already had.
+    """
+    if all(s != seq for s, _, _ in pending):
+        return None
+    while pending.popleft()[0] != seq:
+        pass
+    for _, dx, dy in pending:
+        x, y = predict(maze, x, y, dx, dy)
+    return x, y
+
+
+class Glide:
+    # one remote player sliding from its last shown spot to the newest position
+
+    def __init__(self, x, y, now):
+        self.start = self.end = (x, y)
+        self.started = now
+
+    def at(self, now):
+        t = (now - self.started) / INTERP_SECONDS
+        if t >= 1:
+            return self.end
+        (x0, y0), (x1, y1) = self.start, self.end
+        return (x0 + (x1 - x0) * t, y0 + (y1 - y0) * t)
+
+    def move(self, x, y, now):
+        if (x, y) == self.end:
+            return
+        cx, cy = self.at(now)
+        if abs(x - cx) + abs(y - cy) > SNAP_DISTANCE:
+            cx, cy = x, y
+        self.start, self.end, self.started = (cx, cy), (x, y), now
+
+
+class Link:
+    """
+    The connection to the server. Remembers the session token from
+    WELCOME and the tile version of the last update, so after a drop
+    reconnect() can RESUME: same player, same place, and only the tiles
+    that changed meanwhile instead of the whole maze. The reader thread
+    owns the socket, send() may be called from anywhere and never raises.
+    """
+
+    def __init__(self, host, port, generators):
+        self.host = host
+        self.port = port
+        self.generators = generators
+        self.sock = None
+        self.token = None         # None = the server keeps no session for us
+        self.tile_version = 0
+        self.closed = False
+
+    def connect(self):
+        # ask for the binary protocol (client.py sticks to text) and for
+        # the maze seed instead of the grid when we can build it ourselves
+        sock = socket.create_connection((self.host, self.port))
+        wants = f"BIN {protocol.PROTOCOL_VERSION} GEN {self.generators}"
+        if self.token is None:
+            sock.sendall(f"JOIN {wants}\n".encode())
+        else:
+            sock.sendall(f"RESUME {self.token} {self.tile_version} {wants}\n".encode())
+        self.sock = sock
+
+    def reconnect(self):
+        # True once a RESUME went out, False when the server stayed away
+        deadline = time.monotonic() + RECONNECT_SECONDS
+        while not self.closed and time.monotonic() < deadline:
+            time.sleep(RECONNECT_DELAY)
+            try:
+                self.connect()
+                return True
+            except OSError:
+                pass
+        return False
+
+    def seen(self, msg_type, body, payload):
+        # keep track of what a RESUME has to say
+        if msg_type == protocol.MSG_WELCOME:
+            self.token, self.tile_version = body[4], body[5]
+        elif msg_type == protocol.MSG_UPDATE:
+            version = protocol.decode_tile_version(payload)
+            if version is not None:
+                self.tile_version = version
+
+    def send(self, line):
+        # moves sent while the connection is down are lost, the WELCOME
+        # after the RESUME says where we really are
+        try:
+            self.sock.sendall(line.encode())
+        except OSError:
+            pass
+
+    def close(self):
+        # QUIT first, or the server keeps our player around for a RESUME
+        self.closed = True
+        self.send("QUIT\n")
+        try:
+            # wakes the reader thread up from recv()
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def reader_loop(link, inbox):
+    """
+    Background thread: blocks in recv(), cuts the stream into frames
+    (partial frames wait in the FrameReader for the rest) and appends
+    them decoded to inbox. A dropped connection is resumed if the server
+    gave us a session. None in inbox = connection gone for good.
+    """
+    while True:
+        frames = protocol.FrameReader()
+        try:
+            while True:
+                data = link.sock.recv(RECV_SIZE)
+                if not data:
+                    break
+                for msg_type, payload in frames.feed(data):
+                    msg = decode_frame(msg_type, payload)
+                    link.seen(msg_type, msg[1], payload)
+                    inbox.append(msg)
+        except OSError:
+            pass
+        if link.closed or link.token is None:
+            break
+        print("Connection lost, resuming")
+        if not link.reconnect():
+            break
+    inbox.append(None)
+
 
 def main():
     global TILE_SIZE
 
     # connect to server
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((HOST, PORT))
-    sock.sendall(b"JOIN\n")
-    sock.settimeout(0.01)
+    generators = ",".join(str(v) for v in maze_gen.supported_versions())
+    link = Link(HOST, PORT, generators)
+    link.connect()
+
+    # the frame loop never waits on the network, it drains whatever the
+    # reader thread decoded since the last frame (deque appends are thread safe)
+    inbox = deque()
+    threading.Thread(target=reader_loop, args=(link, inbox), daemon=True).start()
 
-    positions = {}
     my_pid = None
+    me = None                 # where we show ourselves: server position + unacked moves
+    pending = deque()         # (seq, dx, dy) sent, no ACK yet
+    seq = 0
+    others = {}               # pid -> Glide
 
-    maze_rows = []
     maze = None
+    view = None               # MazeView, made once the maze and tile size are known
+    minimap = None
 
     pygame.init()
     screen = pygame.display.set_mode((WINDOW_SIZE, WINDOW_SIZE))
     pygame.display.set_caption("Maze multiplayer")
+    screen.fill(BACKGROUND_COLOR)
+    pygame.display.flip()
     clock = pygame.time.Clock()
 
     running = True
 
     while running:
         # handle input events
-        move_cmd = None
+        full_redraw = False
+        steps = []                # directions pressed this frame
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_w:
-                    move_cmd = b"MOVE UP\n"
-                elif event.key == pygame.K_s:
-                    move_cmd = b"MOVE DOWN\n"
-                elif event.key == pygame.K_a:
-                    move_cmd = b"MOVE LEFT\n"
-                elif event.key == pygame.K_d:
-                    move_cmd = b"MOVE RIGHT\n"
-
-        if move_cmd is not None:
-            sock.sendall(move_cmd)
-
-        # receive messages from server
-        try:
-            data = sock.recv(4096)
-        except socket.timeout:
-            data = b""
-
-        if data:
-            text = data.decode().strip()
-            for line in text.split("\n"):
-                if not line:
-                    continue
-
-                if line.startswith("WELCOME"):
-                    _, my_pid = line.split()
-                    print("My player id:", my_pid)
-
-                elif line.startswith("SPAWN"):
-                    parts = line.split()
-                    if len(parts) == 3 and my_pid is not None:
-                        x = int(parts[1])
-                        y = int(parts[2])
-                        positions[my_pid] = (x, y)
-
-                elif line.startswith("TILE"):
-                    parts = line.split()
-                    if len(parts) == 4 and maze is not None:
-                        x = int(parts[1])
-                        y = int(parts[2])
-                        v = int(parts[3])
-                        if 0 <= y < len(maze) and 0 <= x < len(maze[0]):
-                            maze[y][x] = v
-
-                elif line.startswith("MAZEROW"):
-                    parts = line.split(maxsplit=1)
-                    if len(parts) == 2:
-                        row_str = parts[1]
-                        maze_rows.append([int(ch) for ch in row_str])
-                        # update maze as rows arrive
-                        maze = maze_rows
-
-                elif line.startswith("POS"):
-                    parts = line.split()
-                    if len(parts) == 4:
-                        _, pid_msg, x_str, y_str = parts
-                        positions[pid_msg] = (int(x_str), int(y_str))
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                # the window was covered or restored, paint everything again
+                full_redraw = True
+            elif event.type == pygame.KEYDOWN and event.key in KEYS and maze is not None and me is not None:
+                # move right away, the server's ACK confirms or corrects it
+                direction, dx, dy = KEYS[event.key]
+                moved = predict(maze, me[0], me[1], dx, dy)
+                if moved == me:
+                    continue   # a wall, the server would say the same
+                seq = (seq + 1) % protocol.SEQ_LIMIT
+                pending.append((seq, dx, dy))
+                me = moved
+                steps.append(direction)
+
+        if len(steps) == 1:
+            link.send(f"MOVE {steps[0]} {seq}\n")
+        elif steps:
+            # one line for the whole burst, applied under one lock
+            link.send(f"MOVES {' '.join(d[0] for d in steps)} {seq}\n")
+
+        # everything that arrived since the last frame
+        now = time.perf_counter()
+        while inbox:
+            msg = inbox.popleft()
+            if msg is None:
+                print("Server closed connection")
+                running = False
+                break
+            msg_type, body = msg
+
+            if msg_type == protocol.MSG_WELCOME:
+                # also after a RESUME: the maze we have stays, unless a
+                # new one follows because the session ran out
+                _, my_pid, x, y, _, _ = body
+                me = (x, y)
+                pending.clear()
+                print("My player id:", my_pid)
+
+            elif msg_type == protocol.MSG_ACK:
+                seq_acked, x, y = body
+                if maze is not None:
+                    me = reconcile(maze, pending, seq_acked, x, y) or me
+
+            elif msg_type == protocol.MSG_MAZE:
+                maze = body
+                view = TILE_SIZE = None
+
+            elif msg_type == protocol.MSG_UPDATE:
+                keyframe, tiles, gone, moved = body
+
+                for x, y, v in tiles:
+                    if maze is not None and maze.in_bounds(x, y):
+                        maze.set(x, y, v)
+                        if view is not None:
+                            view.tile_changed(x, y)
+
+                if keyframe:
+                    # full position dump, forget everyone not in it
+                    listed = {pid_msg for pid_msg, _, _ in moved}
+                    for pid_msg in list(others):
+                        if pid_msg not in listed:
+                            del others[pid_msg]
+                for pid_msg in gone:
+                    others.pop(pid_msg, None)
+                for pid_msg, x, y in moved:
+                    if pid_msg == my_pid:
+                        # our own moves are answered by ACK, a POS only
+                        # counts when we're not waiting for any
+                        if not pending:
+                            me = (x, y)
+                    elif pid_msg in others:
+                        others[pid_msg].move(x, y, now)
+                    else:
+                        others[pid_msg] = Glide(x, y, now)
 
         # if we have the maze and tile size is not set yet, compute it
         if maze is not None and TILE_SIZE is None:
-            rows = len(maze)
-            cols = len(maze[0])
+            rows = maze.rows
+            cols = maze.cols
             TILE_SIZE = min(WINDOW_SIZE // cols, WINDOW_SIZE // rows)
-            # just to be safe, make it at least 6 pixels
-            TILE_SIZE = max(TILE_SIZE, 6)
+            # readable tiles even on huge mazes, the camera scrolls instead
+            TILE_SIZE = max(TILE_SIZE, MIN_TILE_SIZE)
             print("Maze size:", rows, "x", cols, "Tile:", TILE_SIZE)
 
-        screen.fill(BACKGROUND_COLOR)
-
-        # draw maze tiles
-        if maze is not None and TILE_SIZE is not None:
-            rows = len(maze)
-            cols = len(maze[0])
-
-            for y in range(rows):
-                for x in range(cols):
-                    cell = maze[y][x]
-                    if cell == 1:   # wall
-                        rect = pygame.Rect(
-                            x * TILE_SIZE,
-                            y * TILE_SIZE,
-                            TILE_SIZE,
-                            TILE_SIZE,
-                        )
-                        pygame.draw.rect(screen, WALL_COLOR, rect)
-                    elif cell == 2:  # exit
-                        rect = pygame.Rect(
-                            x * TILE_SIZE,
-                            y * TILE_SIZE,
-                            TILE_SIZE,
-                            TILE_SIZE,
-                        )
-                        pygame.draw.rect(screen, EXIT_COLOR, rect)
-                    elif cell == 3:  # door
-                        rect = pygame.Rect(
-                            x * TILE_SIZE,
-                            y * TILE_SIZE,
-                            TILE_SIZE,
-                            TILE_SIZE,
-                        )
-                        pygame.draw.rect(screen, DOOR_COLOR, rect)
-                    elif cell == 4:  # highlight from shared door
-                        rect = pygame.Rect(
-                            x * TILE_SIZE,
-                            y * TILE_SIZE,
-                            TILE_SIZE,
-                            TILE_SIZE,
-                        )
-                        pygame.draw.rect(screen, HIGHLIGHT_COLOR, rect)
-
-        # draw players
-        if TILE_SIZE is not None:
-            for pid, (x, y) in positions.items():
-                color = MY_COLOR if pid == my_pid else OTHER_COLOR
-                rect = pygame.Rect(
-                    x * TILE_SIZE,
-                    y * TILE_SIZE,
-                    TILE_SIZE,
-                    TILE_SIZE,
+        if maze is not None and view is None:
+            # only the part of the maze in the window is ever drawn
+            view = MazeView(
+                maze, TILE_SIZE, TILE_COLORS, BACKGROUND_COLOR,
+                size=(WINDOW_SIZE, WINDOW_SIZE),
+            )
+            minimap = None
+            if SHOW_MINIMAP and view.max_camera != (0, 0):
+                minimap = Minimap(
+                    maze, MINIMAP_SIZE, (WINDOW_SIZE - MINIMAP_SIZE - 10, 10),
+                    wall=WALL_COLOR, path=BACKGROUND_COLOR, exit=EXIT_COLOR,
                 )
-                pygame.draw.rect(screen, color, rect)
+            full_redraw = True
+
+        if view is not None:
+            if full_redraw:
+                screen.fill(BACKGROUND_COLOR)
+                view.invalidate()
+            sprites = {glide.at(now): OTHER_COLOR for glide in others.values()}
+            if me is not None:
+                sprites.pop(me, None)
+                sprites[me] = MY_COLOR   # on top of anyone on the same tile
+                view.look_at(*me)
+            dirty = view.draw(screen, sprites)
+            if minimap is not None:
+                # drawn over the maze, so again whenever the maze under it changed
+                covered = minimap.rect.collidelist(dirty) >= 0
+                dirty += minimap.draw(screen, sprites, view, force=covered)
+            if full_redraw:
+                pygame.display.flip()
+            elif dirty:
+                pygame.display.update(dirty)
 
-        pygame.display.flip()
-        clock.tick(30)
+        clock.tick(FPS)
 
-    sock.close()
+    link.close()
     pygame.quit()
 
 
@@ -0,0 +1,212 @@
+import asyncio
+import socket
+import threading
+from collections import deque
+
+import metrics
+
+# what to do when a client stops reading and its queue fills up
+#   drop       - throw away new POS frames while the queue is full
+#   coalesce   - throw away every queued POS frame as well, freeing the
+#                whole queue at once
+#   disconnect - kick the client as soon as the queue is full
+# after drop/coalesce the client gets one full keyframe once it catches up
+SLOW_POLICIES = ("drop", "coalesce", "disconnect")
+
+DEFAULT_MAX_FRAMES = 256
+
+# frames that can't be dropped (tiles, welcome, maze) may use this many
+# times max_frames before even drop/coalesce gives up on the client
+HARD_LIMIT_FACTOR = 4
+
+MESSAGES_OUT = metrics.counter(
+    "maze_messages_out_total", "frames queued for clients, by kind", "kind")
+BYTES_SENT = metrics.counter("maze_bytes_sent_total", "bytes written to client sockets")
+DROPPED = metrics.counter(
+    "maze_dropped_frames_total", "POS frames thrown away for slow clients")
+
+
+class ClientConn:
+    """
+    One connected client with its own bounded outbound queue.
+
+    Game code calls send(), which only appends to the queue and never
+    touches the socket. A writer (thread or asyncio task) drains the queue
+    in the background, so a client with a full receive window can only
+    hurt itself.
+    """
+
+    def __init__(self, addr, policy="drop", max_frames=DEFAULT_MAX_FRAMES):
+        if policy not in SLOW_POLICIES:
+            raise ValueError(f"unknown slow client policy {policy!r}")
+        self.addr = addr
+        self.policy = policy
+        self.max_frames = max_frames
+
+        # protocol version picked at JOIN, 0 = text lines
+        self.version = 0
+        # the Room this client joined and its player id there,
+        # None before JOIN / after leaving
+        self.room = None
+        self.pid = None
+        # session token a RESUME can take this player back with, None = none
+        self.session = None
+
+        self.frames = deque()          # (kind, bytes)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.wake = None               # set by the asyncio writer
+        # set by the writer, tears the transport down so a writer stuck
+        # in sendall() / drain() on a client that never reads gets out
+        self.abort = None
+
+        # set when POS frames were thrown away. once the writer has
+        # emptied the queue it calls on_resync(conn) so the server can
+        # send a full keyframe
+        self.resync = False
+        self.on_resync = None
+        self.dropped_frames = 0
+
+    def send(self, data, kind="DATA"):
+        """
+        Queue a frame for this client. kind "POS" marks frames that only
+        carry positions and may be dropped when the client falls behind,
+        any other kind is only a name for the metrics.
+        Raises OSError if the connection is closed or got evicted.
+        """
+        with self.cond:
+            if self.closed:
+                raise OSError("connection closed")
+
+            if len(self.frames) >= self.max_frames:
+                if not self._make_room(kind):
+                    return
+            evicted = self.closed
+            if not evicted:
+                self.frames.append((kind, data))
+                self.cond.notify()
+        if evicted:
+            self._abort()
+            raise OSError("client too slow, disconnected")
+        MESSAGES_OUT.inc(kind)
+
+        if self.wake is not None:
+            self.wake()
+
+    def _make_room(self, kind):
+        # queue is full, apply the slow client policy. caller holds cond.
+        # returns False if the new frame should be discarded
+        if self.policy == "disconnect":
+            self._close_locked()
+            return True
+
+        if kind == "POS":
+            dropped = 1
+            self.resync = True
+            if self.policy == "coalesce":
+                kept = deque(f for f in self.frames if f[0] != "POS")
+                dropped += len(self.frames) - len(kept)
+                self.frames = kept
+            self.dropped_frames += dropped
+            DROPPED.inc(n=dropped)
+            return False
+
+        if len(self.frames) >= self.max_frames * HARD_LIMIT_FACTOR:
+            self._close_locked()
+        return True
+
+    def take_all(self, wait=False):
+        """
+        Pop every queued frame and return them joined as one bytes object.
+        With wait=True block until there is something to send.
+        Returns None once the connection is closed.
+        """
+        with self.cond:
+            while wait and not self.frames and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return None
+            data = b"".join(frame for _, frame in self.frames)
+            self.frames.clear()
+            return data
+
+    def queued(self):
+        return len(self.frames)
+
+    def caught_up(self):
+        # writer emptied the queue, send the keyframe we owe the client
+        if self.resync and self.on_resync is not None:
+            self.resync = False
+            self.on_resync(self)
+
+    def _close_locked(self):
+        self.closed = True
+        self.frames.clear()
+        self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self._close_locked()
+        if self.wake is not None:
+            self.wake()
+        self._abort()
+
+    def _abort(self):
+        if self.abort is not None:
+            try:
+                self.abort()
+            except OSError:
+                pass
+
+
+def writer_loop(conn, sock):
+    # threaded server: drain the queue with blocking sendall,
+    # outside of any game lock
+    conn.abort = lambda: sock.shutdown(socket.SHUT_RDWR)
+    try:
+        while True:
+            data = conn.take_all(wait=True)
+            if data is None:
+                break
+            sock.sendall(data)
+            BYTES_SENT.inc(n=len(data))
+            conn.caught_up()
+    except OSError:
+        pass
+    finally:
+        conn.close()
+        try:
+            # wakes up the reader thread blocked in recv()
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+
+async def writer_task(conn, writer):
+    # asyncio server: drain the queue into the transport, drain() waits
+    # while the kernel buffer is full so the queue policy kicks in
+    ready = asyncio.Event()
+    conn.wake = ready.set
+    conn.abort = writer.transport.abort
+    ready.set()   # pick up anything queued before we got here
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            data = conn.take_all()
+            if data is None:
+                break
+            if data:
+                writer.write(data)
+                await writer.drain()
+                BYTES_SENT.inc(n=len(data))
+            conn.caught_up()
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        conn.close()
+        writer.close()
@@ -0,0 +1,68 @@
+try:
+    import numpy as np
+except ImportError:   # numpy is optional, only needed for as_numpy()
+    np = None
+
+
+class Grid:
+    """
+    Maze cells in one contiguous bytearray, row-major, one byte per cell.
+
+    0 = path, 1 = wall, 2 = exit, 3 = door, 4 = red highlight
+    """
+
+    def __init__(self, rows, cols, fill=0, data=None):
+        self.rows = rows
+        self.cols = cols
+        if data is None:
+            data = bytearray([fill]) * (rows * cols)
+        elif len(data) != rows * cols:
+            raise ValueError(f"expected {rows * cols} cells, got {len(data)}")
+        self.data = bytearray(data) if not isinstance(data, bytearray) else data
+
+    @classmethod
+    def from_rows(cls, rows):
+        # from a list of lists, mostly for old code and tests
+        cols = len(rows[0]) if rows else 0
+        data = bytearray()
+        for row in rows:
+            data.extend(row)
+        return cls(len(rows), cols, data=data)
+
+    def get(self, x, y):
+        return self.data[y * self.cols + x]
+
+    def set(self, x, y, value):
+        self.data[y * self.cols + x] = value
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.cols and 0 <= y < self.rows
+
+    def row(self, y):
+        # zero-copy view of one row
+        start = y * self.cols
+        return memoryview(self.data)[start:start + self.cols]
+
+    def view(self):
+        # zero-copy view of every cell, row by row
+        return memoryview(self.data)
+
+    def copy(self):
+        return Grid(self.rows, self.cols, data=bytearray(self.data))
+
+    def to_rows(self):
+        return [list(self.row(y)) for y in range(self.rows)]
+
+    def as_numpy(self):
+        # (rows, cols) uint8 array sharing memory with the grid
+        if np is None:
+            raise ImportError("numpy is not installed")
+        return np.frombuffer(self.data, dtype=np.uint8).reshape(self.rows, self.cols)
+
+    def __eq__(self, other):
+        if not isinstance(other, Grid):
+            return NotImplemented
+        return (self.rows, self.cols, self.data) == (other.rows, other.cols, other.data)
+
+    def __repr__(self):
+        return f"Grid({self.rows}x{self.cols})"
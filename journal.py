@@ -0,0 +1,216 @@
+"""
+Append-only binary journal of one room: who joined and left, every move
+with the time the game used for it and where it ended, and the tile
+changes that came out of it. replay.py feeds a journal back into a
+GameState to reproduce a match or to benchmark the game logic on real
+traffic.
+
+The game thread only packs a record into a buffer (under the room's
+lock, a few hundred ns); a writer thread per journal flushes the buffer
+to the file every FLUSH_INTERVAL seconds or once FLUSH_BYTES piled up.
+
+File: MAGIC, then records of a type byte and a struct, times are the
+game's wall clock (time.time()) as doubles:
+
+    START  !dHHQBHI  t, rows, cols, seed, generator, loops, doors
+    ROOM   !dH       t, name length, then the room's name in utf-8 (after START)
+    JOIN   !dI       t, player number
+    LEAVE  !dI       t, player number
+    MOVE   !dIbbHH   t, player, dx, dy, x, y after the move (move_player)
+    BATCH  !dI       t, #moves, then #moves times
+                     !IbbHH player, dx, dy, x, y   (apply_moves)
+    DOORS  !d        t, the door timer cleared doors (expire_doors)
+    TILES  !dI       t, #tiles, then #tiles times !I (x << 18 | y << 4 | value),
+                     the changes of the record before
+
+MZJ1 journals, from before the counts were widened, had !dH for BATCH
+and TILES, read() still takes them.
+"""
+import atexit
+import struct
+import threading
+
+import metrics
+import protocol
+
+MAGIC = b"MZJ2"
+MAGIC_V1 = b"MZJ1"
+
+START = 1
+JOIN = 2
+LEAVE = 3
+MOVE = 4
+BATCH = 5
+DOORS = 6
+TILES = 7
+ROOM = 8
+
+RECORDS = {
+    START: struct.Struct("!dHHQBHI"),
+    JOIN: struct.Struct("!dI"),
+    LEAVE: struct.Struct("!dI"),
+    MOVE: struct.Struct("!dIbbHH"),
+    BATCH: struct.Struct("!dI"),
+    DOORS: struct.Struct("!d"),
+    TILES: struct.Struct("!dI"),
+    ROOM: struct.Struct("!dH"),
+}
+RECORDS_V1 = {**RECORDS, BATCH: struct.Struct("!dH"), TILES: struct.Struct("!dH")}
+STEP = struct.Struct("!IbbHH")
+TILE = protocol.TILE
+
+FLUSH_INTERVAL = 1.0
+FLUSH_BYTES = 1 << 16
+
+JOURNAL_BYTES = metrics.counter("maze_journal_bytes_total", "bytes written to room journals")
+
+
+class Journal:
+    def __init__(self, path, room=None):
+        # room: the room's name as clients know it, file names only get a slug
+        self.path = path
+        self.room = room
+        self.file = open(path, "wb")
+        self.buf = bytearray(MAGIC)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        # whatever is still buffered when the server exits
+        atexit.register(self.close)
+
+    def _add(self, kind, *fields):
+        with self.cond:
+            self.buf.append(kind)
+            self.buf += RECORDS[kind].pack(*fields)
+            if len(self.buf) >= FLUSH_BYTES:
+                self.cond.notify()
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closed or len(self.buf) >= FLUSH_BYTES, FLUSH_INTERVAL)
+                data, self.buf = self.buf, bytearray()
+                closed = self.closed
+            if data:
+                self.file.write(data)
+                self.file.flush()
+                JOURNAL_BYTES.inc(n=len(data))
+            if closed:
+                self.file.close()
+                return
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        self.writer.join()
+        atexit.unregister(self.close)
+
+    # ---- records, called with the room's lock held --------------------
+
+    def start(self, now, rows, cols, origin):
+        seed, generator, loops, doors = origin
+        self._add(START, now, rows, cols, seed, generator, loops, doors)
+        if self.room is not None:
+            name = self.room.encode()[:0xFFFF]
+            with self.cond:
+                self.buf.append(ROOM)
+                self.buf += RECORDS[ROOM].pack(now, len(name)) + name
+
+    def join(self, now, pid):
+        self._add(JOIN, now, protocol.pid_to_int(pid))
+
+    def leave(self, now, pid):
+        self._add(LEAVE, now, protocol.pid_to_int(pid))
+
+    def move(self, now, pid, dx, dy, x, y):
+        self._add(MOVE, now, protocol.pid_to_int(pid), dx, dy, x, y)
+
+    def batch(self, now, steps):
+        # steps: (pid, dx, dy, x, y) in the order they were applied
+        data = b"".join(STEP.pack(protocol.pid_to_int(pid), dx, dy, x, y) for pid, dx, dy, x, y in steps)
+        with self.cond:
+            self.buf.append(BATCH)
+            self.buf += RECORDS[BATCH].pack(now, len(steps)) + data
+
+    def doors(self, now):
+        self._add(DOORS, now)
+
+    def tiles(self, now, tile_updates):
+        if not tile_updates:
+            return
+        data = b"".join(TILE.pack((x << 18) | (y << 4) | v) for x, y, v in tile_updates)
+        with self.cond:
+            self.buf.append(TILES)
+            self.buf += RECORDS[TILES].pack(now, len(tile_updates)) + data
+
+
+def read(path):
+    """
+    Yield (kind, t, fields) for every record in the journal at path.
+    fields: START (rows, cols, (seed, generator, loops, doors)),
+    JOIN / LEAVE (pid,), MOVE (pid, dx, dy, x, y), BATCH ([(pid, dx, dy,
+    x, y), ...],), DOORS (), TILES ([(x, y, value), ...],), ROOM (name,).
+    A record cut off at the end (the server died mid flush) is ignored.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(MAGIC):
+        records = RECORDS
+    elif data.startswith(MAGIC_V1):
+        records = RECORDS_V1
+    else:
+        raise ValueError(f"{path} is not a maze journal")
+    pos = len(MAGIC)
+    end = len(data)
+    while pos < end:
+        kind = data[pos]
+        record = records.get(kind)
+        if record is None:
+            raise ValueError(f"unknown journal record {kind} at byte {pos}")
+        pos += 1
+        if pos + record.size > end:
+            return
+        t, *fields = record.unpack_from(data, pos)
+        pos += record.size
+
+        if kind == START:
+            rows, cols, seed, generator, loops, doors = fields
+            yield kind, t, (rows, cols, (seed, generator, loops, doors))
+        elif kind in (JOIN, LEAVE):
+            yield kind, t, (protocol.int_to_pid(fields[0]),)
+        elif kind == MOVE:
+            num, dx, dy, x, y = fields
+            yield kind, t, (protocol.int_to_pid(num), dx, dy, x, y)
+        elif kind == BATCH:
+            (count,) = fields
+            if pos + count * STEP.size > end:
+                return
+            steps = [
+                (protocol.int_to_pid(num), dx, dy, x, y)
+                for num, dx, dy, x, y in STEP.iter_unpack(data[pos:pos + count * STEP.size])
+            ]
+            pos += count * STEP.size
+            yield kind, t, (steps,)
+        elif kind == TILES:
+            (count,) = fields
+            if pos + count * TILE.size > end:
+                return
+            tiles = [
+                (packed >> 18, (packed >> 4) & protocol.MAX_COORD, packed & 0xF)
+                for (packed,) in TILE.iter_unpack(data[pos:pos + count * TILE.size])
+            ]
+            pos += count * TILE.size
+            yield kind, t, (tiles,)
+        elif kind == ROOM:
+            (length,) = fields
+            if pos + length > end:
+                return
+            name = data[pos:pos + length].decode(errors="replace")
+            pos += length
+            yield kind, t, (name,)
+        else:
+            yield kind, t, ()
@@ -1,15 +1,21 @@
 import pygame
 import sys
-import random
 import time
 
-pygame.init()
+import maze_gen
+from maze_pool import MazePool
+from maze_view import MazeView, Minimap
 
 # Tile setup
 TILE_SIZE = 20
 TOP_MARGIN = 40    # Space for timer
 BOTTOM_MARGIN = 30 # Space for restart instructions
 
+# Biggest maze area in the window, larger mazes scroll with the player
+MAX_VIEW_WIDTH = 1200
+MAX_VIEW_HEIGHT = 800
+MINIMAP_SIZE = 160
+
 # Colors
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -19,6 +25,12 @@ GREEN = (0, 255, 0)
 RED = (255, 0, 0)
 YELLOW = (255, 255, 0)
 
+# Maze colors, every other cell (paths, doors) is white
+MAZE_COLORS = {
+    1: GRAY,
+    2: GREEN,
+}
+
 # Player colors for multiple players
 PLAYER_COLORS = {
     "me": BLUE,
@@ -27,9 +39,9 @@ PLAYER_COLORS = {
     "p4": (0, 255, 255),  # cyan
 }
 
-# Fonts
-font = pygame.font.SysFont("Arial", 48)        # Safe font for win message
-small_font = pygame.font.SysFont("Arial", 20)  # Timer, buttons, instructions
+# Fonts, created in init_display()
+font = None        # Safe font for win message
+small_font = None  # Timer, buttons, instructions
 
 # Difficulty settings (ROWS, COLS)
 DIFFICULTY_SIZES = {
@@ -41,49 +53,39 @@ DIFFICULTY_SIZES = {
 # Menu window size
 MENU_WIDTH = 640
 MENU_HEIGHT = 480
-screen = pygame.display.set_mode((MENU_WIDTH, MENU_HEIGHT))
+screen = None
+
+# Ready-made mazes per difficulty, built by worker processes so pressing R
+# never generates in the frame loop
+MAZE_POOL_DEPTH = 3      # mazes kept ready per difficulty
+MAZE_POOL_WORKERS = 1
+MAZE_POOL_RATE = 0       # mazes started per second, 0 = no limit
+
+# pygame setup lives here and not at import time: maze pool workers
+# import this module too and must not open windows
+def init_display():
+    global font, small_font, screen
+    pygame.init()
+    font = pygame.font.SysFont("Arial", 48)
+    small_font = pygame.font.SysFont("Arial", 20)
+    screen = pygame.display.set_mode((MENU_WIDTH, MENU_HEIGHT))
 
 # Maze generation
 def generate_maze(rows, cols):
-    maze = [[1 for _ in range(cols)] for _ in range(rows)]
-
-    def carve(x, y):
-        directions = [(2, 0), (-2, 0), (0, 2), (0, -2)]
-        random.shuffle(directions)
-        for dx, dy in directions:
-            nx, ny = x + dx, y + dy
-            if 1 <= nx < cols-1 and 1 <= ny < rows-1 and maze[ny][nx] == 1:
-                maze[y + dy//2][x + dx//2] = 0
-                maze[ny][nx] = 0
-                carve(nx, ny)
-
-    maze[1][1] = 0
-    carve(1, 1)
-
-    # Set exit
-    for ey in range(rows-2, 0, -1):
-        for ex in range(cols-2, 0, -1):
-            if maze[ey][ex] == 0:
-                maze[ey][ex] = 2
-                return maze
-    maze[rows-2][cols-2] = 2
+    maze, _ = maze_gen.generate(rows, cols)
     return maze
 
-# Draw maze with margins (no players here)
-def draw_maze(maze):
-    for y, row in enumerate(maze):
-        for x, cell in enumerate(row):
-            if cell == 1:
-                color = GRAY
-            elif cell == 2:
-                color = GREEN
-            else:
-                color = WHITE
-            pygame.draw.rect(
-                screen,
-                color,
-                (x * TILE_SIZE, y * TILE_SIZE + TOP_MARGIN, TILE_SIZE, TILE_SIZE)
-            )
+# Maze view below the timer bar, plus a minimap if the maze doesn't fit
+def make_view(maze):
+    size = (min(maze.cols * TILE_SIZE, MAX_VIEW_WIDTH), min(maze.rows * TILE_SIZE, MAX_VIEW_HEIGHT))
+    view = MazeView(maze, TILE_SIZE, MAZE_COLORS, WHITE, (0, TOP_MARGIN), size)
+    minimap = None
+    if view.max_camera != (0, 0):
+        minimap = Minimap(
+            maze, MINIMAP_SIZE, (size[0] - MINIMAP_SIZE - 10, TOP_MARGIN + 10),
+            wall=GRAY, path=WHITE, frame=YELLOW, exit=GREEN,
+        )
+    return view, minimap
 
 # Display message
 def show_message(text, color=RED):
@@ -132,37 +134,43 @@ def show_menu():
 
 # Local game state for the client
 class LocalGameState:
-    def __init__(self, rows, cols):
+    def __init__(self, rows, cols, maze=None):
         self.rows = rows
         self.cols = cols
-        self.maze = generate_maze(rows, cols)
+        self.maze = maze if maze is not None else generate_maze(rows, cols)
         self.players = {}  # player_id -> [x, y]
 
     def set_player(self, player_id, x, y):
         self.players[player_id] = [x, y]
 
-# Draw the whole world (maze + all players + UI)
-def draw_world(screen, state, my_id, start_time, height):
-    # 1) draw maze
-    draw_maze(state.maze)
-
-    # 2) draw every player
-    for pid, (x, y) in state.players.items():
-        color = PLAYER_COLORS.get(pid, BLUE)
-        pygame.draw.rect(
-            screen,
-            color,
-            (x * TILE_SIZE, y * TILE_SIZE + TOP_MARGIN, TILE_SIZE, TILE_SIZE)
-        )
-
-    # 3) timer at top-left
+# Draw the whole world (maze + all players + UI), returns the changed rects
+def draw_world(screen, view, minimap, state, my_id, start_time, height):
+    width = screen.get_width()
+
+    # 1) + 2) maze and every player, only what changed since the last frame
+    players = {tuple(pos): PLAYER_COLORS.get(pid, BLUE) for pid, pos in state.players.items()}
+    view.look_at(*state.players[my_id])
+    full = view.full
+    dirty = view.draw(screen, players)
+    if minimap is not None:
+        dirty += minimap.draw(screen, players, view, force=minimap.rect.collidelist(dirty) >= 0)
+
+    # 3) timer at top-left, changes every frame
+    bar = pygame.Rect(0, 0, width, TOP_MARGIN)
+    screen.fill(BLACK, bar)
     elapsed_time = time.time() - start_time
     timer_text = small_font.render(f"Timer: {elapsed_time:.2f}s", True, WHITE)
     screen.blit(timer_text, (10, 10))
+    dirty.append(bar)
 
-    # 4) restart instructions at bottom
-    restart_text = small_font.render("Press R to restart maze", True, WHITE)
-    screen.blit(restart_text, (10, height - 25))
+    # 4) restart instructions at bottom, only after a full redraw
+    if full:
+        bottom = pygame.Rect(0, height - BOTTOM_MARGIN, width, BOTTOM_MARGIN)
+        screen.fill(BLACK, bottom)
+        restart_text = small_font.render("Press R to restart maze", True, WHITE)
+        screen.blit(restart_text, (10, height - 25))
+        dirty.append(bottom)
+    return dirty
 
 # Update player position from input (local for now)
 def handle_input(local_state, my_id):
@@ -185,24 +193,32 @@ def handle_input(local_state, my_id):
         # bounds check
         if 0 <= new_x < local_state.cols and 0 <= new_y < local_state.rows:
             # wall check (1 = wall)
-            if local_state.maze[new_y][new_x] != 1:
+            if local_state.maze.get(new_x, new_y) != 1:
                 local_state.players[my_id] = [new_x, new_y]
 
 # Main game
 def main():
     global screen
 
+    init_display()
+
+    # start filling the maze queues while the menu is up
+    pool = MazePool(MAZE_POOL_DEPTH, MAZE_POOL_WORKERS, MAZE_POOL_RATE)
+    for rows, cols in DIFFICULTY_SIZES.values():
+        pool.add(rows, cols)
+
     # Select difficulty
     difficulty = show_menu()
     ROWS, COLS = DIFFICULTY_SIZES[difficulty]
 
-    # Adjust window size dynamically
-    WIDTH = COLS * TILE_SIZE
-    HEIGHT = ROWS * TILE_SIZE + TOP_MARGIN + BOTTOM_MARGIN
+    # Adjust window size dynamically, up to the biggest view
+    WIDTH = min(COLS * TILE_SIZE, MAX_VIEW_WIDTH)
+    HEIGHT = min(ROWS * TILE_SIZE, MAX_VIEW_HEIGHT) + TOP_MARGIN + BOTTOM_MARGIN
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
 
     # Create local game state
-    state = LocalGameState(ROWS, COLS)
+    state = LocalGameState(ROWS, COLS, pool.take(ROWS, COLS)[0])
+    view, minimap = make_view(state.maze)
     my_id = "me"
     state.set_player(my_id, 1, 1)
 
@@ -215,39 +231,42 @@ def main():
     start_time = time.time()
 
     while running:
-        screen.fill(BLACK)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
-
-        keys = pygame.key.get_pressed()
-
-        # Restart maze
-        if keys[pygame.K_r]:
-            state = LocalGameState(ROWS, COLS)
-            state.set_player(my_id, 1, 1)
-            state.set_player("p2", 3, 1)
-            won = False
-            start_time = time.time()
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                view.invalidate()
+
+            # Restart maze, one new maze per key press
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_r:
+                state = LocalGameState(ROWS, COLS, pool.take(ROWS, COLS)[0])
+                view, minimap = make_view(state.maze)
+                state.set_player(my_id, 1, 1)
+                state.set_player("p2", 3, 1)
+                won = False
+                start_time = time.time()
 
         # Handle movement (for now: local only)
         handle_input(state, my_id)
 
         # Win check (only for my player)
         x, y = state.players[my_id]
-        if state.maze[y][x] == 2 and not won:
+        if state.maze.get(x, y) == 2 and not won:
             elapsed = time.time() - start_time
-            draw_maze(state.maze)
+            draw_world(screen, view, minimap, state, my_id, start_time, HEIGHT)
             pygame.display.flip()
             show_message(f"You Win! Time: {elapsed:.2f}s", GREEN)
+            # the message covers part of the maze, paint it all again
+            view.invalidate()
             won = True
 
         # Draw everything via draw_world
-        draw_world(screen, state, my_id, start_time, HEIGHT)
+        dirty = draw_world(screen, view, minimap, state, my_id, start_time, HEIGHT)
 
-        pygame.display.flip()
+        pygame.display.update(dirty)
         clock.tick(15)
 
+    pool.close()
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,378 @@
+"""
+Maze generation shared by the server and the local game.
+
+The maze is carved a row at a time: Eller's algorithm only keeps set labels
+for the current row, and with numpy installed huge mazes use a vectorized
+sidewinder that carves a block of rows per step. Loops and doors are picked
+in the same pass from a window trailing a couple of rows behind the carver,
+with reservoir sampling, so nothing but the picks is remembered next to
+the output Grid.
+
+Every maze comes from an explicit seed and a generator version, and the
+same (seed, rows, cols, version, loops, doors) always gives the same maze,
+on any machine, so the server can send those instead of the grid.
+
+0 = path, 1 = wall, 2 = exit, 3 = door
+"""
+import random
+
+try:
+    import numpy as np
+except ImportError:   # numpy is optional, only used for huge mazes
+    np = None
+
+from grid import Grid
+
+# generator version -> algorithm. A version pins the algorithm and every
+# random call it makes, anything that changes the output needs a new id
+GENERATORS = {
+    1: "eller",
+    2: "sidewinder",      # needs numpy
+}
+
+# with numpy installed, mazes with at least this many cells use sidewinder
+HUGE_CELLS = 4_000_000
+
+# cell rows the numpy generator carves per step
+BLOCK_ROWS = 256
+
+START = (1, 1)
+
+# cells a player can walk onto next to a door
+OPEN = (0, 2)
+
+
+def last_cell(rows, cols):
+    # bottom right carved cell, cells sit on odd coordinates
+    x = cols - 2 if (cols - 2) % 2 else cols - 3
+    y = rows - 2 if (rows - 2) % 2 else rows - 3
+    return x, y
+
+
+class SeededRandom:
+    """
+    The random calls the generators make, all built on random.Random.random(),
+    the one method Python promises gives the same sequence for the same
+    seed across versions and platforms.
+    """
+
+    def __init__(self, seed):
+        self._random = random.Random(seed).random
+
+    def random(self):
+        return self._random()
+
+    def randrange(self, n):
+        return int(self._random() * n)
+
+    def choice(self, items):
+        return items[int(self._random() * len(items))]
+
+    def shuffle(self, items):
+        for i in range(len(items) - 1, 0, -1):
+            j = int(self._random() * (i + 1))
+            items[i], items[j] = items[j], items[i]
+
+    def getrandbits(self, k):
+        bits = 0
+        for _ in range(0, k, 32):
+            bits = (bits << 32) | int(self._random() * (1 << 32))
+        return bits >> (-k % 32)
+
+
+def new_seed():
+    return random.getrandbits(63)
+
+
+def supported_versions():
+    # generator versions this install can run
+    return tuple(v for v, name in GENERATORS.items() if name != "sidewinder" or np is not None)
+
+
+def pick_version(rows, cols):
+    if np is not None and rows * cols >= HUGE_CELLS:
+        return 2
+    return 1
+
+
+def generate(rows, cols, loops=0, doors=0, seed=None, version=None):
+    """
+    (Grid, list of door positions) for a rows x cols maze: a perfect maze
+    plus up to `loops` extra openings and `doors` doors on corridor tiles,
+    start at (1, 1) and the exit in the bottom right cell.
+
+    seed None picks a random one. version is a GENERATORS id, None picks
+    by size.
+    """
+    if rows < 3 or cols < 3:
+        raise ValueError(f"maze must be at least 3x3, got {rows}x{cols}")
+    if version is None:
+        version = pick_version(rows, cols)
+    algorithm = GENERATORS.get(version)
+    rng = SeededRandom(new_seed() if seed is None else seed)
+
+    grid = Grid(rows, cols, fill=1)
+    exit_pos = last_cell(rows, cols)
+    # spare door candidates, loops and neighbouring doors knock some out
+    door_picks = doors * 5 // 4 + 2 * loops + 8 if doors else 0
+
+    if algorithm == "eller":
+        carver = _eller(grid, rng)
+        picker = _RowPicker(grid, loops, door_picks, rng)
+    elif algorithm == "sidewinder":
+        if np is None:
+            raise ImportError("numpy is not installed")
+        # PCG64 streams are fixed for a given seed
+        np_rng = np.random.Generator(np.random.PCG64(rng.getrandbits(64)))
+        carver = _sidewinder(grid, np_rng)
+        picker = _BlockPicker(grid, loops, door_picks, np_rng)
+    else:
+        raise ValueError(f"unknown maze generator version {version!r}")
+
+    # the carver yields how many rows from the top are final
+    for final in carver:
+        picker.scan(final)
+    picker.scan(rows)
+
+    for x, y in picker.loops():
+        grid.set(x, y, 0)
+    grid.set(*exit_pos, 2)
+
+    # candidates never sit on the border, so no bounds checks
+    data = grid.data
+    placed = []
+    for x, y in picker.doors():
+        if len(placed) >= doors:
+            break
+        if (x, y) in (START, exit_pos):
+            continue
+        # still a plain corridor tile after the loops and earlier doors
+        i = y * cols + x
+        if data[i] == 0 and (
+                (data[i - 1] in OPEN) + (data[i + 1] in OPEN)
+                + (data[i - cols] in OPEN) + (data[i + cols] in OPEN)) == 2:
+            data[i] = 3
+            placed.append((x, y))
+    return grid, placed
+
+
+# ---- carvers ---------------------------------------------------------------
+
+def _eller(grid, rng):
+    """
+    Eller's algorithm straight into grid, one cell row at a time. Only the
+    set label of every cell in the current row is kept.
+    """
+    rows, cols, data = grid.rows, grid.cols, grid.data
+    n = (cols - 1) // 2       # cells per row, at x = 1, 3, 5, ...
+    m = (rows - 1) // 2       # cell rows, at y = 1, 3, 5, ...
+    labels = list(range(n))
+    next_label = n
+
+    for i in range(m):
+        y = 1 + 2 * i
+        base = y * cols
+        last = i == m - 1
+        data[base + 1:base + 2 * n:2] = bytes(n)
+
+        members = {}
+        for j, label in enumerate(labels):
+            members.setdefault(label, []).append(j)
+
+        # join neighbours from different sets, on the last row always
+        for j in range(n - 1):
+            a, b = labels[j], labels[j + 1]
+            if a != b and (last or rng.random() < 0.5):
+                data[base + 2 + 2 * j] = 0
+                if len(members[a]) < len(members[b]):
+                    a, b = b, a
+                for k in members[b]:
+                    labels[k] = a
+                members[a].extend(members.pop(b))
+
+        if last:
+            break
+
+        # every set goes down at least once, the rest start new sets
+        below = base + cols
+        new_labels = [-1] * n
+        for label, cells in members.items():
+            down = [k for k in cells if rng.random() < 0.5] or [rng.choice(cells)]
+            for k in down:
+                data[below + 1 + 2 * k] = 0
+                new_labels[k] = label
+        for k in range(n):
+            if new_labels[k] < 0:
+                new_labels[k] = next_label
+                next_label += 1
+        labels = new_labels
+        yield y + 2
+
+    yield rows
+
+
+def _sidewinder(grid, rng):
+    """
+    Sidewinder with numpy, BLOCK_ROWS cell rows per step. Each row is cut
+    into random runs and every run opens north once, so rows don't depend
+    on each other and a whole block is carved with array operations.
+    The top row is one long corridor, the price for the speed.
+    """
+    a = grid.as_numpy()
+    n = (grid.cols - 1) // 2
+    m = (grid.rows - 1) // 2
+
+    a[1, 1:2 * n] = 0
+    yield 2
+
+    for i0 in range(1, m, BLOCK_ROWS):
+        i1 = min(m, i0 + BLOCK_ROWS)
+        b = i1 - i0
+        cells = a[1 + 2 * i0:1 + 2 * i1:2]     # view of this block's cell rows
+        cells[:, 1:2 * n:2] = 0
+
+        east = rng.random((b, n)) < 0.5
+        east[:, -1] = False                   # runs end at the right wall
+        cells[:, 2:2 * n:2][east[:, :-1]] = 0
+
+        # runs start wherever the cell to the left didn't carve east
+        starts = np.ones((b, n), dtype=bool)
+        starts[:, 1:] = ~east[:, :-1]
+        starts = np.flatnonzero(starts)
+        lengths = np.diff(np.append(starts, b * n))
+        chosen = starts + (rng.random(len(starts)) * lengths).astype(np.int64)
+        row, j = np.divmod(chosen, n)
+        a[2 * (i0 + row), 1 + 2 * j] = 0
+        yield 2 * i1
+
+    yield grid.rows
+
+
+# ---- loop / door pickers ---------------------------------------------------
+
+class _Picker:
+    """
+    Looks at every row once the rows around it are final and samples loop
+    and door candidates from what it saw. Runs on the perfect maze, exit
+    and loops are put in afterwards.
+    """
+
+    def __init__(self, grid, loop_count, door_count, rng):
+        self.grid = grid
+        self.loop_count = loop_count
+        self.door_count = door_count
+        self.rng = rng
+        self.next_row = 1
+
+    def scan(self, final):
+        # rows below `final` are done, a row needs the one under it
+        stop = min(final - 1, self.grid.rows - 1)
+        if stop > self.next_row:
+            self._scan(self.next_row, stop)
+            self.next_row = stop
+
+
+class _Reservoir:
+    # uniform sample of k items from a stream of unknown length (algorithm R)
+
+    def __init__(self, k, rng):
+        self.k = k
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+        else:
+            i = self.rng.randrange(self.seen)
+            if i < self.k:
+                self.items[i] = item
+
+
+class _RowPicker(_Picker):
+    # pure Python, one row at a time
+
+    def __init__(self, grid, loop_count, door_count, rng):
+        super().__init__(grid, loop_count, door_count, rng)
+        self.loop_sample = _Reservoir(loop_count, rng)
+        self.door_sample = _Reservoir(door_count, rng)
+
+    def _scan(self, r0, r1):
+        grid = self.grid
+        for y in range(r0, r1):
+            up, row, down = grid.row(y - 1), grid.row(y), grid.row(y + 1)
+            for x in range(1, grid.cols - 1):
+                if row[x] == 1:
+                    # wall between two paths, opening it makes a loop
+                    if self.loop_count and (
+                            (up[x] == 0 and down[x] == 0) or (row[x - 1] == 0 and row[x + 1] == 0)):
+                        self.loop_sample.add((x, y))
+                elif self.door_count:
+                    # corridor tile with exactly two ways out
+                    if (row[x - 1] == 0) + (row[x + 1] == 0) + (up[x] == 0) + (down[x] == 0) == 2:
+                        self.door_sample.add((x, y))
+
+    def loops(self):
+        return self.loop_sample.items
+
+    def doors(self):
+        doors = list(self.door_sample.items)
+        self.rng.shuffle(doors)
+        return doors
+
+
+class _BlockPicker(_Picker):
+    """
+    numpy version: candidates of a whole block come from array masks,
+    sampling keeps the k candidates with the smallest random keys
+    (bottom-k), which is uniform and already in random order.
+    """
+
+    def __init__(self, grid, loop_count, door_count, rng):
+        super().__init__(grid, loop_count, door_count, rng)
+        empty = (np.empty(0), np.empty(0, dtype=np.int64))
+        self.loop_sample = empty
+        self.door_sample = empty
+
+    def _keep(self, sample, k, mask, r0):
+        if not k:
+            return sample
+        found = np.flatnonzero(mask)
+        keys = np.concatenate((sample[0], self.rng.random(len(found))))
+        # flat index into the whole grid, mask starts at row r0, column 1
+        cols = self.grid.cols
+        rows_in, x = np.divmod(found, cols - 2)
+        index = np.concatenate((sample[1], (r0 + rows_in) * cols + x + 1))
+        if len(keys) > k:
+            best = np.argpartition(keys, k)[:k]
+            keys, index = keys[best], index[best]
+        return keys, index
+
+    def _scan(self, r0, r1):
+        a = self.grid.as_numpy()
+        mid = a[r0:r1, 1:-1]
+        up = a[r0 - 1:r1 - 1, 1:-1] == 0
+        down = a[r0 + 1:r1 + 1, 1:-1] == 0
+        left = a[r0:r1, :-2] == 0
+        right = a[r0:r1, 2:] == 0
+
+        wall = mid == 1
+        loops = wall & ((up & down) | (left & right))
+        self.loop_sample = self._keep(self.loop_sample, self.loop_count, loops, r0)
+
+        ways = up.astype(np.uint8) + down + left + right
+        doors = ~wall & (ways == 2)
+        self.door_sample = self._keep(self.door_sample, self.door_count, doors, r0)
+
+    def _positions(self, sample):
+        keys, index = sample
+        y, x = np.divmod(index[np.argsort(keys)], self.grid.cols)
+        return list(zip(x.tolist(), y.tolist()))
+
+    def loops(self):
+        return self._positions(self.loop_sample)
+
+    def doors(self):
+        return self._positions(self.door_sample)
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import maze_gen
+from grid import Grid
+from pathing import PathField
+
+
+def watch_parent(parent):
+    # worker processes: quit once the parent is gone, a killed server
+    # would otherwise leave its workers behind
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1.0)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def build(rows, cols, loops, doors, seed, version, paths=False):
+    # runs in a worker process, the Grid (and PathField) go back as plain bytes
+    grid, placed = maze_gen.generate(rows, cols, loops, doors, seed, version)
+    return bytes(grid.data), placed, PathField(grid).dump() if paths else None
+
+
+class MazePool:
+    """
+    Ready-to-play mazes, generated ahead of time in worker processes.
+
+    add() registers a maze kind (rows, cols, loops, doors) and the pool keeps
+    up to `depth` of them queued. take() pops one in O(1), so a restart or
+    a new room never waits for generation. If the queue ran dry it
+    generates one in the calling thread, or with inline=False in a worker
+    while the caller waits, for callers that must not hold the GIL that
+    long (the server). generate() builds a maze from a given seed in a worker.
+    A background thread tops the queues up, starting at most `rate` mazes
+    a second (0 = as fast as the workers go).
+
+    Mazes come back as (Grid, doors, seed, version, paths), so the server
+    can send the seed instead of the grid. Seeds are picked here, forked
+    workers would otherwise share the parent's random state. With
+    paths=True the workers also build each maze's PathField, which takes
+    longer than the maze itself on big ones, otherwise paths is None.
+    """
+
+    def __init__(self, depth=2, workers=1, rate=0, paths=False):
+        self.depth = depth
+        self.rate = rate
+        self.paths = paths
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=watch_parent, initargs=(os.getpid(),),
+        )
+
+        self.lock = threading.Lock()
+        self.ready = {}           # kind -> deque of (Grid, doors, seed, version, paths)
+        self.pending = {}         # kind -> jobs running in the workers
+        self.futures = set()      # those jobs, close() cancels the ones not started yet
+        self.hits = 0
+        self.misses = 0
+
+        self._next_start = time.monotonic()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        threading.Thread(target=self._refill_loop, daemon=True).start()
+
+    def add(self, rows, cols, loops=0, doors=0):
+        kind = (rows, cols, loops, doors)
+        with self.lock:
+            if kind not in self.ready:
+                self.ready[kind] = deque(maxlen=self.depth)
+                self.pending[kind] = 0
+        self._wake.set()
+
+    def take(self, rows, cols, loops=0, doors=0, inline=True):
+        # (Grid, doors, seed, version, paths), straight from the queue when one is ready
+        kind = (rows, cols, loops, doors)
+        with self.lock:
+            queue = self.ready.get(kind)
+            maze = queue.popleft() if queue else None
+            if maze is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._wake.set()
+        if maze is None:
+            seed, version = maze_gen.new_seed(), maze_gen.pick_version(rows, cols)
+            if not inline:
+                return self.generate(rows, cols, loops, doors, seed, version)
+            grid, placed = maze_gen.generate(rows, cols, loops, doors, seed, version)
+            return grid, placed, seed, version, PathField(grid) if self.paths else None
+        return maze
+
+    def generate(self, rows, cols, loops, doors, seed, version):
+        # (Grid, doors, seed, version, paths) for this seed, built in a worker, blocks until done
+        built = self.executor.submit(build, rows, cols, loops, doors, seed, version, self.paths).result()
+        return self._maze(rows, cols, built, seed, version)
+
+    def _maze(self, rows, cols, built, seed, version):
+        # what build() sent back -> (Grid, doors, seed, version, paths)
+        data, placed, field = built
+        grid = Grid(rows, cols, data=bytearray(data))
+        return grid, placed, seed, version, PathField(grid, built=field) if field else None
+
+    def queued(self, rows, cols, loops=0, doors=0):
+        with self.lock:
+            return len(self.ready.get((rows, cols, loops, doors), ()))
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        # shutdown(cancel_futures=True) would need Python 3.9. cancel()
+        # runs the done callbacks, which take the lock, so not under it
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+        self.executor.shutdown()
+
+    def _refill_loop(self):
+        while not self._stop.is_set():
+            delay = self._top_up()
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _top_up(self):
+        # start jobs for every queue that is short, returns how long to
+        # sleep before the rate limit allows the next one (None = until woken)
+        with self.lock:
+            missing = [
+                kind for kind, queue in self.ready.items()
+                for _ in range(self.depth - len(queue) - self.pending[kind])
+            ]
+        for kind in missing:
+            if self._stop.is_set():
+                return None
+            now = time.monotonic()
+            if self.rate:
+                if now < self._next_start:
+                    return self._next_start - now
+                self._next_start = max(now, self._next_start) + 1.0 / self.rate
+            with self.lock:
+                self.pending[kind] += 1
+            seed, version = maze_gen.new_seed(), maze_gen.pick_version(*kind[:2])
+            try:
+                future = self.executor.submit(build, *kind, seed, version, self.paths)
+            except RuntimeError:   # executor shut down
+                return None
+            with self.lock:
+                self.futures.add(future)
+            future.add_done_callback(
+                lambda f, kind=kind, origin=(seed, version): self._finished(kind, origin, f))
+        return None
+
+    def _finished(self, kind, origin, future):
+        # runs in the executor's thread when a worker is done
+        maze = None
+        if not future.cancelled():
+            if future.exception() is not None:
+                print(f"Maze pool: generating {kind[0]}x{kind[1]} failed: {future.exception()!r}")
+            else:
+                maze = self._maze(kind[0], kind[1], future.result(), *origin)
+        with self.lock:
+            self.pending[kind] -= 1
+            self.futures.discard(future)
+            if maze is not None:
+                self.ready[kind].append(maze)
+        # after a failure wait for the next take() instead of retrying right away
+        if maze is not None:
+            self._wake.set()
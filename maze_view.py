@@ -0,0 +1,277 @@
+"""
+Maze drawing shared by client_pygame.py and main.py.
+
+Only the part of the maze inside the viewport is ever drawn. It is
+painted once into a background Surface the size of the viewport; after
+that only tiles that changed are repainted, players are sprites blitted
+over the background, and draw() returns just the rectangles that differ
+from the last frame for pygame.display.update(). When the camera moves
+the background scrolls and only the newly exposed rows / columns are
+painted, so a frame costs the same on a 51x51 maze as on a 5001x5001 one.
+
+Minimap is the optional shrunk overview for mazes bigger than the window.
+"""
+from itertools import groupby
+
+import pygame
+
+
+class MazeView:
+    """
+    colors maps a cell value to its color, values without one show
+    `background`. offset is where the viewport's top left corner sits on
+    the screen and size its (width, height) in pixels, None = the whole
+    maze. Call tile_changed(x, y) after changing a cell of maze, look_at()
+    to follow a player, and invalidate() when the screen was cleared or
+    covered by something else.
+    """
+
+    def __init__(self, maze, tile_size, colors, background=(0, 0, 0), offset=(0, 0), size=None):
+        self.maze = maze
+        self.tile_size = tile_size
+        self.colors = colors
+        self.background = background
+        self.offset = offset
+
+        t = tile_size
+        width, height = size or (maze.cols * t, maze.rows * t)
+        self.rect = pygame.Rect(offset, (width, height))   # the viewport on screen
+        # tiles the background holds (the last ones may be cut off) and
+        # tiles that are fully visible, the camera never shows past the maze
+        self.view_cols = min(maze.cols, -(-width // t))
+        self.view_rows = min(maze.rows, -(-height // t))
+        self.max_camera = (max(0, maze.cols - width // t), max(0, maze.rows - height // t))
+        self.camera = (0, 0)      # top left tile in the viewport
+
+        self.surface = pygame.Surface((self.view_cols * t, self.view_rows * t))
+        self.sprites = {}         # color -> tile sized Surface
+        self.shown = {}           # (x, y) -> color of the sprite on screen there
+        self.changed = set()      # tiles repainted since the last draw()
+        self.full = True          # next draw() blits the whole background
+        self.paint_all()
+
+    # ---- background ----------------------------------------------------
+
+    def paint_all(self):
+        cx, cy = self.camera
+        self.paint(cx, cy, cx + self.view_cols, cy + self.view_rows)
+        self.full = True
+
+    def paint(self, x0, y0, x1, y1):
+        # maze tiles x0 <= x < x1, y0 <= y < y1 into the background,
+        # runs of equal cells in a row are one fill
+        t = self.tile_size
+        cx, cy = self.camera
+        self.surface.fill(self.background, ((x0 - cx) * t, (y0 - cy) * t, (x1 - x0) * t, (y1 - y0) * t))
+        x0, x1 = max(0, x0), min(self.maze.cols, x1)
+        for y in range(max(0, y0), min(self.maze.rows, y1)):
+            x = x0
+            for value, run in groupby(self.maze.row(y)[x0:x1]):
+                n = len(tuple(run))
+                color = self.colors.get(value)
+                if color is not None:
+                    self.surface.fill(color, ((x - cx) * t, (y - cy) * t, n * t, t))
+                x += n
+
+    def visible(self, x, y):
+        # any part of the tile at (x, y) in view, x and y may be fractions
+        cx, cy = self.camera
+        return cx - 1 < x < cx + self.view_cols and cy - 1 < y < cy + self.view_rows
+
+    def tile_changed(self, x, y):
+        # tiles outside the viewport get painted when the camera gets there
+        if not self.visible(x, y):
+            return
+        t = self.tile_size
+        cx, cy = self.camera
+        color = self.colors.get(self.maze.get(x, y), self.background)
+        self.surface.fill(color, ((x - cx) * t, (y - cy) * t, t, t))
+        self.changed.add((x, y))
+
+    def invalidate(self):
+        self.full = True
+
+    # ---- camera --------------------------------------------------------
+
+    def look_at(self, x, y):
+        # move the camera once (x, y) gets within a quarter view of the edge
+        cx, cy = self.camera
+        mx, my = self.view_cols // 4, self.view_rows // 4
+        if x < cx + mx:
+            cx = x - mx
+        elif x >= cx + self.view_cols - mx:
+            cx = x - self.view_cols + mx + 1
+        if y < cy + my:
+            cy = y - my
+        elif y >= cy + self.view_rows - my:
+            cy = y - self.view_rows + my + 1
+        self.scroll_to(cx, cy)
+
+    def scroll_to(self, cx, cy):
+        cx = max(0, min(cx, self.max_camera[0]))
+        cy = max(0, min(cy, self.max_camera[1]))
+        ox, oy = self.camera
+        dx, dy = cx - ox, cy - oy
+        if not dx and not dy:
+            return
+        self.camera = (cx, cy)
+        self.changed.clear()
+        vc, vr = self.view_cols, self.view_rows
+        if abs(dx) >= vc or abs(dy) >= vr:
+            self.paint_all()
+            return
+
+        # shift what we have, paint the strips that came into view
+        t = self.tile_size
+        self.surface.scroll(-dx * t, -dy * t)
+        if dx > 0:
+            self.paint(cx + vc - dx, cy, cx + vc, cy + vr)
+        elif dx < 0:
+            self.paint(cx, cy, cx - dx, cy + vr)
+        if dy > 0:
+            self.paint(cx, cy + vr - dy, cx + vc, cy + vr)
+        elif dy < 0:
+            self.paint(cx, cy, cx + vc, cy - dy)
+        # everything moved on screen
+        self.full = True
+
+    # ---- drawing -------------------------------------------------------
+
+    def tile_rect(self, x, y):
+        # screen rectangle of a tile, or of a sprite between tiles
+        t = self.tile_size
+        cx, cy = self.camera
+        return pygame.Rect(
+            self.offset[0] + round((x - cx) * t), self.offset[1] + round((y - cy) * t), t, t)
+
+    def sprite(self, color):
+        surf = self.sprites.get(color)
+        if surf is None:
+            surf = self.sprites[color] = pygame.Surface((self.tile_size, self.tile_size))
+            surf.fill(color)
+        return surf
+
+    def draw(self, screen, players):
+        """
+        Bring the viewport up to date. players maps (x, y) -> color, one
+        sprite per position. Positions may be fractions of a tile for
+        players on their way between two tiles, sprites outside the
+        viewport are skipped. Returns the list of screen rectangles that
+        changed.
+        """
+        players = {pos: color for pos, color in players.items() if self.visible(*pos)}
+        rects = {pos: self.tile_rect(*pos) for pos in players}
+        clip = screen.get_clip()
+        screen.set_clip(self.rect)
+
+        if self.full:
+            self.full = False
+            screen.blit(self.surface, self.offset)
+            dirty = [self.rect]
+            paint = players
+        else:
+            # background back where a sprite went away or changed color,
+            # and on repainted tiles
+            restore = [
+                self.tile_rect(*pos) for pos, color in self.shown.items()
+                if players.get(pos) != color
+            ]
+            restore += [self.tile_rect(*pos) for pos in self.changed]
+            shift = (-self.offset[0], -self.offset[1])   # screen -> background
+            for rect in restore:
+                screen.blit(self.surface, rect, rect.move(shift))
+
+            # repaint every sprite touching a changed area, and everything
+            # touching those (sprites overlap while moving), in order
+            grow = restore + [
+                rects[pos] for pos, color in players.items() if self.shown.get(pos) != color
+            ]
+            paint = set()
+            while grow:
+                new = [pos for pos in players if pos not in paint and rects[pos].collidelist(grow) >= 0]
+                paint.update(new)
+                grow = [rects[pos] for pos in new]
+            paint = [pos for pos in players if pos in paint]
+            dirty = [rect.clip(self.rect) for rect in restore]
+            dirty += [rects[pos].clip(self.rect) for pos in paint]
+
+        for pos in paint:
+            screen.blit(self.sprite(players[pos]), rects[pos])
+
+        screen.set_clip(clip)
+        self.shown = players
+        self.changed.clear()
+        return dirty
+
+
+class Minimap:
+    """
+    The whole maze shrunk to fit in size x size pixels, every pixel shaded
+    by how much of its block of cells is wall, with the players and the
+    camera's view drawn on top. Walls never change, so the shrunk maze is
+    built once; TILE changes (doors, red tiles) don't show up here.
+    """
+
+    def __init__(self, maze, size, pos, wall=(80, 80, 80), path=(0, 0, 0),
+                 frame=(255, 255, 0), exit=(0, 0, 200)):
+        self.maze = maze
+        self.pos = pos
+        self.frame = frame
+        self.exit_color = exit
+
+        # cells per block, then pixels per block when the maze is small
+        rows, cols = maze.rows, maze.cols
+        self.block = block = max(1, -(-max(rows, cols) // size))
+        w, h = -(-cols // block), -(-rows // block)
+        self.scale = max(1, size // max(w, h))
+
+        shades = [
+            bytes(p + (q - p) * level // 255 for p, q in zip(path, wall)) for level in range(256)
+        ]
+        data = maze.data
+        pixels = []
+        for by in range(h):
+            y0, y1 = by * block, min(rows, (by + 1) * block)
+            for bx in range(w):
+                x0, x1 = bx * block, min(cols, (bx + 1) * block)
+                walls = sum(data.count(1, y * cols + x0, y * cols + x1) for y in range(y0, y1))
+                pixels.append(shades[walls * 255 // ((y1 - y0) * (x1 - x0))])
+        small = pygame.image.frombuffer(b"".join(pixels), (w, h), "RGB")
+        self.base = pygame.transform.scale(small, (w * self.scale, h * self.scale))
+        self.rect = pygame.Rect(pos, self.base.get_size()).inflate(2, 2)
+
+        exit_at = data.find(2)
+        self.exit = None if exit_at < 0 else (exit_at % cols, exit_at // cols)
+        self.last = None          # what the last draw() showed
+
+    def to_pixel(self, x, y):
+        s = self.scale
+        return (self.pos[0] + x // self.block * s, self.pos[1] + y // self.block * s)
+
+    def draw(self, screen, players, view, force=False):
+        """
+        players maps (x, y) -> color like MazeView.draw, view is the
+        MazeView whose camera gets the frame. Returns [rect] when something
+        changed (or force), [] otherwise.
+        """
+        dots = {self.to_pixel(*p): color for p, color in players.items()}
+        state = (view.camera, list(dots.items()))   # order matters where dots overlap
+        if not force and state == self.last:
+            return []
+        self.last = state
+
+        screen.fill(self.frame, self.rect)
+        screen.blit(self.base, self.pos)
+        dot = max(2, self.scale)
+        if self.exit is not None:
+            screen.fill(self.exit_color, (self.to_pixel(*self.exit), (dot, dot)))
+        for xy, color in dots.items():
+            screen.fill(color, (xy, (dot, dot)))
+
+        # the part of the maze the viewport shows
+        cx, cy = view.camera
+        x0, y0 = self.to_pixel(cx, cy)
+        x1, y1 = self.to_pixel(
+            min(self.maze.cols, cx + view.view_cols) - 1, min(self.maze.rows, cy + view.view_rows) - 1)
+        pygame.draw.rect(screen, self.frame, (x0, y0, x1 - x0 + self.scale, y1 - y0 + self.scale), 1)
+        return [self.rect]
@@ -0,0 +1,248 @@
+"""
+In-process server metrics: counters, gauges and histograms.
+
+Recording is a dict or list update under a small lock, cheap enough to
+leave on all the time. Reading happens through the STATS command
+(summary()) or the Prometheus text format (render()), served on
+localhost by serve_http() when the server runs with --metrics-port.
+
+Metrics live in the module level REGISTRY, modules create theirs at
+import time with counter() / gauge() / histogram().
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, 1us to 1s
+LATENCY_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+
+def _escape(value):
+    # label values may come from clients (room names), the text format
+    # only allows \\, \" and \n escaped inside the quotes
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(name, value):
+    # one label at most, {type="MOVE"}
+    return f'{{{name}="{_escape(value)}"}}' if name is not None else ""
+
+
+class Counter:
+    # only goes up, optionally split by one label: inc("MOVE")
+
+    kind = "counter"
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}          # label value (None without a label) -> count
+        self.lock = threading.Lock()
+
+    def inc(self, value=None, n=1):
+        with self.lock:
+            self.values[value] = self.values.get(value, 0) + n
+
+    def get(self, value=None):
+        return self.values.get(value, 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items(), key=lambda item: str(item[0]))
+        if not items and self.label is None:
+            items = [(None, 0)]
+        return [(self.name + _labels(self.label, v), n) for v, n in items]
+
+
+class Gauge:
+    """
+    A value that goes up and down. Either kept with inc() / dec() / set(),
+    or read from func() every time someone looks, for values the server
+    already tracks (rooms, doors, ...). With a label, func returns a dict
+    label value -> value, one sample each.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, func=None, label=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.label = label
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.func() if self.func is not None else self.value
+
+    def samples(self):
+        if self.label is None:
+            return [(self.name, self.get())]
+        items = sorted(self.func().items(), key=lambda item: str(item[0]))
+        return [(self.name + _labels(self.label, v), n) for v, n in items]
+
+
+class Histogram:
+    """
+    Counts of observations per bucket plus their sum. Buckets are upper
+    bounds, anything above the last one lands in +Inf.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q, counts=None):
+        """
+        Estimate from the buckets, linear inside the bucket the way
+        Prometheus' histogram_quantile does. None without observations.
+        """
+        if counts is None:
+            counts = self.snapshot()[0]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                low = self.bounds[i - 1] if i else 0.0
+                return low + (self.bounds[i] - low) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+    def samples(self):
+        counts, total, count = self.snapshot()
+        out = []
+        cumulative = 0
+        for bound, n in zip(self.bounds + ("+Inf",), counts):
+            cumulative += n
+            out.append((f'{self.name}_bucket{{le="{bound}"}}', cumulative))
+        out.append((self.name + "_sum", total))
+        out.append((self.name + "_count", count))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}         # name -> metric, in registration order
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        # same name again replaces the old one (a second server in one process)
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self):
+        with self.lock:
+            return tuple(self.metrics.values())
+
+    def render(self):
+        # everything in the Prometheus text exposition format
+        lines = []
+        for metric in self.snapshot():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, value in metric.samples():
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        # one short line per sample, histograms as count / avg / quantiles
+        lines = []
+        for metric in self.snapshot():
+            if metric.kind != "histogram":
+                lines.extend(f"{name} {_number(value)}" for name, value in metric.samples())
+                continue
+            counts, total, count = metric.snapshot()
+            if not count:
+                lines.append(f"{metric.name} count=0")
+                continue
+            quantiles = " ".join(
+                f"p{int(q * 100)}={metric.quantile(q, counts) * 1e3:.3f}ms"
+                for q in (0.5, 0.95, 0.99)
+            )
+            lines.append(f"{metric.name} count={count} avg={total / count * 1e3:.3f}ms {quantiles}")
+        return lines
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, label=None):
+    return REGISTRY.register(Counter(name, help, label))
+
+
+def gauge(name, help, func=None, label=None):
+    return REGISTRY.register(Gauge(name, help, func, label))
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, buckets))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass   # scrapes every few seconds would flood the console
+
+
+def serve_http(port, host="127.0.0.1", registry=REGISTRY):
+    # Prometheus scrape endpoint in a background thread, returns the server
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,261 @@
+import heapq
+from array import array
+from collections import deque
+from operator import and_, or_
+
+WALL = 1
+EXIT = 2
+
+UNREACHABLE = -1
+
+# tile value -> 1 if it can be walked on
+PASSABLE = bytes(0 if v == WALL else 1 for v in range(256))
+
+# 0/1 -> 0/bit, to turn a passable mask into adjacency bits
+def _scale(bit):
+    return bytes([0, bit]) + bytes(254)
+
+# neighbour bits in PathField.adj, in the order the door highlight
+# code has always looked at neighbours: right, left, down, up
+EAST, WEST, SOUTH, NORTH = 1, 2, 4, 8
+DIRECTIONS = {EAST: "RIGHT", WEST: "LEFT", SOUTH: "DOWN", NORTH: "UP"}
+
+
+class PathField:
+    """
+    BFS distance from every walkable cell to the exit, plus which
+    neighbours of every cell can be walked to.
+
+    Built once per maze, then kept current with set_tile() / set_passable()
+    when a cell opens or closes, which only touches the cells whose distance
+    actually changes. distance() and next_step() are O(1), within() and
+    zone() only visit what they return.
+
+    Everything is flat, one entry per cell at y * cols + x: adj is one
+    byte of EAST/WEST/SOUTH/NORTH bits, dist a 32 bit int.
+
+    The build is a BFS over the whole maze in Python, seconds on big mazes.
+    dump() gives it as plain bytes and PathField(grid, built=...) takes it
+    back without redoing it, so it can be built in another process.
+    """
+
+    def __init__(self, grid, built=None):
+        self.rows = grid.rows
+        self.cols = grid.cols
+        self.grid = grid
+        cols = self.cols
+        # bit -> index offset
+        self.steps = ((EAST, 1), (WEST, -1), (SOUTH, cols), (NORTH, -cols))
+
+        n = self.rows * cols
+        if built is not None:
+            passable, adj, dist, self.exit = built
+            self.passable = bytearray(passable)
+            self.adj = bytearray(adj)
+            self.dist = array("i")
+            self.dist.frombytes(dist)
+            if not len(self.passable) == len(self.adj) == len(self.dist) == n:
+                raise ValueError(f"built field is not {self.rows}x{cols}")
+            return
+
+        self.passable = bytearray(grid.data.translate(PASSABLE))
+        self.adj = self._all_links()
+
+        self.exit = grid.data.find(EXIT)
+        self.dist = array("i", [UNREACHABLE]) * n
+        if self.exit >= 0:
+            self.dist[self.exit] = 0
+            self._spread([self.exit])
+
+    def dump(self):
+        # (passable, adj, dist, exit) as bytes and an int, for PathField(grid, built=...)
+        return bytes(self.passable), bytes(self.adj), self.dist.tobytes(), self.exit
+
+    def _all_links(self):
+        # adjacency bits for the whole grid at once: a cell links to a
+        # neighbour when both are passable, nothing wraps around rows
+        p, cols = bytes(self.passable), self.cols
+        pad = bytes(cols)
+        east = bytearray(map(and_, p, p[1:] + b"\0"))
+        east[cols - 1::cols] = bytes(self.rows)
+        west = bytearray(map(and_, p, b"\0" + p[:-1]))
+        west[0::cols] = bytes(self.rows)
+        south = bytes(map(and_, p, p[cols:] + pad))
+        north = bytes(map(and_, p, pad + p[:-cols]))
+        return bytearray(map(
+            or_,
+            map(or_, east.translate(_scale(EAST)), west.translate(_scale(WEST))),
+            map(or_, south.translate(_scale(SOUTH)), north.translate(_scale(NORTH))),
+        ))
+
+    def _links(self, i):
+        # adjacency bits of cell i from the passable flags
+        x, y = i % self.cols, i // self.cols
+        passable = self.passable
+        bits = 0
+        if x + 1 < self.cols and passable[i + 1]:
+            bits |= EAST
+        if x > 0 and passable[i - 1]:
+            bits |= WEST
+        if y + 1 < self.rows and passable[i + self.cols]:
+            bits |= SOUTH
+        if y > 0 and passable[i - self.cols]:
+            bits |= NORTH
+        return bits
+
+    def neighbors(self, i):
+        mask = self.adj[i]
+        return [i + delta for bit, delta in self.steps if mask & bit]
+
+    def _spread(self, queue):
+        # BFS outwards from cells whose distance just went down
+        dist, adj, steps = self.dist, self.adj, self.steps
+        queue = deque(queue)
+        while queue:
+            i = queue.popleft()
+            d = dist[i] + 1
+            mask = adj[i]
+            for bit, delta in steps:
+                if mask & bit:
+                    j = i + delta
+                    if dist[j] == UNREACHABLE or dist[j] > d:
+                        dist[j] = d
+                        queue.append(j)
+
+    # ---- queries -------------------------------------------------------
+
+    def distance(self, x, y):
+        # steps to the exit, UNREACHABLE if there is no way
+        return self.dist[y * self.cols + x]
+
+    def next_step(self, x, y):
+        # (direction name, nx, ny) one step closer to the exit, or None
+        i = y * self.cols + x
+        d = self.dist[i]
+        if d <= 0:
+            return None
+        mask = self.adj[i]
+        for bit, delta in self.steps:
+            if mask & bit and self.dist[i + delta] == d - 1:
+                j = i + delta
+                return DIRECTIONS[bit], j % self.cols, j // self.cols
+        return None
+
+    def within(self, x, y, k):
+        # every (x, y) at most k steps from (x, y), nearest first
+        return self.zone(x, y, None, lambda value: True, k)
+
+    def zone(self, x, y, count, accept, k=None):
+        """
+        BFS from (x, y) through cells whose tile value passes accept(),
+        (x, y) first. Stops after count cells (None = no limit) or k steps.
+        """
+        cols, data = self.cols, self.grid.data
+        start = y * cols + x
+        found = [(x, y)]
+        if count is not None and count <= 1:
+            return found[:count]
+        steps = {start: 0}
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            if k is not None and steps[i] >= k:
+                continue
+            for j in self.neighbors(i):
+                if j in steps or not accept(data[j]):
+                    continue
+                steps[j] = steps[i] + 1
+                found.append((j % cols, j // cols))
+                if count is not None and len(found) >= count:
+                    return found
+                queue.append(j)
+        return found
+
+    # ---- updates -------------------------------------------------------
+
+    def set_passable(self, x, y, passable):
+        # a cell opened or closed, fix adjacency and the distances it changes
+        i = y * self.cols + x
+        if bool(self.passable[i]) == bool(passable):
+            return
+        self.passable[i] = 1 if passable else 0
+        self.adj[i] = self._links(i) if passable else 0
+        for j in self._around(i):
+            self.adj[j] = self._links(j) if self.passable[j] else 0
+
+        if passable:
+            self._opened(i)
+        else:
+            self._closed(i)
+
+    def set_tile(self, x, y, value):
+        # tile change from the game, only walls matter for walking
+        self.set_passable(x, y, value != WALL)
+
+    def _around(self, i):
+        x, y = i % self.cols, i // self.cols
+        if x + 1 < self.cols:
+            yield i + 1
+        if x > 0:
+            yield i - 1
+        if y + 1 < self.rows:
+            yield i + self.cols
+        if y > 0:
+            yield i - self.cols
+
+    def _opened(self, i):
+        # distances only go down, BFS out from the new cell
+        dist = self.dist
+        if i == self.exit:
+            dist[i] = 0
+        else:
+            known = [dist[j] for j in self.neighbors(i) if dist[j] != UNREACHABLE]
+            dist[i] = min(known) + 1 if known else UNREACHABLE
+        if dist[i] != UNREACHABLE:
+            self._spread([i])
+
+    def _closed(self, i):
+        """
+        Distances behind the closed cell can only go up. Find the cells that
+        lost every shortest path (level by level, a cell is hit when none of
+        its parents survived), then give them new distances from the
+        unaffected cells around them, Dijkstra style.
+        """
+        dist = self.dist
+        old = dist[i]
+        dist[i] = UNREACHABLE
+        if old == UNREACHABLE:
+            return
+
+        hit = {i}
+        queue = deque(j for j in self._around(i) if dist[j] == old + 1)
+        seen = set(queue)
+        while queue:
+            j = queue.popleft()
+            d = dist[j]
+            if any(dist[p] == d - 1 and p not in hit for p in self.neighbors(j)):
+                continue    # still has a shortest path
+            hit.add(j)
+            for c in self.neighbors(j):
+                if dist[c] == d + 1 and c not in seen:
+                    seen.add(c)
+                    queue.append(c)
+
+        hit.discard(i)
+        for j in hit:
+            dist[j] = UNREACHABLE
+        heap = []
+        for j in hit:
+            known = [dist[p] for p in self.neighbors(j) if p not in hit and dist[p] != UNREACHABLE]
+            if known:
+                dist[j] = min(known) + 1
+                heap.append((dist[j], j))
+        heapq.heapify(heap)
+        while heap:
+            d, j = heapq.heappop(heap)
+            if d != dist[j]:
+                continue
+            for c in self.neighbors(j):
+                if c in hit and (dist[c] == UNREACHABLE or dist[c] > d + 1):
+                    dist[c] = d + 1
+                    heapq.heappush(heap, (d + 1, c))
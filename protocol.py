@@ -0,0 +1,412 @@
+"""
+Wire formats shared by the server and the clients.
+
+Text protocol (default, what client.py speaks), one message per line:
+    WELCOME p3 / SPAWN x y / MAZE rows cols <data> / KEYFRAME / POS p3 x y /
+    LEAVE p3 / TILE x y v / MAZESEED seed rows cols generator loops doors /
+    HINT UP|DOWN|LEFT|RIGHT|NONE distance / STATS <metric> <value> /
+    ACK seq x y / SESSION <token> <tile version> / TILEVER <tile version>
+MAZE data is the zlib compressed grid (one byte per cell, row by row)
+in base64.
+
+Client -> server: JOIN [room] [BIN <version>] [GEN <ids>],
+MOVE UP|DOWN|LEFT|RIGHT [seq], MOVES <dir> <dir> ... [seq] (several steps in
+order, directions also as U|D|L|R), HINT (next step towards the exit), STATS
+(server metrics, works before JOIN too). Without a room name the server picks one
+(matchmaking). Clients that can run maze_gen list the generator versions
+they know, "GEN 1,2", and then get MAZESEED instead of the grid: they
+rebuild the maze from the seed and apply the TILE changes that follow.
+A MOVE with a sequence number is answered with ACK: every move up to seq
+has been applied and this is where the mover ended up, so clients can
+move their own player right away and correct it later.
+The steps of a MOVES line, and MOVE lines that arrive together, are
+applied at once and answered with one ACK (seq of the last step) and one
+update frame.
+
+Sessions: WELCOME comes with a session token and the room's tile version,
+and every frame with TILE changes says which tile version it brings the
+client to (TILEVER after the TILE lines). A client whose connection
+dropped sends "RESUME <token> <tile version> [BIN <version>] [GEN <ids>]"
+instead of JOIN: within the server's grace period it gets its player
+back where it was, plus only the tiles changed since that version. Too
+late, and RESUME works like a plain JOIN. A client that leaves for good
+sends QUIT, its player goes right away instead of after the grace period.
+
+Binary protocol, asked for with "JOIN BIN <version>". Client -> server
+stays text lines, server -> client becomes length-prefixed frames:
+
+    header   !BI   message type, payload length
+    WELCOME  !BIHH protocol version, player number, spawn x, spawn y,
+                   version 3 adds !QI session token, tile version
+    MAZE     !HH   rows, cols, then 4 bits per cell (two cells per byte)
+    MAZE_Z   !HH   rows, cols, then the zlib compressed grid   (version 2)
+    MAZE_SEED !QHHBHI seed, rows, cols, generator, loops, doors  (with GEN)
+    HINT     !Bi   direction (index into HINT_DIRECTIONS), distance (-1 = no way)
+    STATS          the STATS lines without the prefix, utf-8, newline separated
+    ACK      !IHH  last applied move sequence number, x, y
+    UPDATE   !BHHH flags, #tiles, #gone, #moved, then
+                   tiles as !I  (x << 18 | y << 4 | value)
+                   gone  as !I  (player number)
+                   moved as !IHH (player number, x, y)
+                   flag 2: followed by !I tile version   (version 3)
+    More than 65535 tiles go out as several UPDATEs in a row, only the
+    last one has the flags, gone, moved and the tile version.
+
+Player ids are "p<number>" on the text side and just the number in binary.
+"""
+import base64
+import struct
+import zlib
+
+from grid import Grid
+
+# MOVE sequence numbers wrap around at this
+SEQ_LIMIT = 1 << 32
+
+# 1: nibble packed MAZE, 2: zlib compressed MAZE_Z, 3: sessions
+PROTOCOL_VERSION = 3
+
+MSG_WELCOME = 1
+MSG_MAZE = 2
+MSG_UPDATE = 3
+MSG_MAZE_Z = 4
+MSG_MAZE_SEED = 5
+MSG_HINT = 6
+MSG_STATS = 7
+MSG_ACK = 8
+
+FLAG_KEYFRAME = 1
+FLAG_TILE_VERSION = 2
+
+HEADER = struct.Struct("!BI")
+WELCOME = struct.Struct("!BIHH")
+SESSION = struct.Struct("!QI")
+TILE_VERSION = struct.Struct("!I")
+MAZE_HEAD = struct.Struct("!HH")
+UPDATE_HEAD = struct.Struct("!BHHH")
+TILE = struct.Struct("!I")
+GONE = struct.Struct("!I")
+MOVED = struct.Struct("!IHH")
+MAZE_SEED = struct.Struct("!QHHBHI")
+HINT = struct.Struct("!Bi")
+ACK = struct.Struct("!IHH")
+
+HINT_DIRECTIONS = ("NONE", "UP", "DOWN", "LEFT", "RIGHT")
+
+# x and y get 14 bits each in a packed tile, value gets 4
+MAX_COORD = (1 << 14) - 1
+
+# most entries one count in UPDATE_HEAD can say
+MAX_COUNT = 0xFFFF
+
+
+def pid_to_int(pid):
+    return int(pid[1:])
+
+
+def int_to_pid(num):
+    return f"p{num}"
+
+
+def negotiate(parts):
+    """
+    Protocol version for a JOIN line split into words, 0 means text.
+    "JOIN BIN 3" gets the highest version both sides know.
+    """
+    if "BIN" in parts:
+        i = parts.index("BIN")
+        try:
+            wanted = int(parts[i + 1]) if len(parts) > i + 1 else 1
+        except ValueError:
+            return 0
+        if wanted >= 1:
+            return min(wanted, PROTOCOL_VERSION)
+    return 0
+
+
+def parse_generators(parts):
+    # "GEN 1,2" -> (1, 2), the maze generator versions the client can run
+    if "GEN" not in parts:
+        return ()
+    i = parts.index("GEN")
+    try:
+        return tuple(int(v) for v in parts[i + 1].split(","))
+    except (IndexError, ValueError):
+        return ()
+
+
+def parse_seq(token):
+    # MOVE sequence number, None if it isn't one
+    if not token.isdigit():
+        return None
+    return int(token) % SEQ_LIMIT
+
+
+def parse_resume(parts):
+    """
+    "RESUME <token> <tile version> [BIN <version>] [GEN <ids>]"
+    -> (token, tile version, protocol version, generator versions),
+    token None for a line without one
+    """
+    token, tile_version = None, 0
+    if len(parts) >= 3 and parts[2].isdigit():
+        token, tile_version = parts[1], int(parts[2])
+    return token, tile_version, negotiate(parts), parse_generators(parts)
+
+
+def parse_join(parts):
+    """
+    "JOIN [room] [BIN <version>] [GEN <ids>]"
+    -> (room name or None, protocol version, generator versions)
+    """
+    room = None
+    if len(parts) >= 2 and parts[1] not in ("BIN", "GEN"):
+        room = parts[1]
+    return room, negotiate(parts), parse_generators(parts)
+
+
+# ---- text ----------------------------------------------------------------
+
+def text_lines(lines):
+    if not lines:
+        return b""
+    return ("\n".join(lines) + "\n").encode()
+
+
+def text_update(tiles, keyframe, gone, moved, tile_version=None):
+    # TILE lines (and the version they bring us to) first, then KEYFRAME / LEAVE / POS
+    lines = [f"TILE {x} {y} {value}" for x, y, value in tiles]
+    if tile_version is not None:
+        lines.append(f"TILEVER {tile_version}")
+    if keyframe:
+        lines.append("KEYFRAME")
+    for pid in gone:
+        lines.append(f"LEAVE {pid}")
+    for pid, x, y in moved:
+        lines.append(f"POS {pid} {x} {y}")
+    return text_lines(lines)
+
+
+def text_welcome(pid, x, y, token=None, tile_version=0):
+    lines = [f"WELCOME {pid}", f"SPAWN {x} {y}"]
+    if token is not None:
+        lines.append(f"SESSION {token} {tile_version}")
+    return text_lines(lines)
+
+
+def compress_cells(cells):
+    # whole grid, one byte per cell, mazes compress very well
+    return zlib.compress(bytes(cells), 6)
+
+
+def text_maze(rows, cols, compressed):
+    # the whole maze as a single line
+    data = base64.b64encode(compressed).decode()
+    return text_lines([f"MAZE {rows} {cols} {data}"])
+
+
+def text_hint(direction, distance):
+    return text_lines([f"HINT {direction} {distance}"])
+
+
+def text_stats(lines):
+    return text_lines([f"STATS {line}" for line in lines])
+
+
+def text_ack(seq, x, y):
+    return text_lines([f"ACK {seq} {x} {y}"])
+
+
+def text_maze_seed(seed, rows, cols, generator, loops, doors):
+    return text_lines([f"MAZESEED {seed} {rows} {cols} {generator} {loops} {doors}"])
+
+
+# ---- binary --------------------------------------------------------------
+
+def frame(msg_type, payload):
+    return HEADER.pack(msg_type, len(payload)) + payload
+
+
+def binary_welcome(version, pid, x, y, token=None, tile_version=0):
+    payload = WELCOME.pack(version, pid_to_int(pid), x, y)
+    if version >= 3 and token is not None:
+        payload += SESSION.pack(int(token, 16), tile_version)
+    return frame(MSG_WELCOME, payload)
+
+
+def binary_update(tiles, keyframe, gone, moved, tile_version=None):
+    # tiles past what one frame can count go ahead in tile-only frames
+    tiles = list(tiles)
+    head = b""
+    while len(tiles) > MAX_COUNT:
+        head += _update_frame(0, tiles[:MAX_COUNT], (), ())
+        del tiles[:MAX_COUNT]
+    flags = FLAG_KEYFRAME if keyframe else 0
+    if tile_version is not None:
+        flags |= FLAG_TILE_VERSION
+    return head + _update_frame(flags, tiles, gone, moved, tile_version)
+
+
+def _update_frame(flags, tiles, gone, moved, tile_version=None):
+    parts = [UPDATE_HEAD.pack(flags, len(tiles), len(gone), len(moved))]
+    for x, y, value in tiles:
+        parts.append(TILE.pack((x << 18) | (y << 4) | value))
+    for pid in gone:
+        parts.append(GONE.pack(pid_to_int(pid)))
+    for pid, x, y in moved:
+        parts.append(MOVED.pack(pid_to_int(pid), x, y))
+    if tile_version is not None:
+        parts.append(TILE_VERSION.pack(tile_version))
+    return frame(MSG_UPDATE, b"".join(parts))
+
+
+def pack_cells(cells):
+    # two 4 bit cells per byte, high nibble first
+    cells = bytes(cells)
+    if len(cells) % 2:
+        cells += b"\0"
+    high = cells[0::2]
+    low = cells[1::2]
+    return bytes((h << 4) | l for h, l in zip(high, low))
+
+
+def unpack_cells(packed, count):
+    out = bytearray(len(packed) * 2)
+    out[0::2] = bytes(b >> 4 for b in packed)
+    out[1::2] = bytes(b & 0x0F for b in packed)
+    return out[:count]
+
+
+def binary_maze(rows, cols, cells):
+    # version 1 clients
+    return frame(MSG_MAZE, MAZE_HEAD.pack(rows, cols) + pack_cells(cells))
+
+
+def binary_maze_z(rows, cols, compressed):
+    return frame(MSG_MAZE_Z, MAZE_HEAD.pack(rows, cols) + compressed)
+
+
+def binary_hint(direction, distance):
+    return frame(MSG_HINT, HINT.pack(HINT_DIRECTIONS.index(direction), distance))
+
+
+def binary_stats(lines):
+    return frame(MSG_STATS, "\n".join(lines).encode())
+
+
+def binary_ack(seq, x, y):
+    return frame(MSG_ACK, ACK.pack(seq, x, y))
+
+
+def binary_maze_seed(seed, rows, cols, generator, loops, doors):
+    return frame(MSG_MAZE_SEED, MAZE_SEED.pack(seed, rows, cols, generator, loops, doors))
+
+
+# ---- decoding ------------------------------------------------------------
+
+class FrameReader:
+    """
+    Collects bytes from the socket and hands out complete binary frames.
+    Leftover bytes of a frame cut across reads stay in the buffer.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+        frames = []
+        pos = 0
+        while len(self.buf) - pos >= HEADER.size:
+            msg_type, length = HEADER.unpack_from(self.buf, pos)
+            end = pos + HEADER.size + length
+            if len(self.buf) < end:
+                break
+            frames.append((msg_type, bytes(self.buf[pos + HEADER.size:end])))
+            pos = end
+        del self.buf[:pos]
+        return frames
+
+
+def decode_welcome(payload):
+    # -> (version, pid, x, y, session token or None, tile version)
+    version, num, x, y = WELCOME.unpack_from(payload)
+    token, tile_version = None, 0
+    if len(payload) >= WELCOME.size + SESSION.size:
+        number, tile_version = SESSION.unpack_from(payload, WELCOME.size)
+        token = f"{number:016x}"
+    return version, int_to_pid(num), x, y, token, tile_version
+
+
+def decode_maze(payload):
+    # -> Grid
+    rows, cols = MAZE_HEAD.unpack_from(payload)
+    cells = unpack_cells(payload[MAZE_HEAD.size:], rows * cols)
+    return Grid(rows, cols, data=cells)
+
+
+def decode_maze_z(payload):
+    # -> Grid, in one decompress call
+    rows, cols = MAZE_HEAD.unpack_from(payload)
+    cells = zlib.decompress(payload[MAZE_HEAD.size:])
+    return Grid(rows, cols, data=bytearray(cells))
+
+
+def decode_text_maze(line):
+    # "MAZE rows cols data" -> Grid
+    _, rows, cols, data = line.split()
+    cells = zlib.decompress(base64.b64decode(data))
+    return Grid(int(rows), int(cols), data=bytearray(cells))
+
+
+def decode_hint(payload):
+    # -> (direction, distance)
+    index, distance = HINT.unpack(payload)
+    return HINT_DIRECTIONS[index], distance
+
+
+def decode_stats(payload):
+    # -> list of "metric value" lines
+    return payload.decode().split("\n")
+
+
+def decode_ack(payload):
+    # -> (seq, x, y)
+    return ACK.unpack(payload)
+
+
+def decode_maze_seed(payload):
+    # -> (seed, rows, cols, generator, loops, doors), maze_gen.generate builds it
+    return MAZE_SEED.unpack(payload)
+
+
+def decode_text_maze_seed(line):
+    # "MAZESEED seed rows cols generator loops doors" -> same as decode_maze_seed
+    return tuple(int(v) for v in line.split()[1:7])
+
+
+def decode_update(payload):
+    # -> (keyframe, tiles, gone, moved) in the same shapes binary_update takes
+    flags, n_tiles, n_gone, n_moved = UPDATE_HEAD.unpack_from(payload)
+    pos = UPDATE_HEAD.size
+
+    tiles = []
+    for (packed,) in TILE.iter_unpack(payload[pos:pos + n_tiles * TILE.size]):
+        tiles.append((packed >> 18, (packed >> 4) & MAX_COORD, packed & 0x0F))
+    pos += n_tiles * TILE.size
+
+    gone = [int_to_pid(num) for (num,) in GONE.iter_unpack(payload[pos:pos + n_gone * GONE.size])]
+    pos += n_gone * GONE.size
+
+    moved = [
+        (int_to_pid(num), x, y)
+        for num, x, y in MOVED.iter_unpack(payload[pos:pos + n_moved * MOVED.size])
+    ]
+    return bool(flags & FLAG_KEYFRAME), tiles, gone, moved
+
+
+def decode_tile_version(payload):
+    # tile version an UPDATE brings the client to, None if it doesn't say
+    if not UPDATE_HEAD.unpack_from(payload)[0] & FLAG_TILE_VERSION:
+        return None
+    return TILE_VERSION.unpack_from(payload, len(payload) - TILE_VERSION.size)[0]
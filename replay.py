@@ -0,0 +1,177 @@
+"""
+Replay a room journal (server.py --journal DIR) into a fresh GameState as
+fast as possible and check it ends up the same.
+
+    python replay.py journals/room1-1760000000000.mzj
+    python replay.py journals/*.mzj --repeat 5
+
+The maze is rebuilt from the seed in the journal, and GameState.clock
+is a virtual clock set to each record's time, so door timers run out
+exactly when they did in the match however fast the replay goes. Every
+move's end position and every batch of tile changes is compared with
+the journal. The timings are a benchmark of the game logic on real
+traffic, without sockets or broadcasts.
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import journal
+import maze_gen
+from server import GameState
+
+
+class VirtualClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class ReplayStats:
+    def __init__(self):
+        self.records = 0
+        self.moves = 0
+        self.joins = 0
+        self.leaves = 0
+        self.tiles = 0
+        self.mismatches = []      # (record number, what differs)
+        self.timings = {}         # record kind -> seconds per call
+        self.span = 0.0           # match time the journal covers
+        self.elapsed = 0.0        # time the replay took
+
+
+def load(path):
+    # every record in memory first, so reading the file isn't timed
+    records = list(journal.read(path))
+    if not records or records[0][0] != journal.START:
+        raise ValueError(f"{path} doesn't start with a START record")
+    return records
+
+
+def replay(records, stats):
+    """
+    Run records (from load()) through a new GameState, filling in stats.
+    Returns the GameState.
+    """
+    _, t0, (rows, cols, origin) = records[0]
+    seed, generator, loops, doors = origin
+    maze, door_list = maze_gen.generate(rows, cols, loops, doors, seed, generator)
+    clock = VirtualClock(t0)
+    state = GameState(rows, cols, maze, door_list, origin=origin)
+    state.clock = clock
+
+    def mismatch(n, what):
+        if len(stats.mismatches) < 100:
+            stats.mismatches.append((n, what))
+
+    timings = {kind: [] for kind in (journal.JOIN, journal.LEAVE, journal.MOVE, journal.BATCH, journal.DOORS)}
+    expected = []                 # tile changes of the last call, the next TILES has to match
+    perf = time.perf_counter
+    start = perf()
+    for n, (kind, t, fields) in enumerate(records[1:], 1):
+        clock.now = t
+        if kind == journal.ROOM:
+            continue              # only names the room
+        if kind == journal.TILES:
+            (tiles,) = fields
+            if tiles != expected:
+                mismatch(n, f"tiles {expected} instead of {tiles}")
+            expected = []
+            stats.tiles += len(tiles)
+            continue
+        if expected:
+            mismatch(n - 1, f"tiles {expected} that the journal doesn't have")
+            expected = []
+
+        call_start = perf()
+        if kind == journal.JOIN:
+            pid, _, _ = state.add_player()
+            stats.joins += 1
+            if pid != fields[0]:
+                mismatch(n, f"joined as {pid}, not {fields[0]}")
+        elif kind == journal.LEAVE:
+            with state.lock:
+                state.remove_player(fields[0])
+            stats.leaves += 1
+        elif kind == journal.MOVE:
+            pid, dx, dy, x, y = fields
+            rx, ry, expected = state.move_player(pid, dx, dy)
+            stats.moves += 1
+            if (rx, ry) != (x, y):
+                mismatch(n, f"{pid} moved to {rx},{ry}, not {x},{y}")
+        elif kind == journal.BATCH:
+            (steps,) = fields
+            expected, _ = state.apply_moves([(pid, dx, dy, None) for pid, dx, dy, _, _ in steps])
+            stats.moves += len(steps)
+            # the last step of every player says where it has to be now
+            ends = {pid: (x, y) for pid, _, _, x, y in steps}
+            for pid, pos in ends.items():
+                if tuple(state.players.get(pid, ())) != pos:
+                    mismatch(n, f"{pid} at {state.players.get(pid)} after the batch, not {pos}")
+        elif kind == journal.DOORS:
+            expected = state.expire_doors()
+        timings[kind].append(perf() - call_start)
+    if expected:
+        mismatch(len(records) - 1, f"tiles {expected} that the journal doesn't have")
+
+    stats.elapsed += perf() - start
+    stats.records += len(records)
+    stats.span += records[-1][1] - t0
+    for kind, values in timings.items():
+        stats.timings.setdefault(kind, []).extend(values)
+    return state
+
+
+NAMES = {
+    journal.JOIN: "join",
+    journal.LEAVE: "leave",
+    journal.MOVE: "move_player",
+    journal.BATCH: "apply_moves",
+    journal.DOORS: "expire_doors",
+}
+
+
+def report(stats):
+    rate = stats.records / stats.elapsed if stats.elapsed else 0
+    speedup = stats.span / stats.elapsed if stats.elapsed else 0
+    print(f"records: {stats.records} ({stats.joins} joins, {stats.leaves} leaves, "
+          f"{stats.moves} moves, {stats.tiles} tile changes)")
+    print(f"replayed {stats.span:.1f}s of play in {stats.elapsed * 1e3:.1f}ms, "
+          f"{rate:.0f} records/s, {speedup:.0f}x real time")
+    for kind, values in stats.timings.items():
+        if len(values) < 2:
+            continue
+        q = statistics.quantiles(values, n=100, method="inclusive")
+        print(f"{NAMES[kind]}: {len(values)} calls, p50 {q[49] * 1e6:.1f}us  "
+              f"p99 {q[98] * 1e6:.1f}us  max {max(values) * 1e6:.1f}us")
+    if stats.mismatches:
+        print(f"MISMATCH: replay differs from the journal in {len(stats.mismatches)} places")
+        for n, what in stats.mismatches[:10]:
+            print(f"  record {n}: {what}")
+    else:
+        print("replay matches the journal")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay maze lock room journals at full speed")
+    parser.add_argument("journals", nargs="+", help=".mzj files written by server.py --journal")
+    parser.add_argument("--repeat", type=int, default=1, help="replay every journal this many times")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stats = ReplayStats()
+    for path in args.journals:
+        records = load(path)
+        for _ in range(args.repeat):
+            replay(records, stats)
+    report(stats)
+    return 1 if stats.mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+import asyncio
+import secrets
+import threading
+import time
+
+
+class Room:
+    """
+    One match: a name, its own GameState (with its own lock) and whatever
+    background jobs the server started for it.
+    """
+
+    def __init__(self, name, state, auto):
+        self.name = name
+        self.state = state
+        self.auto = auto          # made by matchmaking, not asked for by name
+        self.members = 0          # connections that joined and haven't left
+        self.stop = None          # set by the server, stops the room's jobs
+
+    def __repr__(self):
+        return f"Room({self.name!r}, members={self.members})"
+
+
+class Session:
+    """
+    A player that can be taken back by a new connection with its token.
+    conn is the connection playing it, None while it waits for a RESUME,
+    expires is when it stops waiting.
+    """
+
+    def __init__(self, token, room, pid, conn):
+        self.token = token
+        self.room = room
+        self.pid = pid
+        self.conn = conn
+        self.expires = None
+
+    def __repr__(self):
+        return f"Session({self.room.name!r}, {self.pid!r}, waiting={self.conn is None})"
+
+
+class RoomManager:
+    """
+    Creates rooms on demand and tears them down when the last player leaves.
+
+    make_state(name) builds the GameState for a new room, join_async()
+    calls it in a worker thread so it may block. on_open(room) and
+    on_close(room) let the server start and stop the room's tick / door
+    timer jobs. capacity limits how many players matchmaking puts in one
+    room, 0 = no limit (everyone shares one maze).
+
+    grace is how many seconds a player whose connection dropped is kept
+    for a RESUME, 0 = players go with their connection. A waiting player
+    still counts as a member, so its room stays open.
+    """
+
+    def __init__(self, make_state, capacity=0, on_open=None, on_close=None, grace=0):
+        self.make_state = make_state
+        self.capacity = capacity
+        self.on_open = on_open
+        self.on_close = on_close
+        self.grace = grace
+
+        self.lock = threading.Lock()
+        self.rooms = {}           # name -> Room
+        self.next_auto = 1
+        self.sessions = {}        # token -> Session
+
+    def join(self, name=None):
+        """
+        Room for a new player: the named one (created if needed), or with
+        no name the first matchmaking room that still has space.
+        """
+        room, new_name = self._reserve(name)
+        if room is not None:
+            return room
+        # the maze and the rest of a new room are built without the lock,
+        # joins and leaves in other rooms don't wait for it
+        return self._publish(new_name, self.make_state(new_name), name is None)
+
+    async def join_async(self, name=None):
+        # join() for the asyncio server: a new room's state is built in a
+        # worker thread while the event loop keeps serving everyone else
+        room, new_name = self._reserve(name)
+        if room is not None:
+            return room
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(None, self.make_state, new_name)
+        return self._publish(new_name, state, name is None)
+
+    def _reserve(self, name):
+        # (room, name) with the player counted in when the room is there,
+        # else (None, name of the room to build)
+        with self.lock:
+            room = self._find(name)
+            if room is not None:
+                room.members += 1
+                return room, name
+            if name is None:
+                name = self._auto_name()
+            return None, name
+
+    def _publish(self, name, state, auto):
+        # a new room's state is ready, add the room unless another join
+        # opened it meanwhile
+        with self.lock:
+            room = self._find(None if auto else name)
+            new = room is None
+            if new:
+                if name in self.rooms:
+                    # a named room took the matchmaking name meanwhile
+                    name = self._auto_name()
+                room = self.rooms[name] = Room(name, state, auto)
+            room.members += 1
+
+        if new:
+            # nobody can close it before we leave, so the jobs start first
+            print(f"Room {name} opened")
+            if self.on_open is not None:
+                self.on_open(room)
+        elif self.on_close is not None:
+            # another join opened the room first, this state never got used
+            self.on_close(Room(name, state, auto))
+        return room
+
+    def leave(self, room):
+        # a player left, the last one out closes the room
+        with self.lock:
+            room.members -= 1
+            if room.members > 0 or self.rooms.get(room.name) is not room:
+                return
+            del self.rooms[room.name]
+        print(f"Room {room.name} closed")
+        if self.on_close is not None:
+            self.on_close(room)
+
+    # ---- sessions --------------------------------------------------------
+
+    def open_session(self, room, pid, conn):
+        # token for a player that just joined, None when there's no grace period
+        if not self.grace:
+            return None
+        token = secrets.token_hex(8)
+        with self.lock:
+            self.sessions[token] = Session(token, room, pid, conn)
+        return token
+
+    def claim(self, token, conn):
+        """
+        Hand the session of a RESUME over to conn. Returns (session,
+        connection that had it before) - the old one is only there when
+        the server didn't notice it died yet, the caller closes it.
+        (None, None) when the token is unknown or ran out.
+        """
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None, None
+            old, session.conn = session.conn, conn
+            session.expires = None
+            return session, old
+
+    def detach(self, token, conn):
+        """
+        conn dropped. Returns True when its player is kept for a RESUME
+        (or was already taken over by another connection), False when the
+        caller should remove it as usual.
+        """
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return False
+            if session.conn is conn:
+                session.conn = None
+                session.expires = time.monotonic() + self.grace
+            return True
+
+    def has_session(self, token):
+        with self.lock:
+            return token in self.sessions
+
+    def end_session(self, token):
+        # the player quit, nothing to wait for
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    def expire(self, now=None):
+        # forget sessions nobody resumed in time, the caller removes their players
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            gone = [
+                s for s in self.sessions.values()
+                if s.conn is None and s.expires <= now
+            ]
+            for session in gone:
+                del self.sessions[session.token]
+        return gone
+
+    def snapshot(self):
+        with self.lock:
+            return tuple(self.rooms.values())
+
+    def _find(self, name):
+        # caller holds the lock. the named room, with no name the first
+        # matchmaking room that still has space, None = open a new one
+        if name is not None:
+            return self.rooms.get(name)
+        for room in self.rooms.values():
+            if room.auto and (not self.capacity or room.members < self.capacity):
+                return room
+        return None
+
+    def _auto_name(self):
+        # caller holds the lock
+        while f"room{self.next_auto}" in self.rooms:
+            self.next_auto += 1
+        name = f"room{self.next_auto}"
+        self.next_auto += 1
+        return name
@@ -0,0 +1,179 @@
+"""
+Fair input scheduling: every player gets a move budget that refills as
+time passes (a token bucket), so one client flooding MOVE lines can't
+keep the room's lock away from everyone else.
+
+In tick mode moves wait in a queue per player and each tick serves the
+players round-robin, one move each per round, while they have budget
+left. Moves over the budget wait for a later tick; once a player has
+max_queued moves waiting, new ones are dropped. Without ticks there is
+nothing to wait for, moves over the budget are dropped right away.
+
+backoff() tells a client's reader how long to stop reading once the
+player is out of budget: what it sends meanwhile waits in the socket
+buffers (TCP pushes back on the client) instead of costing the server
+a parse per line just to drop it.
+
+Moves are (dx, dy, seq) with seq None for moves that want no ACK. When
+a sequenced move is dropped its seq goes to the last move that does get
+applied, so the client still hears where it ended up.
+"""
+import threading
+import time
+from collections import deque
+
+import metrics
+
+MOVES_DROPPED = metrics.counter(
+    "maze_moves_dropped_total", "moves thrown away, over the budget or the queue limit", "reason")
+MOVES_DELAYED = metrics.counter(
+    "maze_moves_delayed_total", "queued moves left over at the end of a tick, once per tick they wait")
+
+# seconds a reader waits on a full queue when there is no rate to go by
+QUEUE_BACKOFF = 0.01
+
+
+def _carry_seq(kept, dropped):
+    """
+    Move the newest seq in dropped onto the last kept move. Returns the
+    seq when there is no kept move to carry it, else None.
+    """
+    seqs = [seq for _, _, seq in dropped if seq is not None]
+    if not seqs:
+        return None
+    if not kept:
+        return seqs[-1]
+    dx, dy, _ = kept[-1]
+    kept[-1] = (dx, dy, seqs[-1])
+    return None
+
+
+class PlayerInput:
+    def __init__(self, tokens, now):
+        self.moves = deque()      # (dx, dy, seq) waiting for a tick
+        self.tokens = tokens      # moves allowed right now, fractions add up
+        self.refilled = now
+
+
+class MoveScheduler:
+    """
+    rate is moves per second per player (0 = no budget, round-robin
+    only), burst how many of them can be spent at once after a quiet
+    spell, max_queued how many moves a player may have waiting in tick mode.
+    """
+
+    def __init__(self, rate=0, burst=1, max_queued=32):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_queued = max(1, max_queued)
+        self.players = {}         # pid -> PlayerInput
+        self.turn = 0             # who goes first, moves on every tick
+        # pushes come from client handlers, take() from the tick
+        self.lock = threading.Lock()
+
+    def _player(self, pid, now):
+        # caller holds the lock
+        player = self.players.get(pid)
+        if player is None:
+            player = self.players[pid] = PlayerInput(self.burst, now)
+        elif self.rate:
+            player.tokens = min(self.burst, player.tokens + max(0.0, now - player.refilled) * self.rate)
+        player.refilled = now
+        return player
+
+    def admit(self, pid, moves, now=None):
+        """
+        Immediate mode: the leading moves the budget allows, the rest
+        is dropped. Returns (admitted, seq): seq is a dropped sequence
+        number nothing admitted could carry, the caller acks it with
+        the player's current position. None otherwise.
+        """
+        if not self.rate:
+            return moves, None
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            player = self._player(pid, now)
+            n = min(len(moves), int(player.tokens))
+            player.tokens -= n
+        if n == len(moves):
+            return moves, None
+        kept, dropped = moves[:n], moves[n:]
+        MOVES_DROPPED.inc("budget", len(dropped))
+        return kept, _carry_seq(kept, dropped)
+
+    def push(self, pid, moves):
+        # tick mode: queue moves for the coming ticks, drop what doesn't fit
+        with self.lock:
+            player = self._player(pid, time.monotonic())
+            room = self.max_queued - len(player.moves)
+            kept, dropped = list(moves[:room]), moves[room:]
+            if dropped:
+                if not kept and player.moves:
+                    kept = [player.moves.pop()]
+                _carry_seq(kept, dropped)
+                MOVES_DROPPED.inc("queue", len(dropped))
+            player.moves.extend(kept)
+
+    def take(self, now=None):
+        """
+        The moves one tick applies, as (pid, dx, dy, seq) in order: every
+        player with something queued gets one move per round until its
+        budget or its queue runs out. Who goes first rotates.
+        """
+        if now is None:
+            now = time.monotonic()
+        out = []
+        with self.lock:
+            waiting = [pid for pid, player in self.players.items() if player.moves]
+            if not waiting:
+                return out
+            start = self.turn % len(waiting)
+            self.turn += 1
+            order = [(pid, self._player(pid, now)) for pid in waiting[start:] + waiting[:start]]
+            players = [player for _, player in order]
+            while order:
+                still = []
+                for pid, player in order:
+                    if self.rate:
+                        if player.tokens < 1:
+                            continue
+                        player.tokens -= 1
+                    dx, dy, seq = player.moves.popleft()
+                    out.append((pid, dx, dy, seq))
+                    if player.moves:
+                        still.append((pid, player))
+                order = still
+            left = sum(len(player.moves) for player in players)
+        if left:
+            MOVES_DELAYED.inc(n=left)
+        return out
+
+    def backoff(self, pid, now=None):
+        """
+        Seconds before this player can make another move: its queue is
+        full, or nothing is queued and the budget is spent. 0 = go on.
+        """
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            player = self.players.get(pid)
+            if player is None:
+                return 0.0
+            if player.moves and len(player.moves) < self.max_queued:
+                return 0.0
+            if not self.rate:
+                return QUEUE_BACKOFF if player.moves else 0.0
+            self._player(pid, now)
+            if player.moves:
+                return max(0.0, 1 - player.tokens) / self.rate or QUEUE_BACKOFF
+            return max(0.0, 1 - player.tokens) / self.rate
+
+    def remove(self, pid):
+        with self.lock:
+            self.players.pop(pid, None)
+
+    def depths(self):
+        # pid -> moves waiting, for players that have any
+        with self.lock:
+            return {pid: len(player.moves) for pid, player in self.players.items() if player.moves}
@@ -1,20 +1,210 @@
+import argparse
+import asyncio
+import itertools
+import re
 import socket
 import threading
-import random, time, statistics
+import heapq
+import os
+import signal
+import time, statistics
+import zlib
+
+import maze_gen
+import metrics
+from journal import Journal
+from maze_pool import MazePool
+from pathing import PathField
+import protocol
+from rooms import RoomManager
+from scheduler import MoveScheduler
+from spatial import InterestManager
+from connection import (
+    ClientConn, DEFAULT_MAX_FRAMES, SLOW_POLICIES, writer_loop, writer_task,
+)
 
 HOST = "0.0.0.0"
 PORT = 5001
 
+# pending connections the OS will queue for us, large so join storms
+# don't get refused
+LISTEN_BACKLOG = 1024
+# threaded server: accept() wakes up this often to see if it should stop
+ACCEPT_TIMEOUT = 0.5
+# asyncio server: how long a shutdown waits for the connections to close
+CLOSE_TIMEOUT = 1.0
+
+# journal file names only keep these characters of a room name, room
+# names come from clients
+JOURNAL_UNSAFE = re.compile(r"[^A-Za-z0-9_-]")
+JOURNAL_NAME_MAX = 40
+
+# seconds between full position dumps, everything in between is deltas
+KEYFRAME_INTERVAL = 5.0
+
+# how long a door stays red after the first player enters it
+DOOR_LOCK_SECONDS = 5.0
+
+# default door count is DOOR_COUNT for the 51x51 maze and scales with area
+DOOR_COUNT = 15
+CELLS_PER_DOOR = 170
+
+# extra openings so only a few alternate paths exist
+LOOP_COUNT = 10
+
+# per player move budget: moves a second, how many can come at once, and
+# how many may wait for a tick before new ones are dropped
+MOVE_RATE = 30
+MOVE_BURST = 10
+MAX_QUEUED_MOVES = 32
+
+# seconds a dropped player waits for a RESUME, and how often we look for
+# ones that waited long enough
+RESUME_GRACE = 30.0
+SESSION_CHECK_INTERVAL = 1.0
+
+# commands counted by name in maze_messages_in_total, anything else is "other"
+COMMANDS = ("JOIN", "RESUME", "MOVE", "MOVES", "HINT", "STATS", "QUIT")
+
+MESSAGES_IN = metrics.counter(
+    "maze_messages_in_total", "command lines received from clients, by type", "type")
+MOVE_SECONDS = metrics.histogram(
+    "maze_move_player_seconds", "GameState.move_player calls, lock wait included")
+APPLY_SECONDS = metrics.histogram(
+    "maze_apply_moves_seconds", "one tick's or one client's batch of moves, lock wait included")
+MOVE_BATCHES = metrics.counter(
+    "maze_move_batches_total", "batches of one client's moves applied together outside tick mode")
+BATCHED_MOVES = metrics.counter("maze_batched_moves_total", "moves in those batches")
+LOCK_WAIT = metrics.histogram("maze_lock_wait_seconds", "waiting to acquire a GameState.lock")
+LOCK_HOLD = metrics.histogram("maze_lock_hold_seconds", "GameState.lock held per acquire")
+FANOUT_SECONDS = metrics.histogram(
+    "maze_fanout_seconds", "encoding and queueing one broadcast for its clients")
+RESUMES = metrics.counter(
+    "maze_resumes_total", "RESUME lines, by whether the player was still there", "outcome")
+CONNECTIONS = metrics.gauge("maze_connections", "open client connections")
+
+
+class TimedLock:
+    """
+    threading.Lock that measures how long callers wait for it and how
+    long they hold it. The counters are only touched while the lock is
+    held, so they need no extra locking. Every acquire also goes into the
+    LOCK_WAIT / LOCK_HOLD histograms, after the lock is released.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acquired_at = 0.0
+        self._wait = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.acquires = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        self._acquired_at = now = time.perf_counter()
+        self._wait = wait = now - start
+        self.acquires += 1
+        self.wait_total += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+        return self
+
+    def __exit__(self, *exc):
+        hold = time.perf_counter() - self._acquired_at
+        wait = self._wait
+        self.hold_total += hold
+        if hold > self.hold_max:
+            self.hold_max = hold
+        self._lock.release()
+        LOCK_WAIT.observe(wait)
+        LOCK_HOLD.observe(hold)
+
+    def stats(self, reset=False):
+        # dict of the counters, optionally starting a new window
+        with self._lock:
+            n = self.acquires or 1
+            stats = {
+                "acquires": self.acquires,
+                "wait_avg": self.wait_total / n,
+                "wait_max": self.wait_max,
+                "hold_avg": self.hold_total / n,
+                "hold_max": self.hold_max,
+            }
+            if reset:
+                self.reset_stats()
+        return stats
+
+
+def format_lock_stats(stats):
+    return (
+        f"lock: {stats['acquires']} acquires, "
+        f"wait avg {stats['wait_avg'] * 1e3:.3f}ms max {stats['wait_max'] * 1e3:.3f}ms, "
+        f"hold avg {stats['hold_avg'] * 1e3:.3f}ms max {stats['hold_max'] * 1e3:.3f}ms"
+    )
+
 
 class GameState:
-    def __init__(self, rows, cols, maze, doors):
+    def __init__(self, rows, cols, maze, doors, tick_hz=0, aoi_radius=0, origin=None, scheduler=None, paths=None):
         self.rows = rows
         self.cols = cols
-        self.maze = maze          # 2D list
+        self.maze = maze          # Grid, flat bytearray of cells
+        # (seed, generator, loops, doors) the maze was built from, lets
+        # clients rebuild it instead of downloading it. None = unknown
+        self.origin = origin
         self.players = {}         # player_id -> [x, y]
-        self.conns = {}           # player_id -> socket
+        self.conns = {}           # player_id -> ClientConn
         self.next_id = 1
-        self.lock = threading.Lock()
+
+        # only guards game state, never held while touching sockets
+        self.lock = TimedLock()
+        # keeps position deltas queued in the order they were taken and
+        # tile versions in the order frames go out, game code never waits on it
+        self.broadcast_lock = threading.Lock()
+
+        # tick mode: 0 = apply every MOVE right away,
+        # otherwise moves queue up and are applied tick_hz times a second
+        self.tick_hz = tick_hz
+        # tick mode: tile changes the door timer made between ticks,
+        # they go out with the next tick's frame
+        self.deferred_tiles = []
+        # move budgets, and the per player queues in tick mode
+        self.scheduler = scheduler if scheduler is not None else MoveScheduler()
+
+        # bumped on every tile change, the cached JOIN snapshot is only
+        # rebuilt when this moved on
+        self.maze_version = 0
+        self.snapshot_cache = None     # (maze_version, compressed cells)
+        # (x, y) -> value for every tile changed since generation,
+        # what a client that rebuilt the maze from its seed is missing
+        self.changed_tiles = {}
+        # every frame with tiles bumps tile_version, tile_log holds
+        # (x, y) -> (version, value) of each tile's last change so a
+        # RESUME only gets what changed since the version it saw.
+        # both only change under broadcast_lock, in the order frames go out
+        self.tile_version = 0
+        self.tile_log = {}
+
+        # delta position updates: who moved / left since the last broadcast
+        self.dirty = set()
+        self.gone = set()
+        self.last_keyframe = time.monotonic()
+
+        # area of interest: with a radius, clients only hear about players
+        # and tiles near them. None = everyone gets everything
+        self.interest = InterestManager(aoi_radius) if aoi_radius else None
+
+        # distance to the exit from every cell, for hints, bots and the
+        # red zone around doors. doors count as open: a lock only lasts
+        # DOOR_LOCK_SECONDS, waiting beats any detour. built here unless
+        # the maze pool already built it in a worker
+        self.paths = paths if paths is not None else PathField(maze)
 
         # door positions as a set of (x, y)
         self.doors = set(doors)
@@ -28,15 +218,178 @@ class GameState:
         # door position -> list of highlight tiles (including the door)
         self.door_highlights = {pos: [] for pos in self.doors}
 
+        # min-heap of (lock_until, door_pos) for running door timers
+        self.door_timers = []
+        # called when a new timer starts, wakes up the door timer loop
+        self.on_door_timer = None
+
+        # game time for moves and door timers, replay.py swaps in a
+        # virtual clock
+        self.clock = time.time
+        # journal.Journal recording this room, None = not recorded
+        self.journal = None
+
+    def start_journal(self, journal):
+        # record this room from now on, the journal starts from the maze's seed
+        if self.origin is None:
+            raise ValueError("only rooms built from a seed can be journaled")
+        with self.lock:
+            self.journal = journal
+            journal.start(self.clock(), self.rows, self.cols, self.origin)
+
     def add_player(self):
         # create a new player at starting position 1,1
         with self.lock:
             pid = f"p{self.next_id}"
             self.next_id += 1
             self.players[pid] = [1, 1]
+            self.dirty.add(pid)
+            if self.interest is not None:
+                self.interest.add(pid, 1, 1)
+            if self.journal is not None:
+                self.journal.join(self.clock(), pid)
             return pid, 1, 1
-    
-    
+
+    def remove_player(self, pid):
+        # forget a player and its connection, caller holds the lock
+        self.conns.pop(pid, None)
+        self.scheduler.remove(pid)
+        pos = self.players.pop(pid, None)
+        if pos is not None:
+            self.gone.add(pid)
+            if self.interest is not None:
+                self.interest.remove(pid, *pos)
+            if self.journal is not None:
+                self.journal.leave(self.clock(), pid)
+
+    def detach_player(self, pid, conn):
+        # caller holds the lock: conn is gone but its player stays for a
+        # RESUME. moves it still had queued go, nobody is there to make them
+        if self.conns.get(pid) is conn:
+            del self.conns[pid]
+            self.scheduler.remove(pid)
+
+    def known_players(self, pid):
+        # (pid, x, y) for every player this client should currently know about
+        with self.lock:
+            return self._known_players(pid)
+
+    def _known_players(self, pid):
+        # caller holds the lock
+        if self.interest is None:
+            return tuple((p, x, y) for p, (x, y) in self.players.items())
+        return self.interest.known(pid, self.players)
+
+    def snapshot_players(self):
+        # immutable copy of every position, safe to use without the lock
+        with self.lock:
+            return tuple((pid, x, y) for pid, (x, y) in self.players.items())
+
+    def maze_snapshot(self):
+        """
+        (version, compressed cells) of the current maze. The copy is taken
+        under the lock, compression happens outside of it, and the result
+        is cached until a tile changes.
+        """
+        with self.lock:
+            version = self.maze_version
+            cached = self.snapshot_cache
+            if cached is not None and cached[0] == version:
+                return cached
+            # one memcpy of the flat grid
+            cells = bytes(self.maze.view())
+
+        snapshot = (version, protocol.compress_cells(cells))
+        with self.lock:
+            if self.maze_version == version:
+                self.snapshot_cache = snapshot
+        return snapshot
+
+    def snapshot_conns(self):
+        with self.lock:
+            return tuple(self.conns.items())
+
+    def _keyframe_due(self):
+        # caller holds the lock
+        now = time.monotonic()
+        if now - self.last_keyframe >= KEYFRAME_INTERVAL:
+            self.last_keyframe = now
+            return True
+        return False
+
+    def take_changes(self):
+        """
+        Everything the next position broadcast needs, copied under the lock:
+        (keyframe, gone, moved, conns). moved holds (pid, x, y) for the players
+        that moved since the last call, or every player when it's time for a
+        keyframe.
+        """
+        with self.lock:
+            keyframe = self._keyframe_due()
+            if keyframe:
+                moved = tuple((pid, x, y) for pid, (x, y) in self.players.items())
+                gone = ()
+            else:
+                moved = tuple(
+                    (pid,) + tuple(self.players[pid])
+                    for pid in self.dirty if pid in self.players
+                )
+                gone = tuple(self.gone)
+            self.dirty.clear()
+            self.gone.clear()
+            return keyframe, gone, moved, tuple(self.conns.items())
+
+    def take_updates(self, tiles):
+        """
+        take_changes with an area of interest: a list of (pid, conn, Update)
+        for every client that has something to hear about, tiles included.
+        """
+        with self.lock:
+            keyframe = self._keyframe_due()
+            updates = self.interest.collect(self.players, self.dirty, self.gone, tiles, keyframe)
+            self.dirty.clear()
+            self.gone.clear()
+            return [
+                (pid, self.conns[pid], update)
+                for pid, update in updates.items() if pid in self.conns
+            ]
+
+    def log_tiles(self, tiles):
+        # caller holds broadcast_lock: the version the frame with tiles brings clients to
+        self.tile_version += 1
+        version = self.tile_version
+        for x, y, value in tiles:
+            self.tile_log[(x, y)] = (version, value)
+        return version
+
+    def tiles_since(self, seen):
+        # caller holds broadcast_lock: (x, y, value) changed after version seen
+        if seen >= self.tile_version:
+            return ()
+        return tuple((x, y, value) for (x, y), (version, value) in self.tile_log.items() if version > seen)
+
+    def queue_moves(self, pid, moves):
+        # tick mode: remember the (dx, dy, seq) moves, the next ticks apply them
+        self.scheduler.push(pid, moves)
+
+    def take_moves(self):
+        # this tick's share of everything queued, players served round-robin
+        return self.scheduler.take()
+
+    def defer_tiles(self, tiles):
+        if tiles:
+            with self.lock:
+                self.deferred_tiles.extend(tiles)
+
+    def take_deferred_tiles(self):
+        with self.lock:
+            tiles, self.deferred_tiles = self.deferred_tiles, []
+            return tiles
+
+    def position(self, pid):
+        with self.lock:
+            return tuple(self.players.get(pid, (0, 0)))
+
     def move_player(self, pid, dx, dy):
         """
         Timer starts when FIRST player ENTERS the door.
@@ -51,119 +404,142 @@ class GameState:
             * red tiles are cleared
             * door is removed, path becomes normal
         """
+        start = time.perf_counter()
         with self.lock:
-            now = time.time()
+            now = self.clock()
 
             # clear any doors whose timer expired
             tile_updates = self.refresh_doors(now)
 
-            # if somehow pid vanished, just do nothing but still return correctly
-            if pid not in self.players:
-                return 0, 0, tile_updates
-
-            x, y = self.players[pid]
-            nx = x + dx
-            ny = y + dy
-
-            # check bounds
-            if not (0 <= nx < self.cols and 0 <= ny < self.rows):
-                return x, y, tile_updates
-
-            current_pos = (x, y)
-            target_pos = (nx, ny)
-
-            current_cell = self.maze[y][x]
-            target_cell = self.maze[ny][nx]
-
-            current_is_door = current_pos in self.doors
-            target_is_door = target_pos in self.doors
-
-            # helper: can this player enter target door tile?
-            def door_is_free(door_pos, player_id):
-                lock_until = self.door_lock_until.get(door_pos, 0.0)
-                occ = self.door_occupant.get(door_pos)
+            x, y = self._step(pid, dx, dy, now, tile_updates)
+            if self.journal is not None:
+                self.journal.move(now, pid, dx, dy, x, y)
+                self.journal.tiles(now, tile_updates)
+        MOVE_SECONDS.observe(time.perf_counter() - start)
+        return x, y, tile_updates
 
-                # timer active -> locked for everyone except occupant
-                if lock_until and now < lock_until:
-                    if occ == player_id:
-                        return True
-                    return False
+    def apply_moves(self, moves):
+        """
+        Apply a batch of queued (pid, dx, dy, seq) moves in order, holding
+        the lock once for the whole batch.
+        Returns (tile_updates, acks): the combined list of (x, y, new_value)
+        tile updates and (conn, seq, x, y) for the last sequenced move of
+        every player.
+        """
+        start = time.perf_counter()
+        last = {}
+        steps = [] if self.journal is not None else None
+        with self.lock:
+            now = self.clock()
+            tile_updates = self.refresh_doors(now)
+            for pid, dx, dy, seq in moves:
+                x, y = self._step(pid, dx, dy, now, tile_updates)
+                if seq is not None:
+                    last[pid] = (seq, x, y)
+                if steps is not None:
+                    steps.append((pid, dx, dy, x, y))
+            if steps is not None:
+                self.journal.batch(now, steps)
+                self.journal.tiles(now, tile_updates)
+            acks = [(self.conns[pid],) + ack for pid, ack in last.items() if pid in self.conns]
+        APPLY_SECONDS.observe(time.perf_counter() - start)
+        return tile_updates, acks
+
+    def _step(self, pid, dx, dy, now, tile_updates):
+        # single move, caller holds the lock.
+        # appends any red tiles to tile_updates and returns the new x, y
+
+        # if somehow pid vanished, just do nothing but still return correctly
+        if pid not in self.players:
+            return 0, 0
+
+        x, y = self.players[pid]
+        nx = x + dx
+        ny = y + dy
+
+        # check bounds
+        if not (0 <= nx < self.cols and 0 <= ny < self.rows):
+            return x, y
+
+        current_pos = (x, y)
+        target_pos = (nx, ny)
+
+        current_cell = self.maze.get(x, y)
+        target_cell = self.maze.get(nx, ny)
+
+        current_is_door = current_pos in self.doors
+        target_is_door = target_pos in self.doors
+
+        # helper: can this player enter target door tile?
+        def door_is_free(door_pos, player_id):
+            lock_until = self.door_lock_until.get(door_pos, 0.0)
+            occ = self.door_occupant.get(door_pos)
 
-                # no timer -> free if no occupant or same player
-                if occ is None:
+            # timer active -> locked for everyone except occupant
+            if lock_until and now < lock_until:
+                if occ == player_id:
                     return True
-                return occ == player_id
-
-            # walls always block
-            if target_cell == 1:
-                return x, y, tile_updates
-
-            # entering a door tile
-            if target_is_door:
-                if not door_is_free(target_pos, pid):
-                    # locked for this player
-                    return x, y, tile_updates
-
-            # movement allowed
-            self.players[pid] = [nx, ny]
-
-            # we do NOT start timer on leaving in this option,
-            # only on first ENTER, so nothing special needed here
-            # when current_is_door and current_pos != target_pos.
-
-            # if we entered a door for the first time, start timer + build red area
-            if target_is_door:
-                # only if no timer already running and no occupant yet
-                if (self.door_occupant.get(target_pos) is None and
-                        self.door_lock_until.get(target_pos, 0.0) == 0.0):
-
-                    # this player owns the door
-                    self.door_occupant[target_pos] = pid
-
-                    # start 5 second lock timer immediately
-                    self.door_lock_until[target_pos] = now + 5.0
-
-                    # we want up to five red tiles total
-                    max_red = 5  # door + nearby paths
-
-                    dxdy = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-                    highlights = [target_pos]          # include door tile
-                    visited = {target_pos}
-                    queue = [target_pos]
-
-                    # BFS around the door to find nearby path tiles
-                    while len(highlights) < max_red and queue:
-                        cx, cy = queue.pop(0)
-
-                        for ddx, ddy in dxdy:
-                            sx = cx + ddx
-                            sy = cy + ddy
-
-                            if not (0 <= sx < self.cols and 0 <= sy < self.rows):
-                                continue
-                            pos = (sx, sy)
-                            if pos in visited:
-                                continue
-                            visited.add(pos)
-
-                            cell_here = self.maze[sy][sx]
-
-                            # only normal path tiles become extra red tiles
-                            if cell_here == 0:
-                                highlights.append(pos)
-                                queue.append(pos)
-
-                            # do not cross walls / exit / other doors
-
-                    # remember which tiles belong to this door's red zone
-                    self.door_highlights[target_pos] = highlights
-
-                    # paint them red (4) and report updates
-                    for hx, hy in highlights:
-                        self.maze[hy][hx] = 4
-                        tile_updates.append((hx, hy, 4))
+                return False
+
+            # no timer -> free if no occupant or same player
+            if occ is None:
+                return True
+            return occ == player_id
+
+        # walls always block
+        if target_cell == 1:
+            return x, y
+
+        # entering a door tile
+        if target_is_door:
+            if not door_is_free(target_pos, pid):
+                # locked for this player
+                return x, y
+
+        # movement allowed
+        self.players[pid] = [nx, ny]
+        self.dirty.add(pid)
+        if self.interest is not None:
+            self.interest.move(pid, x, y, nx, ny)
+
+        # we do NOT start timer on leaving in this option,
+        # only on first ENTER, so nothing special needed here
+        # when current_is_door and current_pos != target_pos.
+
+        # if we entered a door for the first time, start timer + build red area
+        if target_is_door:
+            # only if no timer already running and no occupant yet
+            if (self.door_occupant.get(target_pos) is None and
+                    self.door_lock_until.get(target_pos, 0.0) == 0.0):
+
+                # this player owns the door
+                self.door_occupant[target_pos] = pid
+
+                # start 5 second lock timer immediately
+                self.door_lock_until[target_pos] = now + DOOR_LOCK_SECONDS
+                heapq.heappush(self.door_timers, (now + DOOR_LOCK_SECONDS, target_pos))
+                if self.on_door_timer is not None:
+                    self.on_door_timer()
+
+                # we want up to five red tiles total
+                max_red = 5  # door + nearby paths
+
+                # door first, then the nearest path tiles, without crossing
+                # walls / exit / other doors
+                highlights = self.paths.zone(nx, ny, max_red, lambda value: value == 0)
+
+                # remember which tiles belong to this door's red zone
+                self.door_highlights[target_pos] = highlights
+
+                # paint them red (4) and report updates
+                for hx, hy in highlights:
+                    self.maze.set(hx, hy, 4)
+                    self.paths.set_tile(hx, hy, 4)
+                    self.changed_tiles[(hx, hy)] = 4
+                    tile_updates.append((hx, hy, 4))
+                self.maze_version += 1
 
-            return nx, ny, tile_updates
+        return nx, ny
 
 #for if we want to use option 2 instead when the timer starts right away when entering the door
         #     def move_player(self, pid, dx, dy):
@@ -270,274 +646,1112 @@ class GameState:
         """
         tile_updates = []
 
-        for door_pos in list(self.doors):
-            lock_until = self.door_lock_until.get(door_pos, 0.0)
-            if lock_until and now >= lock_until:
-                # timer finished: remove all red tiles and the door itself
-                highlights = self.door_highlights.get(door_pos, [])
-                for hx, hy in highlights:
-                    if self.maze[hy][hx] == 4:   # still red
-                        self.maze[hy][hx] = 0     # back to normal path
-                        tile_updates.append((hx, hy, 0))
-
-                # clean up door data
-                self.door_highlights.pop(door_pos, None)
-                self.door_occupant.pop(door_pos, None)
-                self.door_lock_until[door_pos] = 0.0
-                self.doors.remove(door_pos)
+        # only doors at the top of the heap can be due,
+        # so this is O(log n) per expired door instead of a scan
+        while self.door_timers and self.door_timers[0][0] <= now:
+            lock_until, door_pos = heapq.heappop(self.door_timers)
+            if self.door_lock_until.get(door_pos) != lock_until:
+                continue   # stale entry, door already cleared
+
+            # timer finished: remove all red tiles and the door itself
+            highlights = self.door_highlights.get(door_pos, [])
+            for hx, hy in highlights:
+                if self.maze.get(hx, hy) == 4:   # still red
+                    self.maze.set(hx, hy, 0)     # back to normal path
+                    self.paths.set_tile(hx, hy, 0)
+                    self.changed_tiles[(hx, hy)] = 0
+                    tile_updates.append((hx, hy, 0))
+
+            self.maze_version += 1
+
+            # clean up door data
+            self.door_highlights.pop(door_pos, None)
+            self.door_occupant.pop(door_pos, None)
+            self.door_lock_until[door_pos] = 0.0
+            self.doors.remove(door_pos)
 
         return tile_updates
 
-def broadcast_positions(game_state):
+    def red_tiles(self):
+        # tiles currently painted red around used doors, read without the lock
+        return sum(len(tiles) for tiles in list(self.door_highlights.values()))
+
+    def hint(self, pid):
+        # (direction, steps to the exit) for a player, ("NONE", -1) if there is no way
+        with self.lock:
+            if pid not in self.players:
+                return "NONE", -1
+            x, y = self.players[pid]
+            step = self.paths.next_step(x, y)
+            return (step[0] if step else "NONE"), self.paths.distance(x, y)
+
+    def next_door_expiry(self):
+        # wall clock time the next door timer runs out, None if no timer runs
+        with self.lock:
+            if self.door_timers:
+                return self.door_timers[0][0]
+            return None
+
+    def expire_doors(self):
+        # clear every door that is due right now, returns the tile updates
+        with self.lock:
+            now = self.clock()
+            tile_updates = self.refresh_doors(now)
+            if self.journal is not None and tile_updates:
+                self.journal.doors(now)
+                self.journal.tiles(now, tile_updates)
+            return tile_updates
+
+def drop_dead(game_state, dead):
+    # forget players whose socket failed, (pid, conn) pairs. a player with
+    # a session only loses its connection and waits for a RESUME
     with game_state.lock:
-        lines = []
-        for pid, (x, y) in game_state.players.items():
-            lines.append(f"POS {pid} {x} {y}")
-        msg = "\n".join(lines) + "\n"
+        for pid, conn in dead:
+            if game_state.conns.get(pid) is not conn:
+                continue
+            if conn.session is not None:
+                game_state.detach_player(pid, conn)
+            else:
+                game_state.remove_player(pid)
 
-        dead = []
-        for pid, conn in game_state.conns.items():
-            try:
-                conn.sendall(msg.encode())
-            except OSError:
-                dead.append(pid)
 
-        for pid in dead:
-            conn = game_state.conns.pop(pid, None)
-            game_state.players.pop(pid, None)
-            if conn is not None:
-                try:
-                    conn.close()
-                except OSError:
-                    pass
+# (keyframe, gone, moved) for frames that carry no position changes
+NO_CHANGES = (False, (), ())
 
 
-def broadcast_tile(game_state, x, y, value):
-    msg = f"TILE {x} {y} {value}\n"
-    with game_state.lock:
-        dead = []
-        for pid, conn in game_state.conns.items():
-            try:
-                conn.sendall(msg.encode())
-            except OSError:
-                dead.append(pid)
+def encode_update(version, tiles, changes, tile_version=None):
+    # one update frame in the connection's protocol, 0 = text.
+    # tile_version only goes to clients that know sessions
+    keyframe, gone, moved = changes
+    if version:
+        if version < 3:
+            tile_version = None
+        return protocol.binary_update(tiles, keyframe, gone, moved, tile_version)
+    return protocol.text_update(tiles, keyframe, gone, moved, tile_version)
 
-        for pid in dead:
-            conn = game_state.conns.pop(pid, None)
-            game_state.players.pop(pid, None)
-            if conn is not None:
-                try:
-                    conn.close()
-                except OSError:
-                    pass
 
+def fan_out(game_state, conns, tiles, changes=NO_CHANGES, tile_version=None):
+    """
+    Queue one update frame for every client in the conns snapshot.
+    Runs without the game lock, each encoding is built at most once.
+    Every KEYFRAME_INTERVAL seconds changes is a full keyframe so
+    clients can resync. tile_version is what log_tiles() gave the tiles.
+    """
+    keyframe, gone, moved = changes
+    if not tiles and not keyframe and not gone and not moved:
+        return
+    kind = "FRAME" if tiles else "POS"
+    encoded = {}
+    start = time.perf_counter()
+
+    dead = []
+    for pid, conn in conns:
+        msg = encoded.get(conn.version)
+        if msg is None:
+            msg = encoded[conn.version] = encode_update(conn.version, tiles, changes, tile_version)
+        try:
+            conn.send(msg, kind)
+        except OSError:
+            dead.append((pid, conn))
+            conn.close()
+    FANOUT_SECONDS.observe(time.perf_counter() - start)
+
+    if dead:
+        drop_dead(game_state, dead)
 
-def handle_client(conn, addr, game_state):
-    print("Client connected", addr)
-    buf = b""
-    pid = None
 
+def fan_out_interest(game_state, updates):
+    # area of interest version of fan_out, every client gets its own frame
+    dead = []
+    start = time.perf_counter()
+    for pid, conn, update in updates:
+        moved = tuple((p, x, y) for p, (x, y) in update.moved.items())
+        changes = (update.keyframe, tuple(update.gone), moved)
+        kind = "FRAME" if update.tiles else "POS"
+        try:
+            conn.send(encode_update(conn.version, update.tiles, changes), kind)
+        except OSError:
+            dead.append((pid, conn))
+            conn.close()
+    FANOUT_SECONDS.observe(time.perf_counter() - start)
+
+    if dead:
+        drop_dead(game_state, dead)
+
+
+def broadcast_nearby(game_state, tile_updates):
+    # tiles and position changes, each client only gets what's near it
+    with game_state.broadcast_lock:
+        fan_out_interest(game_state, game_state.take_updates(tile_updates))
+
+
+def send_keyframe(game_state, conn):
+    # a slow client lost POS frames and has caught up again. under
+    # broadcast_lock like every delta, so none gets queued before it
+    # that is older than the positions in it
+    with game_state.broadcast_lock:
+        changes = (True, (), game_state.known_players(conn.pid))
+        try:
+            conn.send(encode_update(conn.version, (), changes), "POS")
+        except OSError:
+            pass
+
+
+def send_ack(conn, seq, x, y):
+    # the mover's own answer: every move up to seq is applied, it's at (x, y)
+    if conn.version:
+        msg = protocol.binary_ack(seq, x, y)
+    else:
+        msg = protocol.text_ack(seq, x, y)
     try:
-        while True:
-            data = conn.recv(4096)
-            if not data:
-                break
-            buf += data
+        conn.send(msg, "ACK")
+    except OSError:
+        pass
 
-            while b"\n" in buf:
-                line, buf = buf.split(b"\n", 1)
-                text = line.decode().strip()
 
-                if text == "JOIN" and pid is None:
-                    pid, x, y = game_state.add_player()
-                    with game_state.lock:
-                        game_state.conns[pid] = conn
+def broadcast_positions(game_state):
+    if game_state.interest is not None:
+        broadcast_nearby(game_state, ())
+        return
+    with game_state.broadcast_lock:
+        keyframe, gone, moved, conns = game_state.take_changes()
+        fan_out(game_state, conns, (), (keyframe, gone, moved))
+
+
+def broadcast_tiles(game_state, tile_updates):
+    # all tile updates in one frame per client
+    if not tile_updates:
+        return
+    if game_state.interest is not None:
+        broadcast_nearby(game_state, tile_updates)
+        return
+    with game_state.broadcast_lock:
+        version = game_state.log_tiles(tile_updates)
+        fan_out(game_state, game_state.snapshot_conns(), tile_updates, tile_version=version)
+
+
+def broadcast_frame(game_state, tile_updates):
+    """
+    Send one combined frame per client holding every TILE change
+    and the position changes. Used once per server tick.
+    """
+    if game_state.interest is not None:
+        broadcast_nearby(game_state, tile_updates)
+        return
+    with game_state.broadcast_lock:
+        keyframe, gone, moved, conns = game_state.take_changes()
+        version = game_state.log_tiles(tile_updates) if tile_updates else None
+        fan_out(game_state, conns, tile_updates, (keyframe, gone, moved), version)
+
+
+def run_tick(game_state):
+    # apply everything queued since the last tick as one batch, doors
+    # the timer cleared since the last tick go out in the same frame
+    moves = game_state.take_moves()
+    tile_updates = game_state.take_deferred_tiles()
+    if not moves and not tile_updates:
+        return
+    acks = ()
+    if moves:
+        applied, acks = game_state.apply_moves(moves)
+        tile_updates += applied
+    for conn, seq, x, y in acks:
+        send_ack(conn, seq, x, y)
+    broadcast_frame(game_state, tile_updates)
+
+
+def clear_doors(game_state):
+    # door timer: clear the doors that are due. in tick mode the tiles
+    # wait for the next tick's frame, otherwise they go out right away
+    tile_updates = game_state.expire_doors()
+    if game_state.tick_hz:
+        game_state.defer_tiles(tile_updates)
+    else:
+        broadcast_tiles(game_state, tile_updates)
+
+
+def run_every(period, func, stop):
+    # fixed rate loop for the threaded server, runs in its own thread
+    # until the stop event is set
+    next_run = time.monotonic()
+    while not stop.is_set():
+        next_run += period
+        func()
+        delay = next_run - time.monotonic()
+        if delay > 0:
+            stop.wait(delay)
+        else:
+            # running behind, don't try to catch up with a burst of runs
+            next_run = time.monotonic()
+
+
+async def run_every_async(period, func):
+    # same as run_every, as a task on the event loop
+    next_run = time.monotonic()
+    while True:
+        next_run += period
+        func()
+        delay = next_run - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            next_run = time.monotonic()
+            await asyncio.sleep(0)
+
+
+def door_timer_loop(game_state, stop):
+    # threaded server: sleep until the next door is due, clear it and
+    # send the TILE updates, even if nobody is moving
+    wakeup = threading.Event()
+    game_state.on_door_timer = wakeup.set
+    while not stop.is_set():
+        due = game_state.next_door_expiry()
+        timeout = None if due is None else max(0.0, due - time.time())
+        wakeup.wait(timeout)
+        wakeup.clear()
+        clear_doors(game_state)
+
+
+async def door_timer_task(game_state):
+    # same as door_timer_loop, as a task on the event loop
+    wakeup = asyncio.Event()
+    game_state.on_door_timer = wakeup.set
+    while True:
+        due = game_state.next_door_expiry()
+        timeout = None if due is None else max(0.0, due - time.time())
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+        clear_doors(game_state)
 
-                    conn.sendall(f"WELCOME {pid}\n".encode())
-                    conn.sendall(f"SPAWN {x} {y}\n".encode())
 
-                    # send maze rows to this client
-                    with game_state.lock:
-                        for row in game_state.maze:
-                            row_str = "".join(str(c) for c in row)
-                            conn.sendall(f"MAZEROW {row_str}\n".encode())
+def report_lock_stats(rooms):
+    for room in rooms.snapshot():
+        stats = room.state.lock.stats(reset=True)
+        print(f"[{room.name}] {format_lock_stats(stats)}")
 
-                    broadcast_positions(game_state)
 
-                elif text.startswith("MOVE") and pid is not None:
-                    parts = text.split()
-                    if len(parts) != 2:
-                        continue
-                    direction = parts[1]
+def room_jobs(game_state):
+    # (period, func) pairs every room runs next to its door timer
+    jobs = []
+    if game_state.tick_hz:
+        jobs.append((1.0 / game_state.tick_hz, lambda: run_tick(game_state)))
+    return jobs
 
-                    dx, dy = 0, 0
-                    if direction == "UP":
-                        dx, dy = 0, -1
-                    elif direction == "DOWN":
-                        dx, dy = 0, 1
-                    elif direction == "LEFT":
-                        dx, dy = -1, 0
-                    elif direction == "RIGHT":
-                        dx, dy = 1, 0
 
-                    _, _, tile_updates = game_state.move_player(pid, dx, dy)
+def start_room_threads(room):
+    # threaded server: door timer + periodic jobs for one room
+    stop = threading.Event()
+    game_state = room.state
+    threading.Thread(target=door_timer_loop, args=(game_state, stop), daemon=True).start()
+    for period, func in room_jobs(game_state):
+        threading.Thread(target=run_every, args=(period, func, stop), daemon=True).start()
 
-                    # send tile updates to all clients
-                    for tx, ty, val in tile_updates:
-                        broadcast_tile(game_state, tx, ty, val)
+    def stop_jobs():
+        stop.set()
+        if game_state.on_door_timer is not None:
+            game_state.on_door_timer()   # wake the door timer so it sees stop
+    room.stop = stop_jobs
 
-                    broadcast_positions(game_state)
 
-    finally:
-        print("Client disconnected", addr)
+def start_room_tasks(room):
+    # asyncio server: same jobs as start_room_threads, as tasks
+    game_state = room.state
+    tasks = [asyncio.create_task(door_timer_task(game_state))]
+    for period, func in room_jobs(game_state):
+        tasks.append(asyncio.create_task(run_every_async(period, func)))
+
+    def stop_jobs():
+        for task in tasks:
+            task.cancel()
+    room.stop = stop_jobs
+
+
+def stop_room(room):
+    if room.stop is not None:
+        room.stop()
+    if room.state.journal is not None:
+        room.state.journal.close()
+
+
+def stop_rooms(rooms):
+    # server shutdown: stop every room's jobs, then flush and close its journal
+    for room in rooms.snapshot():
+        stop_room(room)
+
+
+def send_join(game_state, conn, pid, x, y, generators):
+    """
+    Queue welcome + maze + a full position dump for a new client, and only
+    then register it, so every later TILE/POS broadcast lands behind the maze.
+    A client that can run the room's generator only gets the seed and the
+    tiles changed since, otherwise the whole grid goes out in one frame
+    (cached, only rebuilt after tiles changed).
+    """
+    rows, cols = game_state.rows, game_state.cols
+    origin = game_state.origin
+    # read before the maze: a version that's a bit old only means a
+    # RESUME gets a few tiles it already had
+    welcome = encode_welcome(conn, pid, x, y, game_state.tile_version)
+
+    if origin is not None and origin[1] in generators:
+        seed, generator, loops, doors = origin
+        if conn.version:
+            maze_msg = protocol.binary_maze_seed(seed, rows, cols, generator, loops, doors)
+        else:
+            maze_msg = protocol.text_maze_seed(seed, rows, cols, generator, loops, doors)
         with game_state.lock:
-            if pid in game_state.conns:
-                del game_state.conns[pid]
-            if pid in game_state.players:
-                del game_state.players[pid]
-        try:
-            conn.close()
-        except OSError:
-            pass
-        broadcast_positions(game_state)
+            tiles = tuple((tx, ty, v) for (tx, ty), v in game_state.changed_tiles.items())
+            register_join(game_state, conn, pid, welcome + maze_msg, tiles)
+        return
+
+    while True:
+        version, compressed = game_state.maze_snapshot()
+        if conn.version >= 2:
+            maze_msg = protocol.binary_maze_z(rows, cols, compressed)
+        elif conn.version == 1:
+            maze_msg = protocol.binary_maze(rows, cols, zlib.decompress(compressed))
+        else:
+            maze_msg = protocol.text_maze(rows, cols, compressed)
+
+        with game_state.lock:
+            # a tile changed while we were encoding, try again
+            if game_state.maze_version != version:
+                continue
+            register_join(game_state, conn, pid, welcome + maze_msg, ())
+            return
+
+
+def encode_welcome(conn, pid, x, y, tile_version):
+    if conn.version:
+        return protocol.binary_welcome(conn.version, pid, x, y, conn.session, tile_version)
+    return protocol.text_welcome(pid, x, y, conn.session, tile_version)
+
+
+def register_join(game_state, conn, pid, msg, tiles):
+    # caller holds the lock. everyone else only gets deltas, so the new
+    # client starts from a full position dump (with an area of interest,
+    # the next broadcast sends the players near the spawn as enter events)
+    game_state.conns[pid] = conn
+    if game_state.interest is not None:
+        game_state.interest.reset_view(pid)
+        game_state.dirty.add(pid)
+    players = game_state._known_players(pid)
+    conn.send(msg + encode_update(conn.version, tiles, (True, (), players)), "JOIN")
+
+
+# MOVE direction -> (dx, dy), MOVES also takes the first letter
+DIRECTIONS = {
+    "UP": (0, -1),
+    "DOWN": (0, 1),
+    "LEFT": (-1, 0),
+    "RIGHT": (1, 0),
+}
+SHORT_DIRECTIONS = {name[0]: step for name, step in DIRECTIONS.items()}
+
+MOVE_COMMANDS = ("MOVE", "MOVES")
 
+# most steps one MOVES line may carry
+MAX_BATCH = 64
 
-def generate_maze(rows, cols):
+
+def parse_moves(parts):
     """
-    Large maze with limited loops, one exit, and static doors.
+    "MOVE <dir> [seq]" or "MOVES <dir> <dir> ... [seq]", MOVES directions
+    as names or letters (MOVES U U L R 17).
+    Returns ([(dx, dy), ...], seq), None for a broken line. Unknown
+    directions are steps that go nowhere, like they always were for MOVE.
+    """
+    if parts[0] == "MOVE":
+        if len(parts) not in (2, 3):
+            return None
+        seq = protocol.parse_seq(parts[2]) if len(parts) == 3 else None
+        return [DIRECTIONS.get(parts[1], (0, 0))], seq
+
+    names = parts[1:]
+    seq = None
+    if names and names[-1].isdigit():
+        seq = protocol.parse_seq(names.pop())
+    if not names or len(names) > MAX_BATCH:
+        return None
+    steps = [DIRECTIONS.get(name) or SHORT_DIRECTIONS.get(name, (0, 0)) for name in names]
+    return steps, seq
+
+
+def handle_moves(conn, pid, batch):
+    """
+    Apply a batch of parsed MOVE / MOVES lines from one client, in order.
+    Moves over the player's budget are dropped (queued in tick mode, see
+    scheduler.py). A lone step takes the move_player path, anything more
+    is applied under one lock acquisition and answered with one ACK and
+    one frame.
+    """
+    game_state = conn.room.state
+    steps = []
+    for line_steps, seq in batch:
+        # the sequence number belongs to the line's last step
+        steps.extend((dx, dy, None) for dx, dy in line_steps[:-1])
+        dx, dy = line_steps[-1]
+        steps.append((dx, dy, seq))
+
+    if game_state.tick_hz:
+        # applied and broadcast by the next ticks
+        game_state.queue_moves(pid, steps)
+        return
+
+    steps, seq = game_state.scheduler.admit(pid, steps)
+    if seq is not None:
+        # every move of it was dropped, tell the client where it still is
+        send_ack(conn, seq, *game_state.position(pid))
+    if not steps:
+        return
+    moves = [(pid, dx, dy, seq) for dx, dy, seq in steps]
+
+    MOVE_BATCHES.inc()
+    BATCHED_MOVES.inc(n=len(moves))
+    if len(moves) == 1:
+        _, dx, dy, seq = moves[0]
+        x, y, tile_updates = game_state.move_player(pid, dx, dy)
+        if seq is not None:
+            send_ack(conn, seq, x, y)
+
+        # send tile updates to all clients
+        broadcast_tiles(game_state, tile_updates)
 
-    0 = path
-    1 = wall
-    2 = exit
-    3 = door location (before any player uses it)
-    4 = red highlight tiles (door plus nearby paths while in use)
+        broadcast_positions(game_state)
+        return
+
+    tile_updates, acks = game_state.apply_moves(moves)
+    for ack_conn, seq, x, y in acks:
+        send_ack(ack_conn, seq, x, y)
+    broadcast_frame(game_state, tile_updates)
+
+
+def join_player(rooms, conn, room_name, generators):
+    # a new player for conn in the room (None = matchmaking), returns its id.
+    # the asyncio server has opened the room already, see open_room_async()
+    if conn.room is None:
+        conn.room = rooms.join(room_name)
+    game_state = conn.room.state
+    conn.on_resync = lambda c: send_keyframe(game_state, c)
+    pid, x, y = game_state.add_player()
+    conn.pid = pid
+    conn.session = rooms.open_session(conn.room, pid, conn)
+
+    send_join(game_state, conn, pid, x, y, generators)
+
+    broadcast_positions(game_state)
+    return pid
+
+
+def resume_player(rooms, conn, token, seen):
+    """
+    Hand a player whose connection dropped to conn: same id, same place,
+    and instead of the maze only the tiles changed since tile version
+    seen. Returns the player id, None when the session is unknown or
+    ran out.
     """
+    if token is None:
+        return None
+    session, old = rooms.claim(token, conn)
+    if session is None:
+        return None
+    if old is not None:
+        # still connected as far as we know, the client knows better
+        old.close()
+
+    game_state = session.room.state
+    pid = session.pid
+    conn.room = session.room
+    conn.pid = pid
+    conn.session = token
+    conn.on_resync = lambda c: send_keyframe(game_state, c)
+
+    # no frame with tiles goes out while we pick them, and every later
+    # one finds conn registered. with an area of interest reset_view()
+    # replays the nearby tiles instead
+    with game_state.broadcast_lock:
+        with game_state.lock:
+            tiles = game_state.tiles_since(seen) if game_state.interest is None else ()
+            x, y = game_state.players[pid]
+            welcome = encode_welcome(conn, pid, x, y, game_state.tile_version)
+            register_join(game_state, conn, pid, welcome, tiles)
 
-    # start with all walls
-    maze = [[1 for _ in range(cols)] for _ in range(rows)]
-
-    def in_bounds(r, c):
-        return 1 <= r < rows - 1 and 1 <= c < cols - 1
-
-    def shuffled_dirs():
-        dirs = [(-2, 0), (2, 0), (0, -2), (0, 2)]
-        random.shuffle(dirs)
-        return dirs
-
-    # depth first search to carve a perfect maze
-    start_r, start_c = 1, 1
-    maze[start_r][start_c] = 0
-    stack = [(start_r, start_c)]
-
-    while stack:
-        r, c = stack[-1]
-        carved = False
-
-        for dr, dc in shuffled_dirs():
-            nr, nc = r + dr, c + dc
-            if in_bounds(nr, nc) and maze[nr][nc] == 1:
-                wall_r = r + dr // 2
-                wall_c = c + dc // 2
-                maze[wall_r][wall_c] = 0
-                maze[nr][nc] = 0
-                stack.append((nr, nc))
-                carved = True
-                break
+    broadcast_positions(game_state)
+    return pid
 
-        if not carved:
-            stack.pop()
 
-    # limited loops so only a few alternate paths exist
-    MAX_LOOPS = 10
-    loops_added = 0
-    attempts = rows * cols
+def expire_sessions(rooms):
+    # remove players whose connection dropped and didn't RESUME in time
+    for session in rooms.expire():
+        game_state = session.room.state
+        with game_state.lock:
+            game_state.remove_player(session.pid)
+        broadcast_positions(game_state)
+        rooms.leave(session.room)
+
+
+def handle_line(rooms, conn, pid, text):
+    """
+    Handle one protocol line from a client.
+    Shared by the threaded and the asyncio server, returns the
+    (possibly new) player id for this connection.
+    """
+    parts = text.split()
+    if parts:
+        MESSAGES_IN.inc(parts[0] if parts[0] in COMMANDS else "other")
+
+    if parts and parts[0] == "JOIN" and pid is None:
+        # "JOIN [room]" = text protocol, "JOIN [room] BIN <version>" = binary
+        # frames, "GEN <ids>" = can rebuild the maze from its seed.
+        # no room name = matchmaking
+        room_name, conn.version, generators = protocol.parse_join(parts)
+        pid = join_player(rooms, conn, room_name, generators)
+
+    elif parts and parts[0] == "RESUME" and pid is None:
+        # "RESUME <token> <tile version> [BIN <version>] [GEN <ids>]" after
+        # a dropped connection. too late = a plain JOIN to matchmaking
+        token, seen, conn.version, generators = protocol.parse_resume(parts)
+        pid = resume_player(rooms, conn, token, seen)
+        RESUMES.inc("joined" if pid is None else "resumed")
+        if pid is None:
+            pid = join_player(rooms, conn, None, generators)
+
+    elif parts and parts[0] in MOVE_COMMANDS and pid is not None:
+        # "MOVE <dir> [seq]" / "MOVES <dir> ... [seq]", with a sequence
+        # number the client gets an ACK
+        move = parse_moves(parts)
+        if move is not None:
+            handle_moves(conn, pid, [move])
+
+    elif parts == ["HINT"] and pid is not None:
+        direction, distance = conn.room.state.hint(pid)
+        if conn.version:
+            msg = protocol.binary_hint(direction, distance)
+        else:
+            msg = protocol.text_hint(direction, distance)
+        try:
+            conn.send(msg, "HINT")
+        except OSError:
+            pass
+
+    elif parts == ["QUIT"]:
+        # leaving for good: no session to wait for, drop_client() removes
+        # the player once the reader sees the closed connection
+        if conn.session is not None:
+            rooms.end_session(conn.session)
+            conn.session = None
+        conn.close()
+
+    elif parts == ["STATS"]:
+        lines = metrics.REGISTRY.summary()
+        if conn.version:
+            msg = protocol.binary_stats(lines)
+        else:
+            msg = protocol.text_stats(lines)
+        try:
+            conn.send(msg, "STATS")
+        except OSError:
+            pass
 
-    while loops_added < MAX_LOOPS and attempts > 0:
-        attempts -= 1
+    return pid
 
-        x = random.randrange(1, cols - 1)
-        y = random.randrange(1, rows - 1)
 
-        if maze[y][x] != 1:
+def handle_lines(rooms, conn, pid, lines):
+    """
+    Handle every complete line from one recv(). Runs of MOVE / MOVES
+    lines are applied together by handle_moves(), everything else goes
+    through handle_line() in order. Returns the player id like handle_line.
+    """
+    batch = []
+    for line in lines:
+        text = line.decode().strip()
+        parts = text.split()
+        if parts and parts[0] in MOVE_COMMANDS and pid is not None:
+            MESSAGES_IN.inc(parts[0])
+            move = parse_moves(parts)
+            if move is not None:
+                batch.append(move)
             continue
+        if batch:
+            handle_moves(conn, pid, batch)
+            batch = []
+        pid = handle_line(rooms, conn, pid, text)
+        if conn.closed:
+            # QUIT, the rest of the lines go nowhere
+            return pid
+    if batch:
+        handle_moves(conn, pid, batch)
+    return pid
+
+
+async def open_room_async(rooms, conn, lines):
+    """
+    asyncio server, before the player joined: open the room a JOIN or
+    RESUME in lines is going to join with rooms.join_async(), so building
+    a new room doesn't stop the event loop. join_player() finds conn.room
+    set. A RESUME that can still take its player back needs no room; if
+    its session runs out in between, join_player() opens one the slow way.
+    """
+    for line in lines:
+        parts = line.decode().split()
+        if not parts:
+            continue
+        if parts[0] == "JOIN":
+            room_name = protocol.parse_join(parts)[0]
+        elif parts[0] == "RESUME":
+            if rooms.has_session(protocol.parse_resume(parts)[0]):
+                return
+            room_name = None
+        else:
+            continue
+        conn.room = await rooms.join_async(room_name)
+        return
+
+
+def read_backoff(conn, pid):
+    # seconds a client's reader should stop reading, see MoveScheduler.backoff
+    room = conn.room
+    if room is None or pid is None:
+        return 0.0
+    return room.state.scheduler.backoff(pid)
+
+
+def drop_client(rooms, pid, conn):
+    # forget the player and tell everyone else in the room
+    try:
+        conn.close()
+    except OSError:
+        pass
+    room = conn.room
+    if room is None:
+        return
+    conn.room = None
+
+    game_state = room.state
+    if conn.session is not None and rooms.detach(conn.session, conn):
+        # the player stays where it is until a RESUME or expire_sessions()
+        with game_state.lock:
+            game_state.detach_player(pid, conn)
+        return
+    with game_state.lock:
+        game_state.remove_player(pid)
+    broadcast_positions(game_state)
+    rooms.leave(room)
 
-        vertical_corridor = (maze[y - 1][x] == 0 and maze[y + 1][x] == 0)
-        horizontal_corridor = (maze[y][x - 1] == 0 and maze[y][x + 1] == 0)
 
-        if vertical_corridor or horizontal_corridor:
-            maze[y][x] = 0
-            loops_added += 1
+def handle_client(sock, addr, rooms, conn_options):
+    print("Client connected", addr)
+    CONNECTIONS.inc()
+    conn = ClientConn(addr, **conn_options)
+    threading.Thread(target=writer_loop, args=(conn, sock), daemon=True).start()
+    buf = b""
+    pid = None
 
-    # choose exit near the bottom right among path cells
-    exit_pos = None
-    for ey in range(rows - 2, 0, -1):
-        for ex in range(cols - 2, 0, -1):
-            if maze[ey][ex] == 0:
-                maze[ey][ex] = 2
-                exit_pos = (ex, ey)
+    try:
+        while True:
+            try:
+                data = sock.recv(4096)
+            except OSError:
+                break
+            if not data:
                 break
-        if exit_pos is not None:
-            break
+            buf += data
 
-    if exit_pos is None:
-        maze[rows - 2][cols - 2] = 2
-        exit_pos = (cols - 2, rows - 2)
+            # all complete lines at once, so bursts of moves share one lock
+            *lines, buf = buf.split(b"\n")
+            pid = handle_lines(rooms, conn, pid, lines)
+            if conn.closed:
+                # evicted as too slow, taken over by a RESUME, or QUIT
+                break
 
-    # place some doors on corridors
-    doors = []
-    DOOR_COUNT = 15  # number of shared door objects (independent of path count)
+            # out of moves: leave the rest in the socket until there's budget
+            pause = read_backoff(conn, pid)
+            if pause:
+                time.sleep(pause)
 
-    attempts = rows * cols
-    while len(doors) < DOOR_COUNT and attempts > 0:
-        attempts -= 1
-        x = random.randrange(1, cols - 1)
-        y = random.randrange(1, rows - 1)
+    finally:
+        print("Client disconnected", addr)
+        CONNECTIONS.dec()
+        drop_client(rooms, pid, conn)
 
-        if maze[y][x] != 0:
-            continue
 
-        # do not place doors on start or exit
-        if (x, y) == (1, 1) or (x, y) == exit_pos:
-            continue
+async def handle_client_async(reader, writer, rooms, conn_options, clients):
+    # clients: conn -> handler task of every open connection, for shutdown
+    addr = writer.get_extra_info("peername")
+    print("Client connected", addr)
+    CONNECTIONS.inc()
+    conn = ClientConn(addr, **conn_options)
+    clients[conn] = asyncio.current_task()
+    sender = asyncio.create_task(writer_task(conn, writer))
+    buf = b""
+    pid = None
 
-        # only place doors in straight corridors
-        neighbors = [
-            (x + 1, y),
-            (x - 1, y),
-            (x, y + 1),
-            (x, y - 1),
-        ]
-        open_neighbors = sum(
-            1 for nx, ny in neighbors
-            if 0 <= nx < cols and 0 <= ny < rows and maze[ny][nx] in (0, 2)
-        )
+    try:
+        while True:
+            try:
+                data = await reader.read(4096)
+            except ConnectionError:
+                break
+            if not data:
+                break
+            buf += data
 
-        if open_neighbors == 2:
-            maze[y][x] = 3
-            doors.append((x, y))
+            # all complete lines at once, so bursts of moves share one lock
+            *lines, buf = buf.split(b"\n")
+            if pid is None:
+                try:
+                    await open_room_async(rooms, conn, lines)
+                except asyncio.CancelledError:
+                    # shutdown stopped waiting for the room to be built
+                    break
+                if conn.closed:
+                    # shutdown closed the connection while the room was built
+                    break
+            pid = handle_lines(rooms, conn, pid, lines)
+            if conn.closed:
+                # evicted as too slow, taken over by a RESUME, or QUIT
+                break
 
-    return maze, doors
+            pause = read_backoff(conn, pid)
+            if pause:
+                await asyncio.sleep(pause)
+
+    finally:
+        print("Client disconnected", addr)
+        CONNECTIONS.dec()
+        drop_client(rooms, pid, conn)
+        await sender
+        del clients[conn]
+
+
+def default_door_count(rows, cols):
+    return max(DOOR_COUNT, rows * cols // CELLS_PER_DOOR)
 
 
-def main():
-    rows, cols = 51, 51
-    maze, doors = generate_maze(rows, cols)
-    game_state = GameState(rows, cols, maze, doors)
+def generate_maze(rows, cols, door_count=None, seed=None, version=None):
+    """
+    Large maze with limited loops, one exit, and static doors.
 
+    0 = path
+    1 = wall
+    2 = exit
+    3 = door location (before any player uses it)
+    4 = red highlight tiles (door plus nearby paths while in use)
+    """
+    if door_count is None:
+        door_count = default_door_count(rows, cols)
+    return maze_gen.generate(rows, cols, LOOP_COUNT, door_count, seed, version)
+
+
+def journal_path(directory, name, number):
+    """
+    DIR/<room>-<ms>-<number>.mzj for a room's journal. The room name is
+    whatever the client sent with JOIN, so only a slug of it goes into
+    the file name (the journal itself keeps the real one), and number
+    keeps rooms with the same slug apart.
+    """
+    slug = JOURNAL_UNSAFE.sub("_", name)[:JOURNAL_NAME_MAX] or "room"
+    path = os.path.join(directory, f"{slug}-{int(time.time() * 1000)}-{number}.mzj")
+    if os.path.dirname(os.path.realpath(path)) != os.path.realpath(directory):
+        raise ValueError(f"journal for room {name!r} would end up outside {directory}")
+    return path
+
+
+def add_room_gauges(rooms):
+    # gauges read from the rooms whenever someone asks, nothing to update
+    def total(func):
+        return lambda: sum(func(room.state) for room in rooms.snapshot())
+
+    metrics.gauge("maze_rooms", "open rooms", lambda: len(rooms.snapshot()))
+    metrics.gauge("maze_players", "players in all rooms", total(lambda gs: len(gs.players)))
+    metrics.gauge("maze_doors", "doors not used up yet", total(lambda gs: len(gs.doors)))
+    metrics.gauge("maze_red_tiles", "tiles painted red by locked doors", total(GameState.red_tiles))
+    metrics.gauge(
+        "maze_queued_frames", "frames waiting in client outbound queues",
+        total(lambda gs: sum(conn.queued() for conn in list(gs.conns.values()))),
+    )
+
+    def room_depths():
+        # one sample per room, a label per player would grow without bound
+        return {room.name: sum(room.state.scheduler.depths().values()) for room in rooms.snapshot()}
+
+    def deepest():
+        return max((max(room.state.scheduler.depths().values(), default=0)
+                    for room in rooms.snapshot()), default=0)
+
+    metrics.gauge(
+        "maze_queued_moves", "moves waiting for a tick in all rooms",
+        total(lambda gs: sum(gs.scheduler.depths().values())),
+    )
+    metrics.gauge(
+        "maze_room_queued_moves", "moves waiting for a tick, per room",
+        room_depths, label="room",
+    )
+    metrics.gauge(
+        "maze_max_queued_moves", "longest queue of moves any one player has waiting", deepest,
+    )
+
+
+def serve_threaded(rooms, host, port, conn_options, jobs):
+    # one thread per connection, every thread blocks in recv()
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        s.listen()
-        print(f"Game server listening on {HOST}:{PORT}")
-
-        while True:
-            conn, addr = s.accept()
+        s.bind((host, port))
+        s.listen(LISTEN_BACKLOG)
+        print(f"Game server listening on {host}:{port} (threaded)")
+
+        rooms.on_open = start_room_threads
+        # SIGTERM stops accepting, the rooms are stopped once we're out
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        for period, func in jobs:
+            threading.Thread(target=run_every, args=(period, func, stop), daemon=True).start()
+
+        s.settimeout(ACCEPT_TIMEOUT)
+        while not stop.is_set():
+            try:
+                conn, addr = s.accept()
+            except socket.timeout:
+                continue
             threading.Thread(
                 target=handle_client,
-                args=(conn, addr, game_state),
+                args=(conn, addr, rooms, conn_options),
                 daemon=True,
             ).start()
 
+    stop_rooms(rooms)
+
+
+async def serve_asyncio(rooms, host, port, conn_options, jobs):
+    # every connection is a coroutine on one event loop, no thread each
+    clients = {}
+    server = await asyncio.start_server(
+        lambda r, w: handle_client_async(r, w, rooms, conn_options, clients),
+        host,
+        port,
+        reuse_address=True,
+        backlog=LISTEN_BACKLOG,
+    )
+    print(f"Game server listening on {host}:{port} (asyncio)")
+
+    rooms.on_open = start_room_tasks
+
+    # keep references, the loop only holds tasks weakly
+    tasks = [asyncio.create_task(run_every_async(period, func)) for period, func in jobs]
+
+    # SIGTERM: stop accepting, close every connection, then stop the
+    # rooms and flush their journals
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stopping.set)
+    except NotImplementedError:   # windows
+        signal.signal(signal.SIGTERM, lambda signum, frame: loop.call_soon_threadsafe(stopping.set))
+
+    await stopping.wait()
+    server.close()
+    for conn in list(clients):
+        conn.close()
+    if clients:
+        await asyncio.wait(list(clients.values()), timeout=CLOSE_TIMEOUT)
+    for task in tasks:
+        task.cancel()
+    stop_rooms(rooms)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Maze lock game server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--mode",
+        choices=("asyncio", "threaded"),
+        default="asyncio",
+        help="asyncio = single event loop (default), threaded = one thread per client",
+    )
+    parser.add_argument(
+        "--tick-hz",
+        type=float,
+        default=0,
+        help="apply queued moves this many times a second and send one frame "
+             "per client per tick (0 = apply every MOVE immediately)",
+    )
+    parser.add_argument(
+        "--move-rate",
+        type=float,
+        default=MOVE_RATE,
+        help="moves a second each player may make, extra ones are dropped or, "
+             "in tick mode, wait for later ticks (0 = no limit)",
+    )
+    parser.add_argument(
+        "--move-burst",
+        type=int,
+        default=MOVE_BURST,
+        help="moves a player may make at once after standing still",
+    )
+    parser.add_argument(
+        "--max-queued-moves",
+        type=int,
+        default=MAX_QUEUED_MOVES,
+        help="tick mode: moves a player may have waiting before new ones are dropped",
+    )
+    parser.add_argument(
+        "--resume-grace",
+        type=float,
+        default=RESUME_GRACE,
+        metavar="SECONDS",
+        help="keep a player whose connection dropped this long for a RESUME "
+             "with its session token (0 = players leave with their connection)",
+    )
+    parser.add_argument(
+        "--slow-policy",
+        choices=SLOW_POLICIES,
+        default="coalesce",
+        help="what to do with a client whose outbound queue is full",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=DEFAULT_MAX_FRAMES,
+        help="outbound frames queued per client before the slow policy applies",
+    )
+    parser.add_argument(
+        "--lock-report",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="print GameState.lock wait/hold times every SECONDS (0 = off)",
+    )
+    parser.add_argument(
+        "--room-size",
+        type=int,
+        default=0,
+        help="players matchmaking puts in one room before opening another "
+             "(0 = everyone without a room name shares one room)",
+    )
+    parser.add_argument("--rows", type=int, default=51)
+    parser.add_argument("--cols", type=int, default=51)
+    parser.add_argument(
+        "--doors",
+        type=int,
+        default=None,
+        help=f"number of doors (default {DOOR_COUNT}, more on bigger mazes)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="build every room's maze from this seed (default: a new random seed per room)",
+    )
+    parser.add_argument(
+        "--pool-depth",
+        type=int,
+        default=2,
+        help="mazes kept ready for new rooms, generated by worker processes "
+             "(0 = generate when a room opens)",
+    )
+    parser.add_argument("--pool-workers", type=int, default=1, help="maze generator processes")
+    parser.add_argument(
+        "--pool-rate",
+        type=float,
+        default=0,
+        help="mazes the pool starts per second at most (0 = no limit)",
+    )
+    parser.add_argument(
+        "--aoi-radius",
+        type=int,
+        default=0,
+        metavar="TILES",
+        help="only send clients the players and tile changes within about "
+             "TILES tiles of them (0 = send everything to everyone)",
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="DIR",
+        default=None,
+        help="record every room's joins, leaves, moves and tile changes to "
+             "DIR/<room>-<ms>-<n>.mzj for replay.py (default: off)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=0,
+        help="serve metrics in the Prometheus text format on "
+             "http://127.0.0.1:PORT/metrics (0 = off, STATS still works)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    door_count = args.doors
+    if door_count is None:
+        door_count = default_door_count(args.rows, args.cols)
+    if args.journal:
+        os.makedirs(args.journal, exist_ok=True)
+    journal_numbers = itertools.count(1)
+
+    # mazes are only ever generated in the pool's worker processes, a
+    # fixed --seed doesn't keep any queued
+    pool = MazePool(args.pool_depth if args.seed is None else 0, args.pool_workers, args.pool_rate, paths=True)
+    if args.pool_depth and args.seed is None:
+        pool.add(args.rows, args.cols, LOOP_COUNT, door_count)
+
+    def make_state(name):
+        # every room gets its own maze, GameState and lock. blocks while a
+        # worker generates the maze and its PathField, join_async() runs
+        # this off the loop
+        if args.seed is None:
+            maze, doors, seed, version, paths = pool.take(
+                args.rows, args.cols, LOOP_COUNT, door_count, inline=False)
+        else:
+            maze, doors, seed, version, paths = pool.generate(
+                args.rows, args.cols, LOOP_COUNT, door_count,
+                args.seed, maze_gen.pick_version(args.rows, args.cols))
+        state = GameState(
+            args.rows, args.cols, maze, doors,
+            tick_hz=args.tick_hz, aoi_radius=args.aoi_radius,
+            origin=(seed, version, LOOP_COUNT, door_count),
+            scheduler=MoveScheduler(args.move_rate, args.move_burst, args.max_queued_moves),
+            paths=paths,
+        )
+        if args.journal:
+            # a journal that can't be written doesn't stop the room
+            try:
+                path = journal_path(args.journal, name, next(journal_numbers))
+                journal = Journal(path, name)
+            except (OSError, ValueError) as e:
+                print(f"Room {name} not journaled: {e}")
+            else:
+                state.start_journal(journal)
+                print(f"Room {name} journaled to {path}")
+        return state
+
+    rooms = RoomManager(make_state, capacity=args.room_size, on_close=stop_room, grace=args.resume_grace)
+    add_room_gauges(rooms)
+    if args.metrics_port:
+        metrics.serve_http(args.metrics_port)
+        print(f"Metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+    conn_options = {"policy": args.slow_policy, "max_frames": args.max_queue}
+    jobs = []
+    if args.lock_report:
+        jobs.append((args.lock_report, lambda: report_lock_stats(rooms)))
+    if args.resume_grace:
+        jobs.append((SESSION_CHECK_INTERVAL, lambda: expire_sessions(rooms)))
+
+    if args.mode == "threaded":
+        serve_threaded(rooms, args.host, args.port, conn_options, jobs)
+    else:
+        try:
+            asyncio.run(serve_asyncio(rooms, args.host, args.port, conn_options, jobs))
+        except KeyboardInterrupt:
+            pass
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,172 @@
+class SpatialHash:
+    """
+    Uniform grid of buckets over the maze, bucket -> set of player ids.
+    A player's area of interest is the 3x3 block of buckets around it,
+    so everyone within cell_size tiles is always included.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = max(1, cell_size)
+        self.buckets = {}         # (bx, by) -> set of pids
+
+    def bucket_of(self, x, y):
+        return (x // self.cell_size, y // self.cell_size)
+
+    def insert(self, pid, x, y):
+        self.buckets.setdefault(self.bucket_of(x, y), set()).add(pid)
+
+    def remove(self, pid, x, y):
+        key = self.bucket_of(x, y)
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.discard(pid)
+            if not bucket:
+                del self.buckets[key]
+
+    def move(self, pid, ox, oy, nx, ny):
+        # most steps stay inside the same bucket
+        if self.bucket_of(ox, oy) != self.bucket_of(nx, ny):
+            self.remove(pid, ox, oy)
+            self.insert(pid, nx, ny)
+
+    def area(self, bucket):
+        # bucket keys in the area of interest around a bucket
+        if bucket is None:
+            return set()
+        bx, by = bucket
+        return {(bx + i, by + j) for i in (-1, 0, 1) for j in (-1, 0, 1)}
+
+    def near(self, x, y):
+        # every pid in the area of interest around (x, y)
+        found = set()
+        for key in self.area(self.bucket_of(x, y)):
+            bucket = self.buckets.get(key)
+            if bucket:
+                found |= bucket
+        return found
+
+
+class Update:
+    # what one client gets from one broadcast
+    __slots__ = ("tiles", "keyframe", "gone", "moved")
+
+    def __init__(self):
+        self.tiles = []
+        self.keyframe = False
+        self.gone = set()
+        self.moved = {}           # pid -> (x, y)
+
+    def pos(self, pid, x, y):
+        self.gone.discard(pid)
+        self.moved[pid] = (x, y)
+
+    def leave(self, pid):
+        self.moved.pop(pid, None)
+        self.gone.add(pid)
+
+
+class InterestManager:
+    """
+    Decides who hears about what. Players only get POS/LEAVE for players
+    in their area of interest (a POS for someone new is the enter event,
+    LEAVE is the leave event) and TILE changes near them.
+
+    Seeing each other is symmetric, so neighbors[p] is kept for every
+    player and a move only touches the buckets around the mover instead
+    of every connection. Changed tiles are remembered per bucket and
+    replayed when a player's area moves over that bucket, so tiles it
+    missed while far away are never stale.
+    """
+
+    def __init__(self, cell_size):
+        self.spatial = SpatialHash(cell_size)
+        self.neighbors = {}       # pid -> set of pids it can see (itself included)
+        self.viewer_bucket = {}   # pid -> bucket its area is centred on
+        self.tile_log = {}        # bucket -> {(x, y): value} every tile that ever changed
+
+    def add(self, pid, x, y):
+        self.spatial.insert(pid, x, y)
+
+    def move(self, pid, ox, oy, nx, ny):
+        self.spatial.move(pid, ox, oy, nx, ny)
+
+    def remove(self, pid, x, y):
+        self.spatial.remove(pid, x, y)
+
+    def reset_view(self, pid):
+        # pid starts over knowing nobody, the next collect with pid dirty
+        # sends it everyone around as enter events
+        self.neighbors[pid] = set()
+        self.viewer_bucket.pop(pid, None)
+
+    def known(self, pid, players):
+        # (pid, x, y) for everyone pid currently sees, used for keyframes
+        return tuple((q,) + tuple(players[q]) for q in self.neighbors.get(pid, ()) if q in players)
+
+    def collect(self, players, dirty, gone, tiles, keyframe):
+        """
+        Per player Update for one broadcast, caller holds the game lock.
+        players is GameState.players, dirty / gone the players that moved /
+        left since the last broadcast, tiles the (x, y, value) changes.
+        """
+        out = {}
+
+        def box(pid):
+            update = out.get(pid)
+            if update is None:
+                update = out[pid] = Update()
+            return update
+
+        for g in gone:
+            for q in self.neighbors.pop(g, ()):
+                if q != g and q in self.neighbors:
+                    self.neighbors[q].discard(g)
+                    box(q).leave(g)
+            self.viewer_bucket.pop(g, None)
+
+        for p in dirty:
+            if p not in players:
+                continue
+            x, y = players[p]
+            new = self.spatial.near(x, y)
+            old = self.neighbors.get(p, set())
+
+            # everyone around p (p included) hears about the move
+            for q in new:
+                box(q).pos(p, x, y)
+            # someone entered p's area: p gets to see them too
+            for q in new - old:
+                if q != p and q in players:
+                    box(p).pos(q, *players[q])
+                    self.neighbors.setdefault(q, set()).add(p)
+            # out of range: both sides forget each other
+            for q in old - new:
+                box(q).leave(p)
+                box(p).leave(q)
+                if q in self.neighbors:
+                    self.neighbors[q].discard(p)
+            self.neighbors[p] = new
+
+            # replay tile changes in buckets p can see now but couldn't before
+            bucket = self.spatial.bucket_of(x, y)
+            old_bucket = self.viewer_bucket.get(p)
+            if bucket != old_bucket:
+                self.viewer_bucket[p] = bucket
+                for key in self.spatial.area(bucket) - self.spatial.area(old_bucket):
+                    for (tx, ty), value in self.tile_log.get(key, {}).items():
+                        box(p).tiles.append((tx, ty, value))
+
+        for tx, ty, value in tiles:
+            key = self.spatial.bucket_of(tx, ty)
+            self.tile_log.setdefault(key, {})[(tx, ty)] = value
+            for q in self.spatial.near(tx, ty):
+                box(q).tiles.append((tx, ty, value))
+
+        if keyframe:
+            for p in players:
+                update = box(p)
+                update.keyframe = True
+                update.gone.clear()
+                update.moved = {q: tuple(players[q]) for q in self.neighbors.get(p, ()) if q in players}
+
+        return out
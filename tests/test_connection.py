@@ -0,0 +1,69 @@
+import pytest
+
+from connection import ClientConn
+
+
+def filled(policy, max_frames=4):
+    # a client that stopped reading, its queue full of POS frames
+    conn = ClientConn(("test", 0), policy, max_frames)
+    for n in range(max_frames):
+        conn.send(b"pos%d" % n, "POS")
+    return conn
+
+
+def test_frames_come_out_in_order():
+    conn = ClientConn(("test", 0))
+    conn.send(b"a", "JOIN")
+    conn.send(b"b", "POS")
+    assert conn.take_all() == b"ab"
+    assert conn.take_all() == b""
+
+
+def test_drop_throws_away_new_pos_frames():
+    conn = filled("drop")
+    conn.send(b"late", "POS")
+    assert conn.take_all() == b"pos0pos1pos2pos3"
+    assert conn.resync and conn.dropped_frames == 1
+
+
+def test_drop_keeps_frames_that_matter():
+    conn = filled("drop")
+    conn.send(b"tile", "FRAME")
+    assert conn.take_all().endswith(b"tile")
+
+
+def test_coalesce_throws_away_every_queued_pos_frame():
+    conn = filled("coalesce")
+    conn.send(b"tile", "FRAME")
+    conn.send(b"late", "POS")
+    assert conn.take_all() == b"tile"
+    assert conn.dropped_frames == 5
+
+
+def test_resync_once_caught_up():
+    conn = filled("coalesce")
+    conn.send(b"late", "POS")
+    owed = []
+    conn.on_resync = owed.append
+    conn.take_all()
+    conn.caught_up()
+    conn.caught_up()
+    assert owed == [conn]
+
+
+def test_disconnect_evicts_and_tears_down_the_transport():
+    conn = filled("disconnect")
+    aborted = []
+    conn.abort = lambda: aborted.append(True)
+    with pytest.raises(OSError):
+        conn.send(b"late", "POS")
+    assert conn.closed and aborted == [True]
+    assert conn.take_all() is None
+
+
+def test_hard_limit_for_frames_that_cant_be_dropped():
+    conn = ClientConn(("test", 0), "drop", 2)
+    with pytest.raises(OSError):
+        for _ in range(2 * 4 + 1):
+            conn.send(b"tile", "FRAME")
+    assert conn.closed
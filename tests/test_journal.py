@@ -0,0 +1,126 @@
+import os
+import random
+
+import pytest
+
+import journal
+import maze_gen
+import replay
+from server import GameState, journal_path
+
+ROWS = COLS = 31
+ORIGIN = (12345, 1, 10, 30)       # seed, generator, loops, doors
+
+
+def play(path, room=None):
+    # a short match on a virtual clock: players walk towards the exit
+    # through the doors, some moves one by one, some in batches
+    seed, generator, loops, doors = ORIGIN
+    maze, door_list = maze_gen.generate(ROWS, COLS, loops, doors, seed, generator)
+    state = GameState(ROWS, COLS, maze, door_list, origin=ORIGIN)
+    clock = replay.VirtualClock(1000.0)
+    state.clock = clock
+    state.start_journal(journal.Journal(path, room))
+
+    rng = random.Random(1)
+    pids = [state.add_player()[0] for _ in range(3)]
+    tiles = 0
+    for step in range(400):
+        clock.now += rng.random() * 0.2
+        if step == 200:
+            with state.lock:
+                state.remove_player(pids.pop())
+        if step % 5 == 0:
+            tiles += len(state.expire_doors())
+        if step % 3 == 0:
+            moves = []
+            for pid in pids:
+                x, y = state.players[pid]
+                hint = state.paths.next_step(x, y)
+                nx, ny = (x + 1, y) if hint is None else hint[1:]
+                moves.append((pid, nx - x, ny - y, None))
+            tiles += len(state.apply_moves(moves)[0])
+        else:
+            pid = rng.choice(pids)
+            dx, dy = rng.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+            tiles += len(state.move_player(pid, dx, dy)[2])
+    state.journal.close()
+    return state, tiles
+
+
+def test_replay_matches_the_match(tmp_path):
+    path = str(tmp_path / "room1.mzj")
+    state, tiles = play(path)
+    assert tiles, "nobody used a door, the test proves little"
+
+    records = replay.load(path)
+    kinds = [kind for kind, _, _ in records]
+    assert kinds[0] == journal.START
+    assert records[0][2] == (ROWS, COLS, ORIGIN[:4])
+    assert kinds.count(journal.JOIN) == 3 and kinds.count(journal.LEAVE) == 1
+
+    stats = replay.ReplayStats()
+    replayed = replay.replay(records, stats)
+    assert stats.mismatches == []
+    assert stats.tiles == tiles
+    assert replayed.players == state.players
+    assert replayed.maze.data == state.maze.data
+
+
+def test_cut_off_record_is_ignored(tmp_path):
+    path = str(tmp_path / "room1.mzj")
+    play(path)
+    count = len(list(journal.read(path)))
+    # the server died halfway through writing the last record
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-3])
+    assert len(list(journal.read(path))) == count - 1
+
+
+@pytest.mark.parametrize("name", ["../../escaped", "a/b", "a\\b", "..", "\x1b[31m", "", "x" * 300])
+def test_room_names_stay_in_the_journal_dir(tmp_path, name):
+    directory = str(tmp_path / "journals")
+    os.makedirs(directory)
+    path = journal_path(directory, name, 1)
+    assert os.path.dirname(os.path.realpath(path)) == os.path.realpath(directory)
+    # the real name is in the journal, not in the file name
+    play(path, name)
+    assert os.listdir(directory) == [os.path.basename(path)]
+    records = list(journal.read(path))
+    assert records[1][0] == journal.ROOM and records[1][2] == (name,)
+    assert replay.replay(records, replay.ReplayStats()).players
+
+
+def test_same_name_different_files(tmp_path):
+    a = journal_path(str(tmp_path), "a/b", 1)
+    b = journal_path(str(tmp_path), "a_b", 2)
+    assert a != b
+
+
+def test_more_than_65535_entries(tmp_path):
+    path = str(tmp_path / "big.mzj")
+    j = journal.Journal(path)
+    j.start(1.0, 2001, 2001, (1, 1, 0, 0))
+    tiles = [(i % 2000, i // 2000, 1) for i in range(70000)]
+    steps = [("p1", 1, 0, i % 2000, 1) for i in range(70000)]
+    j.batch(2.0, steps)
+    j.tiles(2.0, tiles)
+    j.close()
+    records = list(journal.read(path))
+    assert records[1] == (journal.BATCH, 2.0, (steps,))
+    assert records[2] == (journal.TILES, 2.0, (tiles,))
+
+
+def test_reads_mzj1(tmp_path):
+    path = str(tmp_path / "old.mzj")
+    with open(path, "wb") as f:
+        f.write(journal.MAGIC_V1)
+        f.write(bytes([journal.TILES]) + journal.RECORDS_V1[journal.TILES].pack(3.0, 1))
+        f.write(journal.TILE.pack((5 << 18) | (7 << 4) | 2))
+        f.write(bytes([journal.JOIN]) + journal.RECORDS[journal.JOIN].pack(4.0, 2))
+    assert list(journal.read(path)) == [
+        (journal.TILES, 3.0, ([(5, 7, 2)],)),
+        (journal.JOIN, 4.0, ("p2",)),
+    ]
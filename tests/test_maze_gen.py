@@ -0,0 +1,88 @@
+import hashlib
+from collections import deque
+
+import pytest
+
+import maze_gen
+
+
+def reachable(grid, start):
+    # every non-wall cell reachable from start
+    seen = {start}
+    queue = deque([start])
+    while queue:
+        x, y = queue.popleft()
+        for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if (nx, ny) not in seen and grid.in_bounds(nx, ny) and grid.get(nx, ny) != 1:
+                seen.add((nx, ny))
+                queue.append((nx, ny))
+    return seen
+
+
+def check_maze(grid, placed, rows, cols, doors):
+    assert (grid.rows, grid.cols) == (rows, cols)
+    # walled in on every side
+    assert all(grid.get(x, 0) == 1 and grid.get(x, rows - 1) == 1 for x in range(cols))
+    assert all(grid.get(0, y) == 1 and grid.get(cols - 1, y) == 1 for y in range(rows))
+    assert grid.get(*maze_gen.last_cell(rows, cols)) == 2
+    assert len(placed) == doors
+    assert all(grid.get(x, y) == 3 for x, y in placed)
+    # one connected maze: every open cell can be walked to from the start
+    open_cells = {(x, y) for y in range(rows) for x in range(cols) if grid.get(x, y) != 1}
+    assert reachable(grid, maze_gen.START) == open_cells
+
+
+@pytest.mark.parametrize("rows, cols", [(3, 3), (21, 21), (31, 40), (40, 31)])
+def test_eller(rows, cols):
+    doors = 0 if rows * cols < 100 else 8
+    grid, placed = maze_gen.generate(rows, cols, 10, doors, seed=3, version=1)
+    check_maze(grid, placed, rows, cols, doors)
+
+
+def test_sidewinder():
+    if 2 not in maze_gen.supported_versions():
+        pytest.skip("numpy is not installed")
+    # taller than a block of rows, so carving goes through several steps
+    rows = maze_gen.BLOCK_ROWS * 2 + 61
+    grid, placed = maze_gen.generate(rows, 41, 10, 8, seed=3, version=2)
+    check_maze(grid, placed, rows, 41, 8)
+
+
+def test_too_small():
+    with pytest.raises(ValueError):
+        maze_gen.generate(2, 10)
+
+
+def digest(rows, cols, loops, doors, seed, version):
+    grid, placed = maze_gen.generate(rows, cols, loops, doors, seed, version)
+    h = hashlib.sha256(grid.data)
+    h.update(repr(placed).encode())
+    return h.hexdigest()[:16]
+
+
+# clients rebuild mazes from MAZESEED, so these must never change for a
+# generator version. If one does, the change needs a new GENERATORS id
+EXPECTED = {
+    (21, 21, 0, 0, 1, 1): "40143fe0ef84babe",
+    (31, 41, 10, 5, 42, 1): "46ccf34847b0e5ef",
+    (101, 75, 40, 30, 2 ** 62 + 7, 1): "d69f0eed69c11006",
+    (301, 257, 20, 10, 7, 2): "0251d097a1bf5b4a",
+}
+
+
+@pytest.mark.parametrize("args", sorted(EXPECTED))
+def test_fixed_seed_gives_the_same_maze(args):
+    if args[-1] not in maze_gen.supported_versions():
+        pytest.skip("numpy is not installed")
+    assert digest(*args) == EXPECTED[args]
+
+
+def test_seeds_give_different_mazes():
+    a, _ = maze_gen.generate(31, 31, seed=1, version=1)
+    b, _ = maze_gen.generate(31, 31, seed=2, version=1)
+    assert a.data != b.data
+
+
+def test_unknown_version():
+    with pytest.raises(ValueError):
+        maze_gen.generate(11, 11, seed=1, version=99)
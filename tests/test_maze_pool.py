@@ -0,0 +1,46 @@
+import time
+
+import maze_gen
+from maze_pool import MazePool
+from pathing import PathField
+
+
+def test_generate_matches_maze_gen():
+    pool = MazePool(depth=0)
+    try:
+        grid, placed, seed, version, paths = pool.generate(21, 21, 3, 2, 7, 1)
+        expected, expected_placed = maze_gen.generate(21, 21, 3, 2, 7, 1)
+        assert (seed, version) == (7, 1)
+        assert bytes(grid.data) == bytes(expected.data)
+        assert placed == expected_placed
+        assert paths is None
+    finally:
+        pool.close()
+
+
+def test_miss_without_inline():
+    pool = MazePool(depth=0)
+    try:
+        grid, placed, seed, version, paths = pool.take(21, 21, inline=False)
+        assert pool.misses == 1
+        expected, _ = maze_gen.generate(21, 21, 0, 0, seed, version)
+        assert bytes(grid.data) == bytes(expected.data)
+    finally:
+        pool.close()
+
+
+def test_paths_built_in_the_worker():
+    pool = MazePool(depth=1, paths=True)
+    try:
+        pool.add(21, 21)
+        grid, _, _, _, paths = pool.generate(21, 21, 0, 0, 7, 1)
+        assert paths.grid is grid
+        assert paths.dist == PathField(grid).dist
+        deadline = time.monotonic() + 5
+        while not pool.queued(21, 21) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        grid, _, _, _, paths = pool.take(21, 21)
+        assert pool.hits == 1
+        assert paths.dist == PathField(grid).dist
+    finally:
+        pool.close()
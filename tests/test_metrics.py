@@ -0,0 +1,36 @@
+import metrics
+import protocol
+
+
+def test_render():
+    registry = metrics.Registry()
+    moves = registry.register(metrics.Counter("moves_total", "moves", "type"))
+    registry.register(metrics.Gauge("rooms", "open rooms", lambda: 3))
+    registry.register(metrics.Gauge("players", "per room", lambda: {'a"b\\c\n': 2}, label="room"))
+    moves.inc("MOVE")
+    moves.inc("MOVE", 2)
+    text = registry.render()
+    assert "# TYPE moves_total counter\n" in text
+    assert 'moves_total{type="MOVE"} 3\n' in text
+    assert "rooms 3\n" in text
+    # label values from clients are escaped
+    assert 'players{room="a\\"b\\\\c\\n"} 2\n' in text
+
+
+def test_histogram():
+    latency = metrics.Histogram("latency", "seconds", buckets=(0.001, 0.01, 0.1))
+    for value in (0.0005, 0.005, 0.005, 0.05, 5.0):
+        latency.observe(value)
+    samples = dict(latency.samples())
+    assert samples['latency_bucket{le="0.001"}'] == 1
+    assert samples['latency_bucket{le="0.01"}'] == 3
+    assert samples['latency_bucket{le="+Inf"}'] == 5
+    assert samples["latency_count"] == 5
+    assert 0.001 <= latency.quantile(0.5) <= 0.01
+    assert metrics.Histogram("empty", "").quantile(0.5) is None
+
+
+def test_stats_round_trip():
+    lines = ["maze_players 3", 'maze_room_players{room="a"} 1']
+    frames = protocol.FrameReader().feed(protocol.binary_stats(lines))
+    assert protocol.decode_stats(frames[0][1]) == lines
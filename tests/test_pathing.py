@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+import maze_gen
+from pathing import PathField, UNREACHABLE, WALL
+
+
+def rebuilt(grid, closed):
+    # a fresh field for the maze with the closed cells walled off
+    copy = grid.copy()
+    for x, y in closed:
+        copy.set(x, y, WALL)
+    return PathField(copy)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_matches_full_rebuild(seed):
+    rng = random.Random(seed)
+    rows, cols = rng.choice([(15, 21), (31, 31), (41, 51)])
+    grid, _ = maze_gen.generate(rows, cols, rng.randrange(30), 10, seed=seed, version=1)
+    field = PathField(grid)
+    cells = [(x, y) for y in range(rows) for x in range(cols) if grid.get(x, y) != WALL]
+    closed = set()
+    for _ in range(60):
+        x, y = rng.choice(cells)
+        if (x, y) in closed:
+            closed.discard((x, y))
+            field.set_passable(x, y, True)
+        else:
+            closed.add((x, y))
+            field.set_passable(x, y, False)
+        full = rebuilt(grid, closed)
+        assert field.dist == full.dist
+        assert field.adj == full.adj
+
+
+def test_next_step_walks_to_the_exit():
+    grid, _ = maze_gen.generate(31, 41, 20, 0, seed=5, version=1)
+    field = PathField(grid)
+    x, y = maze_gen.START
+    d = field.distance(x, y)
+    assert d > 0
+    while d:
+        _, x, y = field.next_step(x, y)
+        assert field.distance(x, y) == d - 1
+        d -= 1
+    assert (x, y) == maze_gen.last_cell(31, 41)
+    assert field.next_step(x, y) is None
+
+
+def test_closing_the_exit_cuts_everything_off():
+    grid, _ = maze_gen.generate(15, 15, 0, 0, seed=2, version=1)
+    field = PathField(grid)
+    ex, ey = maze_gen.last_cell(15, 15)
+    field.set_passable(ex, ey, False)
+    assert all(d == UNREACHABLE for d in field.dist)
+    field.set_passable(ex, ey, True)
+    assert field.dist == PathField(grid).dist
+
+
+def test_dump_and_restore():
+    grid, _ = maze_gen.generate(31, 41, 20, 0, seed=9, version=1)
+    field = PathField(grid)
+    restored = PathField(grid, built=field.dump())
+    assert restored.dist == field.dist
+    assert restored.adj == field.adj
+    assert restored.exit == field.exit
+    # keeps working incrementally like the original
+    x, y = field.next_step(1, 1)[1:]
+    field.set_passable(x, y, False)
+    restored.set_passable(x, y, False)
+    assert restored.dist == field.dist
+
+
+def test_restore_wrong_size():
+    grid, _ = maze_gen.generate(21, 21, 0, 0, seed=1, version=1)
+    other, _ = maze_gen.generate(21, 31, 0, 0, seed=1, version=1)
+    with pytest.raises(ValueError):
+        PathField(grid, built=PathField(other).dump())
@@ -0,0 +1,40 @@
+from collections import deque
+
+import pytest
+
+from grid import Grid
+
+client_pygame = pytest.importorskip("client_pygame")
+
+# a corridor along the top row, walls everywhere else
+#   1 1 1 1 1
+#   1 0 0 0 1
+#   1 1 1 1 1
+CORRIDOR = Grid.from_rows([[1, 1, 1, 1, 1], [1, 0, 0, 0, 1], [1, 1, 1, 1, 1]])
+
+
+def test_predict_stops_at_walls():
+    assert client_pygame.predict(CORRIDOR, 1, 1, 1, 0) == (2, 1)
+    assert client_pygame.predict(CORRIDOR, 1, 1, 0, 1) == (1, 1)
+    assert client_pygame.predict(CORRIDOR, 3, 1, 1, 0) == (3, 1)
+
+
+def test_reconcile_replays_unacked_moves():
+    pending = deque([(1, 1, 0), (2, 1, 0), (3, -1, 0)])
+    # the server took the first move only, the other two go on top of it
+    assert client_pygame.reconcile(CORRIDOR, pending, 1, 2, 1) == (2, 1)
+    assert list(pending) == [(2, 1, 0), (3, -1, 0)]
+    # a door bounced the second move back: we're at 2,1 and replay the third
+    assert client_pygame.reconcile(CORRIDOR, pending, 2, 2, 1) == (1, 1)
+    assert list(pending) == [(3, -1, 0)]
+    # an ACK we already had changes nothing
+    assert client_pygame.reconcile(CORRIDOR, pending, 2, 2, 1) is None
+
+
+def test_glide():
+    glide = client_pygame.Glide(1, 1, 0.0)
+    glide.move(2, 1, 10.0)
+    assert glide.at(10.0) == (1, 1)
+    assert glide.at(10.0 + client_pygame.INTERP_SECONDS / 2) == pytest.approx((1.5, 1))
+    assert glide.at(11.0) == (2, 1)
+
@@ -0,0 +1,127 @@
+import protocol
+from grid import Grid
+
+
+def one_frame(data):
+    frames = protocol.FrameReader().feed(data)
+    assert len(frames) == 1
+    return frames[0]
+
+
+def test_update_round_trip():
+    tiles = [(0, 0, 0), (5, 7, 3), (protocol.MAX_COORD, protocol.MAX_COORD, 15)]
+    gone = ["p1", "p400"]
+    moved = [("p2", 1, 1), ("p70000", 65535, 0)]
+    msg_type, payload = one_frame(protocol.binary_update(tiles, True, gone, moved))
+    assert msg_type == protocol.MSG_UPDATE
+    assert protocol.decode_update(payload) == (True, tiles, gone, moved)
+
+    _, payload = one_frame(protocol.binary_update([], False, [], [("p3", 4, 5)]))
+    assert protocol.decode_update(payload) == (False, [], [], [("p3", 4, 5)])
+
+
+def test_update_with_more_tiles_than_one_frame_counts():
+    tiles = [(i % 1000, i // 1000, i % 16) for i in range(70000)]
+    data = protocol.binary_update(tiles, True, ["p1"], [("p2", 1, 1)], 9)
+    frames = protocol.FrameReader().feed(data)
+    assert len(frames) == 2
+    first, last = (protocol.decode_update(payload) for _, payload in frames)
+    assert first == (False, tiles[:protocol.MAX_COUNT], [], [])
+    assert last == (True, tiles[protocol.MAX_COUNT:], ["p1"], [("p2", 1, 1)])
+    assert protocol.decode_tile_version(frames[0][1]) is None
+    assert protocol.decode_tile_version(frames[1][1]) == 9
+
+
+def test_welcome_round_trip():
+    _, payload = one_frame(protocol.binary_welcome(1, "p12", 1, 3))
+    assert protocol.decode_welcome(payload)[:4] == (1, "p12", 1, 3)
+
+
+def test_maze_round_trip():
+    # odd cell count, the last nibble is padding
+    grid = Grid(5, 7, data=bytearray(i % 5 for i in range(35)))
+    _, payload = one_frame(protocol.binary_maze(5, 7, grid.data))
+    decoded = protocol.decode_maze(payload)
+    assert (decoded.rows, decoded.cols) == (5, 7)
+    assert decoded.data == grid.data
+
+
+def test_frames_cut_across_reads():
+    data = protocol.binary_update([(1, 2, 3)], False, [], []) + protocol.binary_welcome(1, "p1", 1, 1)
+    reader = protocol.FrameReader()
+    frames = []
+    for i in range(len(data)):
+        frames += reader.feed(data[i:i + 1])
+    assert [t for t, _ in frames] == [protocol.MSG_UPDATE, protocol.MSG_WELCOME]
+    assert not reader.buf
+
+
+def test_negotiate():
+    assert protocol.negotiate("JOIN".split()) == 0
+    assert protocol.negotiate("JOIN BIN".split()) == 1
+    assert protocol.negotiate("JOIN BIN 2".split()) == 2
+    assert protocol.negotiate("JOIN BIN 99".split()) == protocol.PROTOCOL_VERSION
+    assert protocol.negotiate("JOIN BIN x".split()) == 0
+
+
+def test_compressed_maze_round_trips():
+    grid = Grid(5, 7, data=bytearray(i % 5 for i in range(35)))
+    compressed = protocol.compress_cells(grid.data)
+    _, payload = one_frame(protocol.binary_maze_z(5, 7, compressed))
+    assert protocol.decode_maze_z(payload).data == grid.data
+    line = protocol.text_maze(5, 7, compressed).decode()
+    assert line.endswith("\n") and line.count("\n") == 1
+    assert protocol.decode_text_maze(line.strip()).data == grid.data
+
+
+def test_maze_seed_round_trips():
+    seed = (2 ** 63 - 1, 501, 501, 2, 10, 300)
+    _, payload = one_frame(protocol.binary_maze_seed(*seed))
+    assert protocol.decode_maze_seed(payload) == seed
+    line = protocol.text_maze_seed(*seed).decode().strip()
+    assert protocol.decode_text_maze_seed(line) == seed
+
+
+def test_parse_join():
+    assert protocol.parse_join("JOIN".split()) == (None, 0, ())
+    assert protocol.parse_join("JOIN lobby BIN 2 GEN 1,2".split()) == ("lobby", 2, (1, 2))
+    assert protocol.parse_join("JOIN GEN 1".split()) == (None, 0, (1,))
+    assert protocol.parse_join("JOIN GEN x".split()) == (None, 0, ())
+
+
+def test_hint_round_trip():
+    _, payload = one_frame(protocol.binary_hint("LEFT", 42))
+    assert protocol.decode_hint(payload) == ("LEFT", 42)
+    _, payload = one_frame(protocol.binary_hint("NONE", -1))
+    assert protocol.decode_hint(payload) == ("NONE", -1)
+
+
+def test_ack_round_trip():
+    _, payload = one_frame(protocol.binary_ack(protocol.SEQ_LIMIT - 1, 3, 9))
+    assert protocol.decode_ack(payload) == (protocol.SEQ_LIMIT - 1, 3, 9)
+    assert protocol.text_ack(17, 3, 9) == b"ACK 17 3 9\n"
+    assert protocol.parse_seq("17") == 17
+    assert protocol.parse_seq(str(protocol.SEQ_LIMIT + 1)) == 1
+    assert protocol.parse_seq("x") is None
+
+
+def test_session_round_trips():
+    _, payload = one_frame(protocol.binary_welcome(3, "p12", 1, 1, "00000000deadbeef", 42))
+    assert protocol.decode_welcome(payload) == (3, "p12", 1, 1, "00000000deadbeef", 42)
+    # version 2 clients don't get the session
+    _, payload = one_frame(protocol.binary_welcome(2, "p12", 1, 1, "00000000deadbeef", 42))
+    assert protocol.decode_welcome(payload) == (2, "p12", 1, 1, None, 0)
+
+    tiles = [(5, 7, 3)]
+    _, payload = one_frame(protocol.binary_update(tiles, False, [], [], 123))
+    assert protocol.decode_update(payload) == (False, tiles, [], [])
+    assert protocol.decode_tile_version(payload) == 123
+    _, payload = one_frame(protocol.binary_update(tiles, False, [], []))
+    assert protocol.decode_tile_version(payload) is None
+    assert b"TILEVER 123\n" in protocol.text_update(tiles, False, [], [], 123)
+
+
+def test_parse_resume():
+    assert protocol.parse_resume("RESUME abc 17 BIN 3 GEN 1".split()) == ("abc", 17, 3, (1,))
+    assert protocol.parse_resume("RESUME abc".split()) == (None, 0, 0, ())
+    assert protocol.parse_resume("RESUME".split()) == (None, 0, 0, ())
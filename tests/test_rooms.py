@@ -0,0 +1,99 @@
+import time
+
+from rooms import RoomManager
+
+
+def manager(**kwargs):
+    opened, closed = [], []
+    rooms = RoomManager(
+        lambda name: f"state of {name}",
+        on_open=opened.append, on_close=closed.append, **kwargs)
+    return rooms, opened, closed
+
+
+def test_matchmaking_fills_rooms():
+    rooms, opened, closed = manager(capacity=2)
+    a, b, c = rooms.join(), rooms.join(), rooms.join()
+    assert a is b and c is not a
+    assert [room.name for room in opened] == ["room1", "room2"]
+    assert rooms.join("lobby").state == "state of lobby"
+    rooms.leave(c)
+    assert closed == [c]
+    assert rooms.join() is not c
+
+
+def test_no_sessions_without_grace():
+    rooms, _, _ = manager()
+    assert rooms.open_session(rooms.join(), "p1", "conn") is None
+
+
+def test_claim_detach_expire():
+    rooms, _, closed = manager(grace=30)
+    room = rooms.join()
+    token = rooms.open_session(room, "p1", "conn1")
+
+    # the connection drops, the player waits for a RESUME
+    assert rooms.detach(token, "conn1")
+    session, old = rooms.claim(token, "conn2")
+    assert (session.room, session.pid, old) == (room, "p1", None)
+    assert session.conn == "conn2" and session.expires is None
+
+    # a RESUME while the server still thinks the old connection is up
+    session, old = rooms.claim(token, "conn3")
+    assert old == "conn2"
+    # the old connection going away later doesn't detach the new one
+    assert rooms.detach(token, "conn2")
+    assert session.conn == "conn3"
+
+    assert rooms.detach(token, "conn3")
+    now = time.monotonic()
+    assert rooms.expire(now) == []
+    assert rooms.expire(now + 31) == [session]
+    assert rooms.claim(token, "conn4") == (None, None)
+    # the caller removes the player, its room closes as usual
+    rooms.leave(room)
+    assert closed == [room]
+
+
+def test_unknown_token():
+    rooms, _, _ = manager(grace=30)
+    assert rooms.claim("nope", "conn") == (None, None)
+    assert not rooms.detach("nope", "conn")
+
+
+def test_quit_ends_the_session():
+    rooms, _, _ = manager(grace=30)
+    token = rooms.open_session(rooms.join(), "p1", "conn1")
+    rooms.end_session(token)
+    assert not rooms.detach(token, "conn1")
+    assert rooms.claim(token, "conn2") == (None, None)
+
+
+def test_join_async_builds_off_the_loop():
+    import asyncio
+    import threading
+
+    built = []
+    opened = []
+
+    def make_state(name):
+        built.append(threading.current_thread())
+        time.sleep(0.05)
+        return name
+
+    rooms = RoomManager(make_state, on_open=opened.append, on_close=lambda room: None)
+
+    async def main():
+        ticks = 0
+        joins = asyncio.gather(*(rooms.join_async("a") for _ in range(3)))
+        while not joins.done():
+            ticks += 1
+            await asyncio.sleep(0.005)
+        return await joins, ticks
+
+    joined, ticks = asyncio.run(main())
+    # one room for everyone, the loop kept running while it was built
+    assert len(set(map(id, joined))) == 1 and joined[0].members == 3
+    assert opened == [joined[0]]
+    assert threading.main_thread() not in built
+    assert ticks > 3
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from scheduler import MoveScheduler
+
+RIGHT = (1, 0, None)
+
+
+def test_admit_spends_the_budget():
+    scheduler = MoveScheduler(rate=10, burst=3)
+    now = 100.0
+    moves = [RIGHT, RIGHT, (1, 0, 1), (1, 0, 2), (1, 0, 5)]
+    kept, seq = scheduler.admit("p1", moves, now)
+    # the newest dropped seq goes to the last move that is applied
+    assert kept == [RIGHT, RIGHT, (1, 0, 5)]
+    assert seq is None
+    # spent: everything is dropped, the caller acks seq itself
+    assert scheduler.admit("p1", [(1, 0, 6)], now) == ([], 6)
+    # 0.15s at 10 moves a second buys one more
+    assert scheduler.admit("p1", [RIGHT, RIGHT], now + 0.15) == ([RIGHT], None)
+
+
+def test_budget_refills_up_to_burst():
+    scheduler = MoveScheduler(rate=10, burst=3)
+    scheduler.admit("p1", [RIGHT] * 3, 100.0)
+    kept, _ = scheduler.admit("p1", [RIGHT] * 10, 200.0)
+    assert len(kept) == 3
+
+
+def test_no_rate_no_budget():
+    scheduler = MoveScheduler(rate=0)
+    moves = [RIGHT] * 100
+    assert scheduler.admit("p1", moves) == (moves, None)
+
+
+def test_round_robin():
+    scheduler = MoveScheduler(rate=0)
+    scheduler.push("p1", [(1, 0, 1), (1, 0, 2), (1, 0, 3)])
+    scheduler.push("p2", [(0, 1, 7)])
+    # one move each per round, whoever still has some goes on
+    assert [(pid, seq) for pid, _, _, seq in scheduler.take()] == [
+        ("p1", 1), ("p2", 7), ("p1", 2), ("p1", 3)]
+    assert scheduler.take() == []
+
+
+def test_first_turn_rotates():
+    scheduler = MoveScheduler(rate=0)
+    firsts = []
+    for _ in range(2):
+        scheduler.push("p1", [RIGHT])
+        scheduler.push("p2", [RIGHT])
+        firsts.append(scheduler.take()[0][0])
+    assert firsts == ["p1", "p2"]
+
+
+def test_moves_over_the_budget_wait_for_later_ticks():
+    scheduler = MoveScheduler(rate=10, burst=2)
+    scheduler.push("p1", [RIGHT] * 5)
+    now = time.monotonic()
+    assert len(scheduler.take(now)) == 2
+    assert scheduler.depths() == {"p1": 3}
+    assert len(scheduler.take(now + 0.15)) == 1
+    assert scheduler.depths() == {"p1": 2}
+
+
+def test_queue_limit_drops_and_carries_the_seq():
+    scheduler = MoveScheduler(rate=0, max_queued=3)
+    scheduler.push("p1", [RIGHT, RIGHT, RIGHT, (1, 0, 4), (1, 0, 5)])
+    assert [seq for _, _, _, seq in scheduler.take()] == [None, None, 5]
+    # a full queue: the newest queued move takes the seq of the dropped ones
+    scheduler.push("p1", [RIGHT] * 3)
+    scheduler.push("p1", [(1, 0, 9)])
+    assert [seq for _, _, _, seq in scheduler.take()] == [None, None, 9]
+
+
+def test_backoff():
+    scheduler = MoveScheduler(rate=10, burst=1, max_queued=2)
+    assert scheduler.backoff("p1") == 0.0
+    scheduler.push("p1", [RIGHT])
+    assert scheduler.backoff("p1") == 0.0
+    scheduler.push("p1", [RIGHT])
+    # full queue, wait for a token
+    assert scheduler.backoff("p1") > 0.0
+    scheduler.remove("p1")
+    assert scheduler.backoff("p1") == 0.0
+    assert scheduler.depths() == {}
+
+
+def test_immediate_mode_backoff_once_spent():
+    scheduler = MoveScheduler(rate=10, burst=1)
+    now = time.monotonic()
+    scheduler.admit("p1", [RIGHT], now)
+    assert scheduler.backoff("p1", now) == pytest.approx(0.1)
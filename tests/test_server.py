@@ -0,0 +1,39 @@
+import maze_gen
+from server import GameState, drop_dead
+
+
+def new_state(**kwargs):
+    maze, doors = maze_gen.generate(21, 21, 5, 5, seed=7, version=1)
+    return GameState(21, 21, maze, doors, origin=(7, 1, 5, 5), **kwargs)
+
+
+def test_tiles_since():
+    state = new_state()
+    v1 = state.log_tiles([(1, 1, 4), (3, 1, 4)])
+    v2 = state.log_tiles([(1, 1, 0)])
+    assert (v1, v2) == (1, 2)
+    assert sorted(state.tiles_since(0)) == [(1, 1, 0), (3, 1, 4)]
+    assert state.tiles_since(v1) == ((1, 1, 0),)
+    assert state.tiles_since(v2) == ()
+
+
+class Conn:
+    # what drop_dead looks at
+    def __init__(self, session):
+        self.session = session
+
+
+def test_dropped_conn_keeps_the_player_but_not_its_moves():
+    state = new_state(tick_hz=20)
+    kept, _, _ = state.add_player()
+    gone, _, _ = state.add_player()
+    state.conns[kept] = Conn("token")
+    state.conns[gone] = Conn(None)
+    state.queue_moves(kept, [(1, 0, None)] * 3)
+    state.queue_moves(gone, [(1, 0, None)] * 3)
+
+    drop_dead(state, list(state.conns.items()))
+    # with a session the player waits for a RESUME, without one it's gone
+    assert kept in state.players and gone not in state.players
+    assert state.conns == {}
+    assert state.take_moves() == []
@@ -0,0 +1,90 @@
+from spatial import InterestManager
+
+
+class Room:
+    # the bits of GameState collect() works with
+    def __init__(self, cell_size=10):
+        self.interest = InterestManager(cell_size)
+        self.players = {}
+        self.dirty = set()
+
+    def add(self, pid, x, y):
+        self.players[pid] = [x, y]
+        self.interest.add(pid, x, y)
+        self.interest.reset_view(pid)
+        self.dirty.add(pid)
+
+    def move(self, pid, x, y):
+        ox, oy = self.players[pid]
+        self.players[pid] = [x, y]
+        self.interest.move(pid, ox, oy, x, y)
+        self.dirty.add(pid)
+
+    def remove(self, pid):
+        x, y = self.players.pop(pid)
+        self.interest.remove(pid, x, y)
+        return self.collect(gone={pid})
+
+    def collect(self, tiles=(), gone=(), keyframe=False):
+        out = self.interest.collect(self.players, self.dirty, set(gone), list(tiles), keyframe)
+        self.dirty = set()
+        return out
+
+
+def test_far_players_dont_hear_about_each_other():
+    room = Room()
+    room.add("p1", 1, 1)
+    room.add("p2", 60, 60)
+    out = room.collect()
+    assert out["p1"].moved == {"p1": (1, 1)}
+    assert out["p2"].moved == {"p2": (60, 60)}
+
+
+def test_enter_and_leave():
+    room = Room()
+    room.add("p1", 1, 1)
+    room.add("p2", 60, 60)
+    room.collect()
+
+    room.move("p2", 5, 5)
+    out = room.collect()
+    # both sides get a POS for the other, that's the enter event
+    assert out["p1"].moved == {"p2": (5, 5)}
+    assert out["p2"].moved == {"p2": (5, 5), "p1": (1, 1)}
+
+    room.move("p2", 60, 60)
+    out = room.collect()
+    assert out["p1"].gone == {"p2"}
+    assert out["p2"].gone == {"p1"}
+
+    room.move("p2", 5, 5)
+    room.collect()
+    out = room.remove("p2")
+    assert out["p1"].gone == {"p2"}
+
+
+def test_tiles_missed_far_away_are_replayed():
+    room = Room()
+    room.add("p1", 1, 1)
+    room.add("p2", 55, 55)
+    room.collect()
+
+    out = room.collect(tiles=[(56, 56, 4)])
+    assert out["p2"].tiles == [(56, 56, 4)]
+    assert "p1" not in out
+
+    room.move("p1", 45, 45)
+    out = room.collect()
+    assert (56, 56, 4) in out["p1"].tiles
+
+
+def test_keyframe_lists_only_the_players_in_range():
+    room = Room()
+    room.add("p1", 1, 1)
+    room.add("p2", 5, 5)
+    room.add("p3", 60, 60)
+    room.collect()
+    out = room.collect(keyframe=True)
+    assert out["p1"].keyframe
+    assert out["p1"].moved == {"p1": (1, 1), "p2": (5, 5)}
+    assert out["p3"].moved == {"p3": (60, 60)}